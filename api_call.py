@@ -1,8 +1,10 @@
 import requests
 import os
+import sys
 
 
 url = "http://127.0.0.1:8000/process_data"
+batch_url = "http://127.0.0.1:8000/process_data/batch"
 
 
 headers = {
@@ -14,8 +16,20 @@ params_high = {'qualityquery': 'high'}
 params_low = {'qualityquery': 'low'}
 
 
+def fetch_batch(session, qualities=('high', 'low')):
+    # One round trip for every quality level; the session keeps the connection alive
+    response = session.get(batch_url, params={'qualityquery': list(qualities)})
+    response.raise_for_status()
+    return response.json()
+
+
 if __name__ == "__main__":
-    response = requests.get(url, headers=headers, params=params_high)
-    print(response.json())
-    response = requests.get(url, headers=headers, params=params_low)
-    print(response.json())
\ No newline at end of file
+    if '--batch' in sys.argv:
+        with requests.Session() as session:
+            session.headers.update(headers)
+            print(fetch_batch(session))
+    else:
+        response = requests.get(url, headers=headers, params=params_high)
+        print(response.json())
+        response = requests.get(url, headers=headers, params=params_low)
+        print(response.json())
@@ -1,36 +1,113 @@
-import boto3
 import zipfile
 import os
 import logging
 import json
 import uuid
-import pandas as pd
-from io import StringIO
+import gzip
+import hashlib
+import mimetypes
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
 
 region = 'eu-north-1'
 bucket_name = 'dataka'
 files = ['winequality-red.csv', 'winequality-white.csv']
 lambda_name = 'process_csv_lambda'
+# Modules packaged into the Lambda deployment zip
+lambda_sources = ['lambda_function.py', 'wine_loader.py', 'quality_kernel.py', 'quality_aggregates.py',
+                  'lambda_metrics.py', 's3_ranges.py', 'results_manifest.py']
+# Lean deployment: stdlib-only handler, no pandas layer
+lean_lambda_sources = ['lambda_lean.py', 'results_manifest.py']
+lean_lambda_handler = 'lambda_lean.lambda_handler'
 secret_name = 'secret'
-
-# Initialize the clients
-s3_client = boto3.client('s3', region_name=region)
-lambda_client = boto3.client('lambda', region_name=region)
-secrets_manager_client = boto3.client('secretsmanager', region_name=region)
+# Source suffixes the pipeline ingests; mirrors wine_loader.SOURCE_FORMATS, which
+# is not imported here to keep pandas out of the deployment scripts
+source_suffixes = ['.csv', '.csv.gz', '.csv.zst', '.parquet']
+
+# Bulk upload tuning
+UPLOAD_MAX_WORKERS = 8
+MULTIPART_THRESHOLD = 8 * 1024 * 1024
+MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+UPLOAD_PART_CONCURRENCY = 4
+# Content-Type by suffix for formats mimetypes does not know (or guesses as an encoding)
+CONTENT_TYPES = {
+    '.csv': 'text/csv',
+    '.parquet': 'application/vnd.apache.parquet',
+    '.gz': 'application/gzip',
+    '.zst': 'application/zstd',
+}
 
 # ARN for the AWSSDKPandas-Python38 Lambda layer
 LAYER_ARN = f'arn:aws:lambda:eu-north-1:336392948345:layer:AWSSDKPandas-Python38:29'  # Update the ARN if necessary
 
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def content_type(path):
+    """Content-Type of a file by suffix, falling back to application/octet-stream."""
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix in CONTENT_TYPES:
+        return CONTENT_TYPES[suffix]
+    guessed, encoding = mimetypes.guess_type(path)
+    return guessed if guessed and encoding is None else 'application/octet-stream'
+
+
+def get_client(service, region_name=region):
+    """Create a boto3 client on first use and reuse it afterwards.
+
+    boto3 itself is imported here so importing this module stays cheap.
+    """
+    with _clients_lock:
+        client = _clients.get((service, region_name))
+        if client is None:
+            import boto3
+            client = _clients[(service, region_name)] = boto3.client(service, region_name=region_name)
+        return client
+
+
 class S3Utils:
-    def __init__(self, bucket_name: str, s3_client=None, region=region):
+    """Deployment helpers. Clients are created lazily and nothing touches the network
+    until a method needs it; call ``create_s3_bucket`` to provision the bucket."""
+
+    def __init__(self, bucket_name: str, s3_client=None, region=region,
+                 lambda_client=None, secrets_manager_client=None, sqs_client=None):
         self.bucket_name = bucket_name
-        self.s3_client = s3_client or boto3.client('s3', region_name=region)
-        self.lambda_client = lambda_client or boto3.client('lambda', region_name=region)
-        self.secrets_manager_client = secrets_manager_client or boto3.client('secretsmanager', region_name=region)
-        self.sqs_client = boto3.client('sqs', region_name=region)  # Initialize SQS client
-        self.create_s3_bucket()
+        self.region = region
+        self._clients = {
+            's3': s3_client,
+            'lambda': lambda_client,
+            'secretsmanager': secrets_manager_client,
+            'sqs': sqs_client,
+        }
+        self._secrets = {}
         self.queue_url = None
 
+    def _client(self, service):
+        if self._clients[service] is None:
+            self._clients[service] = get_client(service, self.region)
+        return self._clients[service]
+
+    @property
+    def s3_client(self):
+        return self._client('s3')
+
+    @property
+    def lambda_client(self):
+        return self._client('lambda')
+
+    @property
+    def secrets_manager_client(self):
+        return self._client('secretsmanager')
+
+    @property
+    def sqs_client(self):
+        return self._client('sqs')
+
     def list_s3_buckets(self):
         response = self.s3_client.list_buckets()
         print("S3 Buckets:")
@@ -47,6 +124,9 @@ class S3Utils:
             print("No buckets found!")
 
     def get_secret(self, secret_name):
+        # Successful lookups are memoized; failures are retried on the next call
+        if secret_name in self._secrets:
+            return self._secrets[secret_name]
         try:
             response = self.secrets_manager_client.get_secret_value(SecretId=secret_name)
             # Parse the secret value from JSON string
@@ -54,6 +134,7 @@ class S3Utils:
             account_id = secret['AWS_ACCOUNT_ID']
             role_arn = secret['LAMBDA_ROLE_ARN']
             print(f"AWS Account ID: {account_id}, Lambda Role ARN: {role_arn}")
+            self._secrets[secret_name] = account_id, role_arn
             return account_id, role_arn
         except Exception as e:
             print(f"Error retrieving secret: {e}")
@@ -67,7 +148,7 @@ class S3Utils:
             try:
                 response = self.s3_client.create_bucket(
                     Bucket=self.bucket_name,
-                    CreateBucketConfiguration={'LocationConstraint': region}
+                    CreateBucketConfiguration={'LocationConstraint': self.region}
                 )
                 print(f"Bucket {self.bucket_name} created successfully!")
                 return response
@@ -82,10 +163,10 @@ class S3Utils:
         file_key = event['Records'][0]['s3']['object']['key']
 
         try:
+            # Imported here so deployment scripts do not pay for pandas
+            from wine_loader import read_wine_csv
             file_obj = self.s3_client.get_object(Bucket=bucket_name, Key=file_key)
-            file_content = file_obj['Body'].read().decode('utf-8').splitlines()
-            
-            df = pd.read_csv(StringIO("\n".join(file_content)))
+            df = read_wine_csv(file_obj['Body'].read())
             print(df.head())
 
             return {
@@ -99,7 +180,8 @@ class S3Utils:
                 'body': json.dumps(f"Error processing file {file_key}")
             }
 
-    def create_lambda_function(self, function_name, role_arn, zip_file):
+    def create_lambda_function(self, function_name, role_arn, zip_file,
+                               handler='lambda_function.lambda_handler', layers=(LAYER_ARN,)):
         try:
             with open(zip_file, 'rb') as f:
                 zipped_code = f.read()
@@ -109,21 +191,23 @@ class S3Utils:
                 FunctionName=function_name,
                 Runtime='python3.8',
                 Role=role_arn,
-                Handler='lambda_function.lambda_handler',
+                Handler=handler,
                 Code=dict(ZipFile=zipped_code),
                 Timeout=300,
-                Layers=[LAYER_ARN],  # Attach the AWSSDKPandas-Python38 layer
+                Layers=list(layers),  # AWSSDKPandas-Python38 layer unless deploying the lean handler
             )
             print(f"Lambda function {function_name} created successfully.")
         except Exception as e:
             print(f"Error creating Lambda function: {e}")
 
-    def zip_lambda_function(self, zip_file, source_file):
+    def zip_lambda_function(self, zip_file, source_file, extra_files=()):
         with zipfile.ZipFile(zip_file, 'w') as z:
-            z.write(source_file, os.path.basename(source_file))
+            for path in [source_file, *extra_files]:
+                z.write(path, os.path.basename(path))
 
-    def add_s3_trigger(self, lambda_function_name, aws_account_id, region):
+    def add_s3_trigger(self, lambda_function_name, aws_account_id, region, suffixes=source_suffixes):
         lambda_arn = f'arn:aws:lambda:{region}:{aws_account_id}:function:{lambda_function_name}'
+        # S3 allows one suffix rule per configuration, so add one per source format
         notification = {
             'LambdaFunctionConfigurations': [
                 {
@@ -134,7 +218,7 @@ class S3Utils:
                             'FilterRules': [
                                 {
                                     'Name': 'suffix',
-                                    'Value': '.csv'  # Only trigger for .csv files
+                                    'Value': suffix  # Only trigger for source files
                                 },
                                 {
                                     'Name': 'prefix',
@@ -144,6 +228,7 @@ class S3Utils:
                         }
                     }
                 }
+                for suffix in suffixes
             ]
         }
 
@@ -167,14 +252,98 @@ class S3Utils:
             print(f"Error adding trigger: {e}")
 
 
-    def upload_files_to_s3(self, files):
-        for file in files:
-            file_key = os.path.basename(file)
-            try:
-                self.s3_client.upload_file(file, self.bucket_name, file_key)
-                print(f"File uploaded successfully to {self.bucket_name}/{file_key}")
-            except Exception as e:
-                print(f"Error uploading file {file}: {e}")
+    @staticmethod
+    def local_etag(fileobj, multipart_threshold=MULTIPART_THRESHOLD, multipart_chunksize=MULTIPART_CHUNKSIZE):
+        """Compute the ETag S3 will report for this content when uploaded with the given settings."""
+        fileobj.seek(0, os.SEEK_END)
+        size = fileobj.tell()
+        fileobj.seek(0)
+        if size < multipart_threshold:
+            digest = hashlib.md5()
+            for block in iter(lambda: fileobj.read(1024 * 1024), b''):
+                digest.update(block)
+            fileobj.seek(0)
+            return f'"{digest.hexdigest()}"'
+        part_digests = []
+        for part in iter(lambda: fileobj.read(multipart_chunksize), b''):
+            part_digests.append(hashlib.md5(part).digest())
+        fileobj.seek(0)
+        return f'"{hashlib.md5(b"".join(part_digests)).hexdigest()}-{len(part_digests)}"'
+
+    def remote_etag_and_size(self, key):
+        try:
+            response = self.s3_client.head_object(Bucket=self.bucket_name, Key=key)
+        except ClientError:
+            return None, None
+        return response['ETag'], response['ContentLength']
+
+    def _upload_one(self, file, transfer_config, skip_unchanged, compress):
+        file_key = os.path.basename(file) + ('.gz' if compress else '')
+        report = {'file': file, 'key': file_key, 'source_bytes': os.path.getsize(file)}
+        start = time.perf_counter()
+        try:
+            with tempfile.SpooledTemporaryFile(max_size=MULTIPART_CHUNKSIZE) as compressed, open(file, 'rb') as source:
+                if compress:
+                    # mtime=0 keeps the gzip bytes (and so the ETag) stable across runs
+                    with gzip.GzipFile(fileobj=compressed, mode='wb', mtime=0) as gz:
+                        shutil.copyfileobj(source, gz)
+                    body = compressed
+                else:
+                    body = source
+                body.seek(0, os.SEEK_END)
+                report['bytes'] = body.tell()
+                body.seek(0)
+
+                if skip_unchanged:
+                    etag = self.local_etag(body, transfer_config.multipart_threshold, transfer_config.multipart_chunksize)
+                    if self.remote_etag_and_size(file_key) == (etag, report['bytes']):
+                        report.update(status='skipped', seconds=round(time.perf_counter() - start, 4), throughput_mb_s=None)
+                        return report
+
+                # Compressed uploads keep the source type and declare the gzip encoding
+                extra_args = {'ContentType': content_type(file)}
+                if compress:
+                    extra_args['ContentEncoding'] = 'gzip'
+                self.s3_client.upload_fileobj(body, self.bucket_name, file_key, ExtraArgs=extra_args, Config=transfer_config)
+            seconds = time.perf_counter() - start
+            report.update(
+                status='uploaded',
+                seconds=round(seconds, 4),
+                throughput_mb_s=round(report['bytes'] / seconds / 1e6, 2) if seconds > 0 else None,
+            )
+        except Exception as e:
+            report.update(status='failed', error=str(e), seconds=round(time.perf_counter() - start, 4), throughput_mb_s=None)
+        return report
+
+    def bulk_upload_files(self, files, max_workers=UPLOAD_MAX_WORKERS, multipart_threshold=MULTIPART_THRESHOLD,
+                          multipart_chunksize=MULTIPART_CHUNKSIZE, part_concurrency=UPLOAD_PART_CONCURRENCY,
+                          skip_unchanged=True, compress=False):
+        """Upload files concurrently and return one report dict per file.
+
+        Files whose local MD5/size already matches the remote ETag are skipped.
+        With ``compress`` each file is gzipped on the fly and stored as ``<name>.gz``.
+        """
+        from boto3.s3.transfer import TransferConfig
+        transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_chunksize,
+            max_concurrency=part_concurrency,
+            use_threads=True,
+        )
+        if not files:
+            return []
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(files))) as executor:
+            return list(executor.map(
+                lambda file: self._upload_one(file, transfer_config, skip_unchanged, compress), files
+            ))
+
+    def upload_files_to_s3(self, files, **options):
+        report = self.bulk_upload_files(files, **options)
+        counts = {}
+        for entry in report:
+            counts[entry['status']] = counts.get(entry['status'], 0) + 1
+        print(f"Upload to {self.bucket_name}: " + ", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
+        return report
 
     def create_sqs_queue(self, queue_name):
         try:
@@ -244,12 +413,17 @@ class S3Utils:
                                 'FilterRules': [
                                     {
                                         'Name': 'suffix',
-                                        'Value': '.csv'
+                                        'Value': suffix
+                                    },
+                                    {
+                                        'Name': 'prefix',
+                                        'Value': 'winequality-'  # Skip the pipeline's own Parquet outputs
                                     }
                                 ]
                             }
                         }
                     }
+                    for suffix in source_suffixes
                 ]
             }
             
@@ -265,6 +439,9 @@ class S3Utils:
 if __name__ == '__main__':
     s3_utils = S3Utils(bucket_name)
 
+    # Provision the bucket explicitly; constructing S3Utils makes no AWS calls
+    s3_utils.create_s3_bucket()
+
     # List S3 buckets
     s3_utils.list_s3_buckets()
 
@@ -275,14 +452,21 @@ if __name__ == '__main__':
     account_id, role_arn = s3_utils.get_secret(secret_name)
 
     if account_id and role_arn:
-        # Zip the Lambda function
-        s3_utils.zip_lambda_function('lambda_function.zip', 'lambda_function.py')
+        if os.getenv('LAMBDA_LEAN') == '1':
+            # Zip and create the pandas-free handler without the pandas layer
+            s3_utils.zip_lambda_function('lambda_function.zip', lean_lambda_sources[0], extra_files=lean_lambda_sources[1:])
+            s3_utils.create_lambda_function(lambda_name, role_arn, 'lambda_function.zip',
+                                            handler=lean_lambda_handler, layers=())
+        else:
+            # Zip the Lambda function
+            s3_utils.zip_lambda_function('lambda_function.zip', lambda_sources[0], extra_files=lambda_sources[1:])
 
-        # Create Lambda function
-        s3_utils.create_lambda_function(lambda_name, role_arn, 'lambda_function.zip')
+            # Create Lambda function
+            s3_utils.create_lambda_function(lambda_name, role_arn, 'lambda_function.zip')
 
-        # Add the trigger to the S3 bucket
-        s3_utils.add_s3_trigger(lambda_name, account_id, region)
+        # Add the trigger to the S3 bucket; the lean handler only reads plain CSV
+        trigger_suffixes = ['.csv'] if os.getenv('LAMBDA_LEAN') == '1' else source_suffixes
+        s3_utils.add_s3_trigger(lambda_name, account_id, region, suffixes=trigger_suffixes)
 
         # Upload files to the bucket
         s3_utils.upload_files_to_s3(files)
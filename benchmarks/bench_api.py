@@ -0,0 +1,138 @@
+"""DataProcessor.process_json_data latency and /process_data load through uvicorn, against moto.
+
+    python benchmarks/bench_api.py --requests 500 --concurrency 1,8,32
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_lambda import fake_aws_environment, REGION, BUCKET_NAME  # noqa: E402
+
+API_KEY = 'bench-api-key'
+
+
+def latency_summary(latencies, elapsed=None):
+    latencies = np.asarray(latencies)
+    summary = {
+        'requests': int(len(latencies)),
+        'p50_ms': round(float(np.percentile(latencies, 50)) * 1000, 3),
+        'p99_ms': round(float(np.percentile(latencies, 99)) * 1000, 3),
+        'mean_ms': round(float(latencies.mean()) * 1000, 3),
+    }
+    if elapsed:
+        summary['throughput_rps'] = round(len(latencies) / elapsed, 1)
+    return summary
+
+
+def seed_bucket(s3_client):
+    s3_client.create_bucket(Bucket=BUCKET_NAME, CreateBucketConfiguration={'LocationConstraint': REGION})
+    s3_client.put_object(Bucket=BUCKET_NAME, Key='high_quality_average.json', Body=b'{"high_average_quality": 7.16}')
+    s3_client.put_object(Bucket=BUCKET_NAME, Key='low_quality_average.json', Body=b'{"low_average_quality": 3.88}')
+
+
+def bench_process_json_data(fast_api, s3_client, iterations):
+    results = {}
+    for label, cache in (('uncached', None), ('cached', fast_api.ResultCache())):
+        processor = fast_api.DataProcessor(s3_client=s3_client, cache=cache)
+        latencies = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            processor.process_json_data('high_quality_average.json')
+            latencies.append(time.perf_counter() - start)
+        results[label] = latency_summary(latencies)
+    return results
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def load(url, total, concurrency):
+    import httpx
+
+    latencies = []
+    queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(None)
+
+    async def worker(client):
+        while not queue.empty():
+            queue.get_nowait()
+            start = time.perf_counter()
+            response = await client.get(url, params={'qualityquery': 'high'}, headers={'api-key': API_KEY})
+            latencies.append(time.perf_counter() - start)
+            response.raise_for_status()
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*[worker(client) for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+    return latency_summary(latencies, elapsed)
+
+
+def bench_endpoint(fast_api, total, concurrency_levels):
+    import uvicorn
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(fast_api.app, host='127.0.0.1', port=port, log_level='warning'))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    try:
+        url = f'http://127.0.0.1:{port}/process_data'
+        return {str(level): asyncio.run(load(url, total, level)) for level in concurrency_levels}
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+def run(requests=500, concurrency_levels=(1, 8, 32), iterations=200):
+    fake_aws_environment()
+    os.environ['API_KEY'] = API_KEY
+    import boto3
+    from moto import mock_aws
+
+    with mock_aws():
+        import fast_api
+        s3_client = boto3.client('s3', region_name=REGION)
+        seed_bucket(s3_client)
+        fast_api.RESULT_CACHE.clear()
+
+        # The endpoint builds its own processor, so keep the print in fetch_object out of the timings
+        with open(os.devnull, 'w') as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                process_json_data = bench_process_json_data(fast_api, s3_client, iterations)
+                endpoint = bench_endpoint(fast_api, requests, concurrency_levels)
+            finally:
+                sys.stdout = stdout
+
+    return {
+        'benchmark': 'api',
+        'process_json_data': process_json_data,
+        'process_data_endpoint': endpoint,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', default='1,8,32')
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+    levels = [int(level) for level in args.concurrency.split(',')]
+    print(json.dumps(run(args.requests, levels, args.iterations), indent=2))
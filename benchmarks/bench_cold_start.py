@@ -0,0 +1,91 @@
+"""Import-time / cold-start report for the full and lean Lambda handlers.
+
+Runs ``python -X importtime -c "import <module>"`` in fresh interpreters and
+reports the cumulative import time of the handler module plus its slowest
+dependencies. Also times importing aws_lambda and constructing S3Utils with
+the AWS endpoints pointed at an unroutable address, so any network call shows up.
+
+    python benchmarks/bench_cold_start.py
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HANDLER_MODULES = ['lambda_function', 'lambda_lean']
+
+
+def parse_importtime(stderr):
+    """Map module name -> (self_us, cumulative_us) from -X importtime output."""
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def import_profile(module, repeat):
+    env = dict(os.environ, AWS_DEFAULT_REGION=os.environ.get('AWS_DEFAULT_REGION', 'eu-north-1'))
+    runs = []
+    for _ in range(repeat):
+        completed = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+            cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+        )
+        runs.append(parse_importtime(completed.stderr))
+    best = min(runs, key=lambda times: times[module][1])
+    slowest = sorted(best.items(), key=lambda item: item[1][0], reverse=True)[:5]
+    return {
+        'module': module,
+        'import_ms': round(best[module][1] / 1000, 1),
+        'modules_imported': len(best),
+        'slowest_self_ms': {name: round(self_us / 1000, 1) for name, (self_us, _) in slowest},
+        'imports_pandas': 'pandas' in best,
+    }
+
+
+CONSTRUCT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import aws_lambda
+imported = time.perf_counter()
+aws_lambda.S3Utils(aws_lambda.bucket_name)
+constructed = time.perf_counter()
+print(json.dumps({'import_ms': (imported - start) * 1000, 'construct_ms': (constructed - imported) * 1000,
+                  'imports_boto3': 'boto3' in sys.modules, 'imports_pandas': 'pandas' in sys.modules}))
+"""
+
+
+def construct_profile(repeat):
+    # Any AWS call would hang on this endpoint until the connect timeout
+    env = dict(os.environ, AWS_DEFAULT_REGION='eu-north-1', AWS_ENDPOINT_URL='http://10.255.255.1:9')
+    runs = []
+    for _ in range(repeat):
+        completed = subprocess.run(
+            [sys.executable, '-c', CONSTRUCT_SCRIPT],
+            cwd=ROOT, env=env, capture_output=True, text=True, check=True, timeout=60,
+        )
+        runs.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    best = min(runs, key=lambda run: run['import_ms'] + run['construct_ms'])
+    return {key: round(value, 2) if isinstance(value, float) else value for key, value in best.items()}
+
+
+def run(repeat=5):
+    profiles = [import_profile(module, repeat) for module in HANDLER_MODULES]
+    return {
+        'benchmark': 'cold_start',
+        'profiles': profiles,
+        'import_speedup': round(profiles[0]['import_ms'] / profiles[1]['import_ms'], 1),
+        'deploy_utils': construct_profile(repeat),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    print(json.dumps(run(args.repeat), indent=2))
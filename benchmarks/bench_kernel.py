@@ -0,0 +1,77 @@
+"""Single-pass quality band kernel vs boolean-masked pandas copies on synthetic rows.
+
+Reports throughput next to a plain ``sum`` over the same int8 column (a
+memory-bandwidth reference) and the peak extra memory each approach
+allocates, measured with tracemalloc.
+
+    python benchmarks/bench_kernel.py --rows 100000000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from quality_kernel import quality_band_stats, HIGH_LOW_BANDS  # noqa: E402
+
+
+def masked_pandas(quality):
+    # The pre-kernel approach: two filtered copies, one mean from each
+    high = quality[quality >= 7]
+    low = quality[quality <= 4]
+    return high.mean(), low.mean()
+
+
+def timed(func, argument, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(argument)
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func(argument)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(timings), peak
+
+
+def run(rows=100_000_000, repeat=3):
+    rng = np.random.default_rng(0)
+    quality = rng.integers(3, 10, size=rows, dtype=np.int8)
+    series = pd.Series(quality, copy=False)
+
+    results = {}
+    for name, func, argument in (
+        ('reference_sum', lambda q: q.sum(dtype=np.int64), quality),
+        ('kernel', lambda q: quality_band_stats(q, HIGH_LOW_BANDS), quality),
+        ('masked_pandas', masked_pandas, series),
+    ):
+        seconds, peak = timed(func, argument, repeat)
+        results[name] = {
+            'seconds': round(seconds, 4),
+            'gb_per_second': round(quality.nbytes / seconds / 1e9, 2),
+            'peak_alloc_bytes': int(peak),
+        }
+    return {
+        'benchmark': 'quality_kernel',
+        'rows': rows,
+        'input_bytes': int(quality.nbytes),
+        'results': results,
+        'kernel_speedup': round(results['masked_pandas']['seconds'] / results['kernel']['seconds'], 1),
+        'kernel_vs_bandwidth': round(results['reference_sum']['seconds'] / results['kernel']['seconds'], 2),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=100_000_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    print(json.dumps(run(args.rows, args.repeat), indent=2))
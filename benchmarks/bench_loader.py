@@ -0,0 +1,89 @@
+"""Parse time and in-memory footprint: default pd.read_csv vs the typed wine_loader.
+
+    python benchmarks/bench_loader.py --scale 100
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from wine_loader import load_wines, load_wines_cached  # noqa: E402
+
+SOURCES = ['winequality-red.csv', 'winequality-white.csv']
+
+
+def scaled_copies(directory, scale):
+    """Write each source CSV repeated ``scale`` times (header kept once)."""
+    paths = []
+    for name in SOURCES:
+        with open(os.path.join(ROOT, name), 'rb') as f:
+            header = f.readline()
+            body = f.read()
+        if not body.endswith(b'\n'):
+            body += b'\n'
+        path = os.path.join(directory, name)
+        with open(path, 'wb') as f:
+            f.write(header)
+            for _ in range(scale):
+                f.write(body)
+        paths.append(path)
+    return paths
+
+
+def load_untyped(paths):
+    # What the loaders did before: inferred dtypes and a per-row string wine_type
+    frames = []
+    for path in paths:
+        df = pd.read_csv(path, delimiter=';')
+        df['wine_type'] = os.path.basename(path)[len('winequality-'):].replace('.csv', '')
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True)
+
+
+def measure(loader, paths, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        df = loader(paths)
+        timings.append(time.perf_counter() - start)
+    return {
+        'rows': len(df),
+        'parse_seconds': round(min(timings), 4),
+        'memory_bytes': int(df.memory_usage(deep=True).sum()),
+    }
+
+
+def run(scale=10, repeat=3):
+    with tempfile.TemporaryDirectory() as directory:
+        paths = scaled_copies(directory, scale)
+        untyped = measure(load_untyped, paths, repeat)
+        typed = measure(load_wines, paths, repeat)
+        # First call parses and writes the snapshot, later calls memory-map it
+        snapshot_cold = measure(load_wines_cached, paths, 1)
+        snapshot_warm = measure(load_wines_cached, paths, repeat)
+    return {
+        'benchmark': 'loader',
+        'scale': scale,
+        'untyped': untyped,
+        'typed': typed,
+        'snapshot_cold': snapshot_cold,
+        'snapshot_warm': snapshot_warm,
+        'memory_ratio': round(untyped['memory_bytes'] / typed['memory_bytes'], 2),
+        'speedup': round(untyped['parse_seconds'] / typed['parse_seconds'], 2),
+        'snapshot_speedup': round(typed['parse_seconds'] / snapshot_warm['parse_seconds'], 1),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--scale', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    print(json.dumps(run(args.scale, args.repeat), indent=2))
@@ -0,0 +1,51 @@
+"""Throughput of sharded process-parallel aggregation against worker count.
+
+    python benchmarks/bench_sharded.py --scale 50 --workers 1,2,4,8
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_loader import scaled_copies  # noqa: E402
+from shard_aggregation import sharded_aggregate  # noqa: E402
+
+
+def run(scale=50, worker_counts=None, shard_size=16 * 1024 * 1024):
+    worker_counts = worker_counts or sorted({1, 2, os.cpu_count() or 1})
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        paths = scaled_copies(directory, scale)
+        input_bytes = sum(os.path.getsize(path) for path in paths)
+        for workers in worker_counts:
+            start = time.perf_counter()
+            sharded_aggregate(paths, max_workers=workers, shard_size=shard_size)
+            seconds = time.perf_counter() - start
+            results[str(workers)] = {
+                'seconds': round(seconds, 3),
+                'mb_per_second': round(input_bytes / seconds / 1e6, 1),
+            }
+    baseline = results[str(worker_counts[0])]['seconds']
+    for entry in results.values():
+        entry['speedup'] = round(baseline / entry['seconds'], 2)
+    return {
+        'benchmark': 'sharded_aggregation',
+        'scale': scale,
+        'input_bytes': input_bytes,
+        'cpu_count': os.cpu_count(),
+        'workers': results,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--scale', type=int, default=50)
+    parser.add_argument('--workers', default=None)
+    args = parser.parse_args()
+    worker_counts = [int(count) for count in args.workers.split(',')] if args.workers else None
+    print(json.dumps(run(args.scale, worker_counts), indent=2))
@@ -0,0 +1,105 @@
+"""Run the ingest -> aggregate -> serve benchmark suite offline and write JSON results.
+
+Each benchmark runs in a fresh process so its peak RSS is reported in isolation.
+
+    python benchmarks/run_benchmarks.py --scales 1,10,100,1000 --output bench_results.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+
+
+def peak_rss_kb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def _child(module_name, kwargs, results):
+    sys.path[:0] = [BENCH_DIR, ROOT]
+    os.chdir(ROOT)
+    module = __import__(module_name)
+    baseline = peak_rss_kb()
+    result = module.run(**kwargs)
+    result['baseline_rss_kb'] = baseline
+    result['peak_rss_kb'] = peak_rss_kb()
+    results.put(result)
+
+
+def run_isolated(module_name, **kwargs):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=_child, args=(module_name, kwargs, results))
+    process.start()
+    result = results.get()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(f"{module_name} benchmark exited with {process.exitcode}")
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(scales, requests, concurrency_levels, repeat, kernel_rows=100_000_000):
+    results = []
+    for scale in scales:
+        print(f"loader x{scale}", file=sys.stderr)
+        results.append(run_isolated('bench_loader', scale=scale, repeat=repeat))
+    for scale in scales:
+        print(f"lambda_handler x{scale}", file=sys.stderr)
+        results.append(run_isolated('bench_lambda', scale=scale, repeat=repeat))
+    print("api", file=sys.stderr)
+    results.append(run_isolated('bench_api', requests=requests, concurrency_levels=concurrency_levels))
+    print("quality_kernel", file=sys.stderr)
+    results.append(run_isolated('bench_kernel', rows=kernel_rows, repeat=repeat))
+    print("sharded_aggregation", file=sys.stderr)
+    results.append(run_isolated('bench_sharded', scale=max(scales)))
+    print("cold_start", file=sys.stderr)
+    results.append(run_isolated('bench_cold_start', repeat=repeat))
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'results': results,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--scales', default='1,10,100')
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', default='1,8,32')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--kernel-rows', type=int, default=100_000_000)
+    parser.add_argument('--output', default=None, help='write JSON here instead of stdout')
+    args = parser.parse_args()
+
+    report = run_suite(
+        [int(scale) for scale in args.scales.split(',')],
+        args.requests,
+        [int(level) for level in args.concurrency.split(',')],
+        args.repeat,
+        args.kernel_rows,
+    )
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
@@ -1,20 +1,36 @@
-import pandas as pd
+import sys
+from wine_loader import load_wines_cached
+from quality_kernel import quality_band_stats, HIGH_LOW_BANDS
 
-red_wine = pd.read_csv("winequality-red.csv", delimiter=";")
-white_wine = pd.read_csv("winequality-white.csv", delimiter=";")
-#wine = pd.read_csv("winequality.csv", delimiter=";")
-wine = 'winequality-red.csv'
-print(wine[12:].replace('.csv', ''))
-red_wine["wine_type"] = 'red'
-white_wine["wine_type"] = 'white'
+SOURCES = ["winequality-red.csv", "winequality-white.csv"]
 
-wine = pd.concat([red_wine, white_wine], ignore_index=True)
 
+def quality_averages(paths):
+    wine = load_wines_cached(paths)
 
-high_quality_wine = wine[wine["quality"] >= 7]
-low_quality_wine = wine[wine['quality'] <= 4]
+    # One pass over the quality column for both bands, no filtered copies of the frame
+    bands = quality_band_stats(wine["quality"].to_numpy(), HIGH_LOW_BANDS)
+    return bands['high']['mean'], bands['low']['mean']
 
-high_average_quality = round(high_quality_wine['quality'].mean(),2)
-low_average_quality = round(low_quality_wine['quality'].mean(),2)
 
-print(f"Average quality of high quality wine: {high_average_quality}, average quality of low quality wine: {low_average_quality}")
\ No newline at end of file
+def sharded_quality_averages(paths):
+    # Multi-GB inputs: line-aligned byte-range shards aggregated on every core
+    from shard_aggregation import sharded_aggregate
+    from quality_aggregates import quality_average
+
+    aggregates = sharded_aggregate(paths)
+    high_min, low_max = HIGH_LOW_BANDS['high'][0], HIGH_LOW_BANDS['low'][1]
+    return quality_average(aggregates, min_quality=high_min), quality_average(aggregates, max_quality=low_max)
+
+
+if __name__ == "__main__":
+    # python data_processing.py [--sharded] [file.csv ...]
+    args = sys.argv[1:]
+    sharded = '--sharded' in args
+    paths = [arg for arg in args if arg != '--sharded'] or SOURCES
+
+    high_average_quality, low_average_quality = (sharded_quality_averages if sharded else quality_averages)(paths)
+    high_average_quality = round(high_average_quality,2)
+    low_average_quality = round(low_average_quality,2)
+
+    print(f"Average quality of high quality wine: {high_average_quality}, average quality of low quality wine: {low_average_quality}")
@@ -1,54 +1,494 @@
-from fastapi import FastAPI, Query, HTTPException, Header, Depends
+from typing import List
+from fastapi import FastAPI, Query, HTTPException, Header, Depends, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+import asyncio
 import boto3
+import hashlib
 import json
+import math
 import os
+import threading
+import time
+from contextlib import asynccontextmanager
+import numpy as np
+import pandas as pd
+from io import BytesIO
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from api_metrics import MetricsRegistry
 
 # uvicorn fast_api:app --reload
 
 REGION = 'eu-north-1'
 BUCKET_NAME = 'dataka'
-S3_CLIENT = boto3.client('s3', region_name=REGION)
+# Concurrent S3 calls per worker; the executor and the botocore pool share this size
+S3_MAX_CONCURRENCY = int(os.getenv('S3_MAX_CONCURRENCY', 32))
+# Connections opened at startup so the first requests do not pay for TLS handshakes
+S3_WARM_CONNECTIONS = int(os.getenv('S3_WARM_CONNECTIONS', min(4, S3_MAX_CONCURRENCY)))
+# Seconds between warm-up attempts while S3 is unreachable at startup
+WARM_UP_RETRY_SECONDS = float(os.getenv('WARM_UP_RETRY_SECONDS', 5))
+S3_CONFIG = Config(
+    max_pool_connections=S3_MAX_CONCURRENCY,
+    tcp_keepalive=True,
+    connect_timeout=float(os.getenv('S3_CONNECT_TIMEOUT', 2)),
+    read_timeout=float(os.getenv('S3_READ_TIMEOUT', 10)),
+    retries={'max_attempts': 3, 'mode': 'standard'},
+)
+S3_CLIENT = boto3.client('s3', region_name=REGION, config=S3_CONFIG)
+S3_EXECUTOR = ThreadPoolExecutor(max_workers=S3_MAX_CONCURRENCY, thread_name_prefix='s3')
+AGGREGATES_KEY = 'quality_aggregates.parquet'
 API_KEY = os.getenv('API_KEY')
+CACHE_TTL_SECONDS = float(os.getenv('CACHE_TTL_SECONDS', 30))
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 128))
+# Cache-Control max-age sent with /process_data responses
+HTTP_CACHE_MAX_AGE = int(os.getenv('HTTP_CACHE_MAX_AGE', 60))
+QUALITY_KEYS = {
+    'high': 'high_quality_average.json',
+    'low': 'low_quality_average.json',
+}
+# Manifest the Lambda publishes with both averages and the versioned aggregate table
+RESULTS_KEY = 'quality_results.json'
+QUALITY_FIELDS = {
+    'high': 'high_average_quality',
+    'low': 'low_average_quality',
+}
+# Per-metric file -> its field in the manifest
+MANIFEST_FIELDS = {QUALITY_KEYS[quality]: field for quality, field in QUALITY_FIELDS.items()}
 
+METRICS = MetricsRegistry()
+REQUEST_LATENCY = METRICS.histogram('http_request_duration_seconds', 'End-to-end request latency.', labels=('path',))
+STAGE_LATENCY = METRICS.histogram('request_stage_duration_seconds', 'Latency of auth, s3_get, decode and response stages.', labels=('stage',))
+RESPONSES = METRICS.counter('http_responses_total', 'Responses by route and status code.', labels=('path', 'status'))
+IN_FLIGHT = METRICS.gauge('http_requests_in_flight', 'Requests currently being served.')
+S3_ERRORS = METRICS.counter('s3_errors_total', 'Failed S3 calls by operation and error code.', labels=('operation', 'code'))
+
+
+class ResultCache:
+    """Bounded LRU cache of parsed results with a TTL and ETag revalidation.
+
+    ``loader(key, etag)`` must return ``(value, etag)``, or ``None`` when the
+    stored ETag is still current. Concurrent misses on the same key share a
+    single load.
+    """
+
+    def __init__(self, ttl=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self.entries = OrderedDict()  # key -> (value, etag, expires_at)
+        self.lock = threading.Lock()
+        self.key_locks = {}  # key -> [lock, number of callers using it]
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+
+    def _lookup(self, key):
+        entry = self.entries.get(key)
+        if entry is not None and entry[2] > self.clock():
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True, entry
+        return False, entry
+
+    def peek(self, key):
+        """Value of a fresh entry, or None; never loads."""
+        with self.lock:
+            fresh, entry = self._lookup(key)
+            return entry[0] if fresh else None
+
+    def get_or_load(self, key, loader):
+        return self.get_or_load_entry(key, loader)[0]
+
+    def get_or_load_entry(self, key, loader):
+        """Like get_or_load but returns ``(value, etag)``."""
+        with self.lock:
+            fresh, entry = self._lookup(key)
+            if fresh:
+                return entry[0], entry[1]
+            key_lock = self.key_locks.setdefault(key, [threading.Lock(), 0])
+            key_lock[1] += 1
+
+        try:
+            with key_lock[0]:
+                # Another request may have refreshed the entry while we waited
+                with self.lock:
+                    fresh, entry = self._lookup(key)
+                    if fresh:
+                        return entry[0], entry[1]
+
+                stored_etag = entry[1] if entry else None
+                loaded = loader(key, stored_etag)
+
+                with self.lock:
+                    if loaded is None:
+                        self.revalidations += 1
+                        value, etag = entry[0], stored_etag
+                    else:
+                        self.misses += 1
+                        value, etag = loaded
+                    self.entries[key] = (value, etag, self.clock() + self.ttl)
+                    self.entries.move_to_end(key)
+                    while len(self.entries) > self.max_entries:
+                        self.entries.popitem(last=False)
+                return value, etag
+        finally:
+            # The last caller out drops the lock, whether the load succeeded or failed
+            with self.lock:
+                key_lock[1] -= 1
+                if key_lock[1] == 0 and self.key_locks.get(key) is key_lock:
+                    del self.key_locks[key]
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'revalidations': self.revalidations,
+                'size': len(self.entries),
+            }
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.misses = self.revalidations = 0
+
+
+RESULT_CACHE = ResultCache()
+
+
+class AggregateStore:
+    """In-memory columnar view of the precomputed aggregate table written by the Lambda.
+
+    Rows hold count/sum/sum_sq/min/max of one feature for one (wine_type, quality)
+    group, so any threshold/feature/type aggregate is a reduction over a few rows.
+    """
+
+    def __init__(self, table: pd.DataFrame):
+        self.rows = {}
+        for feature, group in table.groupby('feature'):
+            self.rows[feature] = {
+                'wine_type': group['wine_type'].to_numpy(dtype=object),
+                'quality': group['quality'].to_numpy(dtype=np.int64),
+                'count': group['count'].to_numpy(dtype=np.int64),
+                'sum': group['sum'].to_numpy(dtype=np.float64),
+                'sum_sq': group['sum_sq'].to_numpy(dtype=np.float64),
+                'min': group['min'].to_numpy(dtype=np.float64),
+                'max': group['max'].to_numpy(dtype=np.float64),
+            }
+        self.features = sorted(self.rows)
+        self.wine_types = sorted(set(table['wine_type']))
+
+    @classmethod
+    def from_parquet(cls, data: bytes):
+        return cls(pd.read_parquet(BytesIO(data)))
+
+    def query(self, feature: str = 'quality', min_quality: int = None, max_quality: int = None, wine_type: str = None):
+        if feature not in self.rows:
+            raise HTTPException(status_code=400, detail=f"Invalid feature. Allowed values: {', '.join(self.features)}")
+        rows = self.rows[feature]
+        mask = np.ones(len(rows['count']), dtype=bool)
+        if min_quality is not None:
+            mask &= rows['quality'] >= min_quality
+        if max_quality is not None:
+            mask &= rows['quality'] <= max_quality
+        if wine_type is not None:
+            mask &= rows['wine_type'] == wine_type
+
+        result = {
+            'feature': feature,
+            'wine_type': wine_type,
+            'min_quality': min_quality,
+            'max_quality': max_quality,
+            'count': int(rows['count'][mask].sum()),
+            'mean': None,
+            'std': None,
+            'min': None,
+            'max': None,
+        }
+        if result['count'] == 0:
+            return result
+        count = result['count']
+        mean = rows['sum'][mask].sum() / count
+        variance = max(rows['sum_sq'][mask].sum() / count - mean * mean, 0.0)
+        result.update({
+            'mean': float(mean),
+            'std': math.sqrt(variance),
+            'min': float(rows['min'][mask].min()),
+            'max': float(rows['max'][mask].max()),
+        })
+        return result
 
-app = FastAPI()
 
 class DataProcessor:
-    def __init__(self, s3_client=S3_CLIENT, region=REGION, bucket_name=BUCKET_NAME):
+    def __init__(self, s3_client=S3_CLIENT, region=REGION, bucket_name=BUCKET_NAME, cache=RESULT_CACHE):
         self.s3_client = s3_client
         self.bucket_name = bucket_name
         self.region = region
+        self.cache = cache
+
+    def fetch_object(self, file_key: str, etag: str = None, parse=None, missing_ok=False):
+        print(f"Fetching file from bucket: {self.bucket_name}, key: {file_key}")
+        request = {'Bucket': self.bucket_name, 'Key': file_key}
+        if etag:
+            request['IfNoneMatch'] = etag
+        try:
+            with STAGE_LATENCY.time('s3_get'):
+                file_obj = self.s3_client.get_object(**request)
+                data = file_obj['Body'].read()
+        except ClientError as e:
+            # S3 answers a matching If-None-Match with 304 Not Modified
+            if e.response.get('ResponseMetadata', {}).get('HTTPStatusCode') == 304:
+                return None
+            code = e.response.get('Error', {}).get('Code', 'Unknown')
+            if missing_ok and code in ('NoSuchKey', '404'):
+                # An expected miss, not an S3 error
+                return None, None
+            S3_ERRORS.inc('get_object', code)
+            raise
+        except Exception as e:
+            S3_ERRORS.inc('get_object', type(e).__name__)
+            raise
+        with STAGE_LATENCY.time('decode'):
+            value = parse(data)
+        return value, file_obj.get('ETag')
+
+    def fetch_json_data(self, file_key: str, etag: str = None):
+        return self.fetch_object(file_key, etag, parse=lambda data: json.loads(data.decode('utf-8')))
+
+    def fetch_aggregate_store(self, file_key: str, etag: str = None):
+        return self.fetch_object(file_key, etag, parse=AggregateStore.from_parquet)
+
+    def get_json_data(self, file_key: str):
+        """Parsed JSON and the S3 ETag of the object it came from."""
+        try:
+            if self.cache is None:
+                return self.fetch_json_data(file_key)
+            return self.cache.get_or_load_entry(file_key, self.fetch_json_data)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
 
     def process_json_data(self, file_key: str):
+        """Parsed JSON of ``file_key``; per-metric values come from the manifest when one is published.
+
+        Reading both averages from the same manifest means high and low always come from the same run.
+        """
+        field = MANIFEST_FIELDS.get(file_key)
+        if field is not None:
+            manifest, _ = self.get_manifest()
+            if manifest is not None:
+                return {field: manifest[field]}
+        return self.get_json_data(file_key)[0]
+
+    def peek_json_data(self, file_key: str):
+        """process_json_data answered from fresh cache entries only, or None; never touches S3."""
+        if self.cache is None:
+            return None
+        field = MANIFEST_FIELDS.get(file_key)
+        if field is not None:
+            manifest = self.cache.peek(RESULTS_KEY)
+            if manifest is not None:
+                return {field: manifest[field]}
+        return self.cache.peek(file_key)
+
+    def fetch_manifest(self, file_key: str, etag: str = None):
+        # Not published yet (or written by an older Lambda): readers fall back to the per-metric files
+        return self.fetch_object(file_key, etag, parse=lambda data: json.loads(data.decode('utf-8')), missing_ok=True)
+
+    def get_manifest(self):
+        """The published results manifest and its ETag, or (None, None) when there is none."""
         try:
-            print(f"Fetching file from bucket: {self.bucket_name}, key: {file_key}")
-            file_obj = self.s3_client.get_object(Bucket=self.bucket_name, Key=file_key)
-            file_content = file_obj['Body'].read().decode('utf-8')
-            return json.loads(file_content)
+            if self.cache is None:
+                return self.fetch_manifest(RESULTS_KEY)
+            return self.cache.get_or_load_entry(RESULTS_KEY, self.fetch_manifest)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
 
+    def get_aggregate_store(self):
+        manifest, _ = self.get_manifest()
+        if manifest is not None and not manifest.get('aggregates_key'):
+            # The lean handler publishes averages only; the legacy table would be from an older run
+            raise HTTPException(status_code=409, detail="The published results have no aggregate table.")
+        try:
+            # Versioned keys never change, so a cached table always matches its manifest
+            key = manifest['aggregates_key'] if manifest else AGGREGATES_KEY
+            if self.cache is None:
+                return self.fetch_aggregate_store(key)[0]
+            return self.cache.get_or_load(key, self.fetch_aggregate_store)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error loading aggregates: {str(e)}")
+
     def get_file_key(self, quality: str):
-        quality_map = {
-            'high': 'high_quality_average.json',
-            'low': 'low_quality_average.json',
-        }
-        if quality not in quality_map:
+        try:
+            return QUALITY_KEYS[quality]
+        except KeyError:
             raise HTTPException(status_code=400, detail="Invalid quality parameter. Allowed values: high, low")
-        return quality_map[quality]
 
-def get_data_processor() -> DataProcessor:
-    return DataProcessor()
+    def warm_up(self, connections=S3_WARM_CONNECTIONS):
+        """Open ``connections`` pooled S3 connections in parallel; returns True if all succeeded."""
+        if connections <= 0:
+            return True
+        futures = [S3_EXECUTOR.submit(self.s3_client.head_bucket, Bucket=self.bucket_name)
+                   for _ in range(connections)]
+        ok = True
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                print(f"S3 warm-up failed: {e}")
+                ok = False
+        return ok
+
+
+async def warm_up_until_ready(app: FastAPI):
+    # Keep /ready at 503 until a warm-up succeeds
+    loop = asyncio.get_running_loop()
+    while not await loop.run_in_executor(None, app.state.processor.warm_up):
+        print(f"DataProcessor not ready, retrying warm-up in {WARM_UP_RETRY_SECONDS}s")
+        await asyncio.sleep(WARM_UP_RETRY_SECONDS)
+    app.state.ready = True
+    print("DataProcessor ready")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One processor per worker, warmed before the worker reports ready
+    app.state.ready = False
+    app.state.processor = DataProcessor()
+    app.state.ready = await asyncio.get_running_loop().run_in_executor(None, app.state.processor.warm_up)
+    retry = None
+    if app.state.ready:
+        print("DataProcessor ready")
+    else:
+        # Serve anyway (requests may still succeed) but stay out of rotation until S3 answers
+        retry = asyncio.create_task(warm_up_until_ready(app))
+    try:
+        yield
+    finally:
+        if retry is not None:
+            retry.cancel()
+        app.state.ready = False
+        print("DataProcessor shutting down")
+
+app = FastAPI(lifespan=lifespan)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    IN_FLIGHT.inc()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        IN_FLIGHT.dec()
+        # Label by route template so unmatched paths cannot blow up cardinality
+        route = request.scope.get('route')
+        label = route.path if route is not None else 'unmatched'
+        REQUEST_LATENCY.observe(time.perf_counter() - start, label)
+        RESPONSES.inc(label, status)
+
+def get_data_processor(request: Request) -> DataProcessor:
+    processor = getattr(request.app.state, 'processor', None)
+    if processor is None:
+        # Served without the lifespan (e.g. a bare TestClient); create the singleton lazily
+        processor = request.app.state.processor = DataProcessor()
+    return processor
+
+async def run_in_s3_executor(func, *args):
+    # Run blocking boto3 work off the event loop so concurrent requests overlap their I/O
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(S3_EXECUTOR, func, *args)
+
+def etag_matches(if_none_match: str, etag: str):
+    # If-None-Match uses the weak comparison: ignore W/ prefixes, accept lists and *
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return etag.removeprefix('W/') in [tag.removeprefix('W/') for tag in candidates]
+
+def result_etag(result):
+    # Derived from the body itself, so the same values always get the same ETag;
+    # anything but a JSON document gets none and is never answered with 304
+    if not isinstance(result, (dict, list)):
+        return None
+    digest = hashlib.blake2b(json.dumps(result, sort_keys=True).encode(), digest_size=12)
+    return f'"{digest.hexdigest()}"'
+
+def cache_headers(etag: str):
+    headers = {'Cache-Control': f'max-age={HTTP_CACHE_MAX_AGE}'}
+    if etag:
+        headers['ETag'] = etag
+    return headers
+
+def check_api_key(api_key: str):
+    with STAGE_LATENCY.time('auth'):
+        if api_key != os.getenv('API_KEY'):
+            raise HTTPException(status_code=401, detail="Invalid or missing API key.")
+
+@app.get("/ready")
+async def ready_endpoint(request: Request):
+    if not getattr(request.app.state, 'ready', False):
+        raise HTTPException(status_code=503, detail="Not ready")
+    return {'status': 'ready'}
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return PlainTextResponse(METRICS.render(), media_type='text/plain; version=0.0.4')
 
 @app.get("/process_data")
 async def process_data_endpoint(
     quality: str = Query(..., alias="qualityquery"),
     api_key: str = Header(None),
+    if_none_match: str = Header(None),
     processor: DataProcessor = Depends(get_data_processor)
 ):
-    if api_key != os.getenv('API_KEY'):
-        raise HTTPException(status_code=401, detail="Invalid or missing API key.")
+    check_api_key(api_key)
 
     file_key = processor.get_file_key(quality)
-    result = processor.process_json_data(file_key)
-    return result
+
+    # A fresh cached result answers conditional requests without any S3 call
+    if if_none_match:
+        cached = processor.peek_json_data(file_key)
+        if cached is not None and etag_matches(if_none_match, result_etag(cached)):
+            return Response(status_code=304, headers=cache_headers(result_etag(cached)))
+
+    result = await run_in_s3_executor(processor.process_json_data, file_key)
+    etag = result_etag(result)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=cache_headers(etag))
+    with STAGE_LATENCY.time('response'):
+        return JSONResponse(result, headers=cache_headers(etag))
+
+@app.get("/process_data/batch")
+async def process_data_batch_endpoint(
+    qualities: List[str] = Query(..., alias="qualityquery"),
+    api_key: str = Header(None),
+    processor: DataProcessor = Depends(get_data_processor)
+):
+    check_api_key(api_key)
+
+    # Accept repeated parameters as well as comma-separated lists, keep first-seen order
+    names = list(dict.fromkeys(name.strip() for value in qualities for name in value.split(',') if name.strip()))
+    file_keys = [processor.get_file_key(name) for name in names]
+
+    # All levels come from the same cached manifest, so this is at most one S3 read
+    results = await asyncio.gather(*(run_in_s3_executor(processor.process_json_data, key) for key in file_keys))
+    return dict(zip(names, results))
+
+@app.get("/aggregates")
+async def aggregates_endpoint(
+    feature: str = Query('quality'),
+    min_quality: int = Query(None),
+    max_quality: int = Query(None),
+    wine_type: str = Query(None),
+    api_key: str = Header(None),
+    processor: DataProcessor = Depends(get_data_processor)
+):
+    check_api_key(api_key)
+
+    store = await run_in_s3_executor(processor.get_aggregate_store)
+    return store.query(feature, min_quality=min_quality, max_quality=max_quality, wine_type=wine_type)
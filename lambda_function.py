@@ -1,74 +1,502 @@
 import json
+import os
+import time
 import pandas as pd
 import boto3
-from io import StringIO
+from io import BytesIO
+from botocore.exceptions import ClientError
+from wine_loader import (
+    SOURCE_SUFFIXES,
+    open_decompressed,
+    read_wine_csv,
+    read_wine_parquet,
+    source_format,
+    wine_type_from_path,
+)
+from quality_aggregates import (
+    AGGREGATE_KEYS,
+    AGGREGATE_STATS,
+    STREAM_CHUNK_SIZE,
+    UNKNOWN_WINE_TYPE,
+    aggregate_frame,
+    empty_aggregates,
+    merge_aggregates,
+    quality_average,
+    stream_aggregates,
+)
+from lambda_metrics import CurrentMetrics, InvocationMetrics, Profiler, current_metrics, in_context
+from s3_ranges import RANGE_SIZE, fetch_lines, sniff_header, split_ranges
+from results_manifest import RESULTS_PREFIX, prune_result_versions, results_version
+from concurrent.futures import ThreadPoolExecutor
 
 # Initialize the S3 client
 s3_client = boto3.client('s3')
 
+# Quality thresholds used for the high and low buckets
+HIGH_QUALITY_MIN = 7
+LOW_QUALITY_MAX = 4
+
+# Source objects picked up when the event does not list keys explicitly
+SOURCE_PREFIX = 'winequality-'
+
+# Concurrent ranged GETs per object when a plain CSV is larger than RANGE_SIZE
+RANGE_MAX_WORKERS = int(os.getenv('RANGE_MAX_WORKERS', 8))
+
+# Features read from Parquet sources besides quality; unset reads every column
+AGGREGATE_FEATURES = [name for name in os.getenv('AGGREGATE_FEATURES', '').split(',') if name] or None
+
+# Upper bound on concurrent S3 downloads per invocation
+FETCH_MAX_WORKERS = int(os.getenv('FETCH_MAX_WORKERS', 8))
+
+# Aggregate table for existing readers; the manifest points at a versioned copy
+AGGREGATES_KEY = 'quality_aggregates.parquet'
+
+# Single manifest holding both averages and the versioned aggregate table; a reader
+# that fetches it sees one consistent result set
+RESULTS_KEY = 'quality_results.json'
+# Per-metric files written alongside the manifest for existing readers
+RESULT_FILES = {
+    'high_average_quality': 'high_quality_average.json',
+    'low_average_quality': 'low_quality_average.json',
+}
+
+# Per-object partial aggregates used by incremental mode, tagged with the source ETag,
+# and the merged running total with the source ETags it was built from
+PARTIALS_PREFIX = 'partials/'
+INCREMENTAL_STATE_KEY = f'{PARTIALS_PREFIX}_running_total.parquet'
+INCREMENTAL_AGGREGATION = os.getenv('INCREMENTAL_AGGREGATION', '1') == '1'
+
+# Opt-in profiling (cprofile or tracemalloc); written to LAMBDA_PROFILE_DIR or s3://<bucket>/profiles/
+LAMBDA_PROFILE = os.getenv('LAMBDA_PROFILE', '')
+LAMBDA_PROFILE_DIR = os.getenv('LAMBDA_PROFILE_DIR')
+
+# Stage timings and byte/row counts of the current invocation
+METRICS = CurrentMetrics(InvocationMetrics())
+
+
+def list_source_etags(bucket_name, prefix=SOURCE_PREFIX, suffixes=SOURCE_SUFFIXES):
+    """Map the winequality-* source keys (CSV, compressed CSV, Parquet) in the bucket to their ETags."""
+    etags = {}
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if obj['Key'].endswith(suffixes):
+                etags[obj['Key']] = obj['ETag'].strip('"')
+    return etags
+
+
+def list_source_keys(bucket_name, prefix=SOURCE_PREFIX, suffixes=SOURCE_SUFFIXES):
+    """List the winequality-* source keys (CSV, compressed CSV, Parquet) currently in the bucket."""
+    return sorted(list_source_etags(bucket_name, prefix, suffixes))
+
+
+class S3RangeFile:
+    """Seekable read-only file over one S3 object version, fetched with ranged GETs.
+
+    Lets pyarrow read a Parquet footer and only the projected column chunks.
+    ``IfMatch`` pins every range to the ETag seen when the file was opened.
+    """
+
+    def __init__(self, bucket_name, key):
+        head = s3_client.head_object(Bucket=bucket_name, Key=key)
+        self.bucket_name = bucket_name
+        self.key = key
+        self.etag = head['ETag']
+        self.size = head['ContentLength']
+        self.position = 0
+        self.closed = False
+        # Last range fetched; pyarrow re-reads the footer it has just speculatively read
+        self.buffer_start = 0
+        self.buffer = b''
+
+    def read(self, size=-1):
+        end = self.size if size is None or size < 0 else min(self.position + size, self.size)
+        if end <= self.position:
+            return b''
+        if self.buffer_start <= self.position and end <= self.buffer_start + len(self.buffer):
+            data = self.buffer[self.position - self.buffer_start:end - self.buffer_start]
+            self.position = end
+            return data
+        with METRICS.stage('download'):
+            response = s3_client.get_object(
+                Bucket=self.bucket_name, Key=self.key, IfMatch=self.etag,
+                Range=f'bytes={self.position}-{end - 1}'
+            )
+            data = response['Body'].read()
+        METRICS.add('bytes_processed', len(data))
+        self.buffer_start, self.buffer = self.position, data
+        self.position += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        base = {0: 0, 1: self.position, 2: self.size}[whence]
+        self.position = base + offset
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def seekable(self):
+        return True
+
+    def readable(self):
+        return True
+
+    def close(self):
+        self.closed = True
+
+
+def parquet_aggregates(source, wine_type, features=AGGREGATE_FEATURES):
+    with METRICS.stage('parse'):
+        df = read_wine_parquet(source, features=features)
+    METRICS.add('rows_processed', len(df))
+    with METRICS.stage('aggregate'):
+        return aggregate_frame(df, wine_type)
+
+
+def aggregate_csv_object(bucket_name, key, delimiter=None, range_size=RANGE_SIZE, max_workers=RANGE_MAX_WORKERS):
+    """Aggregate a plain CSV object, validating its header before the bulk download.
+
+    Objects that fit in the header sniff need no further request. Objects up to
+    ``range_size`` are streamed in one GET. Larger ones are split into
+    line-aligned ranges that are downloaded and parsed concurrently.
+    """
+    wine_type = wine_type_from_path(key)
+    with METRICS.stage('download'):
+        sniffed = sniff_header(s3_client, bucket_name, key)
+    METRICS.add('bytes_processed', len(sniffed['data']))
+    delimiter = delimiter or sniffed['delimiter']
+    etag = sniffed['etag']
+
+    if len(sniffed['data']) >= sniffed['size']:
+        aggregates = stream_aggregates(BytesIO(sniffed['data']), wine_type, delimiter=delimiter, metrics=METRICS)
+    elif sniffed['size'] <= range_size:
+        with METRICS.stage('download'):
+            wine_obj = s3_client.get_object(Bucket=bucket_name, Key=key, IfMatch=etag)
+        aggregates = stream_aggregates(METRICS.timed_body(wine_obj['Body']), wine_type, delimiter=delimiter,
+                                       metrics=METRICS)
+    else:
+        header = sniffed['header']
+
+        def aggregate_range(byte_range):
+            with METRICS.stage('download'):
+                lines = fetch_lines(s3_client, bucket_name, key, *byte_range, sniffed['size'], etag)
+            METRICS.add('bytes_processed', len(lines))
+            if not lines.strip():
+                return empty_aggregates()
+            with METRICS.stage('parse'):
+                chunk = read_wine_csv(header + lines, delimiter=delimiter)
+            METRICS.add('rows_processed', len(chunk))
+            with METRICS.stage('aggregate'):
+                return aggregate_frame(chunk, wine_type)
+
+        ranges = split_ranges(sniffed['size'], len(header), range_size)
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(ranges))) as executor:
+            parts = list(executor.map(in_context(aggregate_range), ranges))
+        with METRICS.stage('merge'):
+            aggregates = merge_aggregates(parts)
+    return aggregates, (etag or '').strip('"')
+
+
+def fetch_and_aggregate(bucket_name, key, delimiter=None, features=AGGREGATE_FEATURES):
+    """Download one object and aggregate it as its body streams in.
+
+    Plain CSVs go through aggregate_csv_object, so the header is validated
+    first. Compressed CSV bodies are decompressed (gzip/zstd) while they stream. Parquet objects
+    are read with ranged GETs of only ``quality`` and ``features``. Returns the
+    aggregate table and the ETag of the object that was read.
+    """
+    wine_type = wine_type_from_path(key)
+    file_format, compression = source_format(key)
+    if file_format == 'parquet':
+        source = S3RangeFile(bucket_name, key)
+        return parquet_aggregates(source, wine_type, features), source.etag.strip('"')
+    if key.endswith('.csv'):
+        return aggregate_csv_object(bucket_name, key, delimiter=delimiter)
+
+    with METRICS.stage('download'):
+        wine_obj = s3_client.get_object(Bucket=bucket_name, Key=key)
+    body = METRICS.timed_body(wine_obj['Body'])
+    if not key.endswith(SOURCE_SUFFIXES):
+        # Unknown suffix: fall back to the object's Content-Type/-Encoding
+        file_format, compression = source_format(key, wine_obj.get('ContentType'), wine_obj.get('ContentEncoding'))
+    if file_format == 'parquet':
+        aggregates = parquet_aggregates(body.read(), wine_type, features)
+    else:
+        aggregates = stream_aggregates(open_decompressed(body, compression), wine_type, delimiter=delimiter,
+                                       metrics=METRICS)
+    return aggregates, wine_obj['ETag'].strip('"')
+
+
+def aggregate_keys(bucket_name, keys, max_workers=FETCH_MAX_WORKERS, on_partial=None):
+    """Fetch and parse the given keys over a bounded thread pool and merge the results.
+
+    ``on_partial(key, etag, aggregates)`` is called for each object as it completes.
+    Parts are merged in key order, so the same inputs always give the same float
+    sums. Returns the merged table and the ETag of every object read.
+    """
+    if not keys:
+        return empty_aggregates(), {}
+
+    def run(key):
+        aggregates, etag = fetch_and_aggregate(bucket_name, key)
+        if on_partial:
+            on_partial(key, etag, aggregates)
+        return aggregates, etag
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(keys))) as executor:
+        results = dict(zip(keys, executor.map(in_context(run), keys)))
+    ordered = sorted(results)
+    with METRICS.stage('merge'):
+        merged = merge_aggregates([results[key][0] for key in ordered])
+    return merged, {key: results[key][1] for key in ordered}
+
+
+def partial_key(key):
+    return f"{PARTIALS_PREFIX}{key}.parquet"
+
+
+def list_partials(bucket_name):
+    """Return the source keys that currently have a stored partial."""
+    keys = set()
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=PARTIALS_PREFIX):
+        for obj in page.get('Contents', []):
+            name = obj['Key'][len(PARTIALS_PREFIX):]
+            if name.endswith('.parquet') and obj['Key'] != INCREMENTAL_STATE_KEY:
+                keys.add(name[:-len('.parquet')])
+    return keys
+
+
+def save_partial(bucket_name, key, etag, aggregates):
+    buffer = BytesIO()
+    aggregates.to_parquet(buffer, index=False)
+    s3_client.put_object(
+        Bucket=bucket_name,
+        Key=partial_key(key),
+        Body=buffer.getvalue(),
+        Metadata={'source-etag': etag},
+        ContentType='application/vnd.apache.parquet'
+    )
+
+
+def load_partial(bucket_name, key):
+    partial_obj = s3_client.get_object(Bucket=bucket_name, Key=partial_key(key))
+    return pd.read_parquet(BytesIO(partial_obj['Body'].read()))
+
+
+def load_incremental_state(bucket_name):
+    """Return the running total and the source ETags it covers, or (None, {}) before the first run."""
+    import pyarrow.parquet as pq
+
+    try:
+        state_obj = s3_client.get_object(Bucket=bucket_name, Key=INCREMENTAL_STATE_KEY)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+            return None, {}
+        raise
+    table = pq.read_table(BytesIO(state_obj['Body'].read()))
+    etags = json.loads(table.schema.metadata[b'source_etags'])
+    return table.to_pandas()[AGGREGATE_KEYS + AGGREGATE_STATS], etags
+
+
+def save_incremental_state(bucket_name, aggregates, etags):
+    """Store the running total with its source ETags in one object, so they cannot drift apart."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_pandas(aggregates, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[b'source_etags'] = json.dumps(etags, sort_keys=True).encode()
+    buffer = BytesIO()
+    pq.write_table(table.replace_schema_metadata(metadata), buffer)
+    s3_client.put_object(
+        Bucket=bucket_name,
+        Key=INCREMENTAL_STATE_KEY,
+        Body=buffer.getvalue(),
+        ContentType='application/vnd.apache.parquet'
+    )
+
+
+def incremental_aggregate(bucket_name, keys=None, max_workers=FETCH_MAX_WORKERS):
+    """Fold new objects into the stored running total; recompute only what changed.
+
+    The listing ETags are compared with the ETags the running total was built
+    from, so overwrites are picked up even when their event was lost. With
+    ``keys`` (the objects named in the triggering event) only those are
+    compared, so invocations for different objects do not aggregate each
+    other's objects; without a running total every object is still read.
+    New objects are merged into the total directly. A replaced or removed
+    object cannot be subtracted out of min/max, so then the total is rebuilt
+    from the stored per-object partials. Returns the total and the source
+    ETags it covers.
+    """
+    with METRICS.stage('list'):
+        sources = list_source_etags(bucket_name)
+        total, known = load_incremental_state(bucket_name)
+
+    candidates = set(sources) | set(known) if keys is None or total is None else set(keys)
+    changed = sorted(key for key in candidates if key in sources and known.get(key) != sources[key])
+    removed = sorted(key for key in candidates if key in known and key not in sources)
+    if total is not None and not changed and not removed:
+        print(f"No source objects changed out of {len(sources)}")
+        return total, known
+
+    # Drop partials of objects that no longer exist
+    for key in removed:
+        s3_client.delete_object(Bucket=bucket_name, Key=partial_key(key))
+
+    fresh, fetched = aggregate_keys(
+        bucket_name, changed, max_workers=max_workers,
+        on_partial=lambda key, etag, aggregates: save_partial(bucket_name, key, etag, aggregates)
+    )
+    unchanged = sorted(set(known) - set(changed) - set(removed))
+    etags = {key: known[key] for key in unchanged}
+    etags.update(fetched)
+
+    if total is not None and not removed and not any(key in known for key in changed):
+        with METRICS.stage('merge'):
+            merged = merge_aggregates([total, fresh])
+    else:
+        loaded = []
+        if unchanged:
+            with METRICS.stage('load_partials'), \
+                    ThreadPoolExecutor(max_workers=min(max_workers, len(unchanged))) as executor:
+                loaded = list(executor.map(in_context(lambda key: load_partial(bucket_name, key)), unchanged))
+        with METRICS.stage('merge'):
+            merged = merge_aggregates([fresh] + loaded)
+
+    save_incremental_state(bucket_name, merged, etags)
+    print(f"Recomputed {len(changed)} of {len(sources)} source objects")
+    return merged, etags
+
+
+def current_results_version(bucket_name):
+    try:
+        results_obj = s3_client.get_object(Bucket=bucket_name, Key=RESULTS_KEY)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+            return None
+        raise
+    return json.loads(results_obj['Body'].read()).get('version')
+
+
+def publish_results(bucket_name, values, aggregates, sources):
+    """Publish the averages and aggregate table; returns False when nothing changed.
+
+    ``sources`` maps each source key to the ETag of the object that was read.
+
+    The per-metric files, the legacy aggregate key and a versioned copy of the
+    table are uploaded concurrently. The manifest at RESULTS_KEY is written last,
+    as one PUT, so it only ever points at a complete set of outputs. If any
+    upload fails the manifest keeps its old version and the next run retries.
+
+    Only the manifest and the versioned table it names are consistent. The
+    per-metric files and the legacy AGGREGATES_KEY are overwritten in place
+    before the manifest, so a reader of those may briefly see a mix of old and
+    new values. Versioned tables older than the previous one are deleted once
+    the new manifest is in place; the previous one stays for readers that still
+    hold the old manifest.
+    """
+    version = results_version(values, sources, AGGREGATE_FEATURES)
+    previous_version = current_results_version(bucket_name)
+    if previous_version == version:
+        print(f"Results unchanged (version {version}); skipping publication")
+        return False
+
+    aggregates_buffer = BytesIO()
+    aggregates.to_parquet(aggregates_buffer, index=False)
+    parquet = aggregates_buffer.getvalue()
+    aggregates_key = f"{RESULTS_PREFIX}{version}/{AGGREGATES_KEY}"
+
+    uploads = [
+        (aggregates_key, parquet, 'application/vnd.apache.parquet'),
+        # Columnar aggregate table for arbitrary threshold/feature/type queries
+        (AGGREGATES_KEY, parquet, 'application/vnd.apache.parquet'),
+    ]
+    for name, value in values.items():
+        uploads.append((RESULT_FILES[name], json.dumps({name: value}), 'application/json'))
+
+    with ThreadPoolExecutor(max_workers=len(uploads)) as executor:
+        list(executor.map(
+            lambda upload: s3_client.put_object(Bucket=bucket_name, Key=upload[0], Body=upload[1], ContentType=upload[2]),
+            uploads
+        ))
+
+    manifest = {'version': version, **values, 'aggregates_key': aggregates_key}
+    s3_client.put_object(
+        Bucket=bucket_name,
+        Key=RESULTS_KEY,
+        Body=json.dumps(manifest),
+        ContentType='application/json'
+    )
+    print(f"Published results version {version}")
+
+    try:
+        pruned = prune_result_versions(s3_client, bucket_name, keep={version, previous_version})
+        if pruned:
+            print(f"Deleted {pruned} objects of older result versions")
+    except Exception as e:
+        # Left for the next publication to clean up
+        print(f"Could not prune older result versions: {e}")
+    return True
+
+
 def lambda_handler(event, context):
     # Log the event for debugging purposes
     print(f"Received event: {json.dumps(event)}")
 
-    # Extract bucket name and object keys from the event
+    # Extract bucket name from the event
     bucket_name = event['Records'][0]['s3']['bucket']['name']
-    red_wine_key = 'winequality-red.csv'
-    white_wine_key = 'winequality-white.csv'
-    
-    try:
-        # Fetch the red wine and white wine CSV files from S3
-        red_wine_obj = s3_client.get_object(Bucket=bucket_name, Key=red_wine_key)
-        white_wine_obj = s3_client.get_object(Bucket=bucket_name, Key=white_wine_key)
-        
-        # Read the CSV contents into DataFrames
-        red_wine_content = red_wine_obj['Body'].read().decode('utf-8')
-        white_wine_content = white_wine_obj['Body'].read().decode('utf-8')
+    function_name = getattr(context, 'function_name', None) or os.getenv('AWS_LAMBDA_FUNCTION_NAME', 'local')
 
-        red_wine = pd.read_csv(StringIO(red_wine_content), delimiter=';')
-        white_wine = pd.read_csv(StringIO(white_wine_content), delimiter=';')
+    # Fresh metrics per invocation, so concurrent local invocations do not share counters
+    metrics = InvocationMetrics()
+    token = current_metrics.set(metrics)
+    try:
+        if not LAMBDA_PROFILE:
+            result = process_event(event, bucket_name)
+        else:
+            with Profiler(LAMBDA_PROFILE) as profiler:
+                result = process_event(event, bucket_name)
+            request_id = getattr(context, 'aws_request_id', None) or str(int(time.time() * 1000))
+            try:
+                print(f"Profile written to {profiler.save(s3_client, bucket_name, request_id, LAMBDA_PROFILE_DIR)}")
+            except Exception as e:
+                print(f"Could not write profile: {e}")
+    finally:
+        current_metrics.reset(token)
 
-        # Add a new column for wine type
-        red_wine["wine_type"] = 'red'
-        white_wine["wine_type"] = 'white'
+    # One structured line per invocation; CloudWatch extracts the metrics from it
+    metrics.log(function_name, result['statusCode'])
+    return result
 
-        # Concatenate the two dataframes
-        wine = pd.concat([red_wine, white_wine], ignore_index=True)
 
-        # Separate high and low-quality wines
-        high_quality_wine = wine[wine["quality"] >= 7]
-        low_quality_wine = wine[wine['quality'] <= 4]
+def process_event(event, bucket_name):
+    try:
+        if event.get('keys') or not INCREMENTAL_AGGREGATION:
+            # Full pass over the keys given in the event, otherwise every winequality-* object in the bucket
+            with METRICS.stage('list'):
+                source_keys = event.get('keys') or list_source_keys(bucket_name)
+            if not source_keys:
+                raise ValueError(f"No {SOURCE_PREFIX}* source objects found in {bucket_name}")
+            aggregates, sources = aggregate_keys(bucket_name, source_keys)
+        else:
+            # Only recompute the objects (of the event's changed_keys, if given) whose ETag
+            # changed and fold them into the running total
+            aggregates, sources = incremental_aggregate(bucket_name, keys=event.get('changed_keys'))
+            if aggregates.empty:
+                raise ValueError(f"No {SOURCE_PREFIX}* source objects found in {bucket_name}")
 
         # Calculate average quality for both high and low quality wines
-        high_average_quality = round(high_quality_wine['quality'].mean(), 2)
-        low_average_quality = round(low_quality_wine['quality'].mean(), 2)
-
-        # Prepare the high and low average quality data as dictionaries
-        high_quality_avg_data = {'high_average_quality': high_average_quality}
-        low_quality_avg_data = {'low_average_quality': low_average_quality}
-
-        # Convert the dictionaries to JSON strings
-        high_quality_avg_json = json.dumps(high_quality_avg_data)
-        low_quality_avg_json = json.dumps(low_quality_avg_data)
-        
-        # Define the S3 keys for saving the high and low quality average data
-        high_quality_avg_key = 'high_quality_average.json'
-        low_quality_avg_key = 'low_quality_average.json'
-
-        # Upload the high quality average data to S3
-        s3_client.put_object(
-            Bucket=bucket_name,
-            Key=high_quality_avg_key,
-            Body=high_quality_avg_json,
-            ContentType='application/json'
-        )
-
-        # Upload the low quality average data to S3
-        s3_client.put_object(
-            Bucket=bucket_name,
-            Key=low_quality_avg_key,
-            Body=low_quality_avg_json,
-            ContentType='application/json'
-        )
+        high_average_quality = quality_average(aggregates, min_quality=HIGH_QUALITY_MIN)
+        low_average_quality = quality_average(aggregates, max_quality=LOW_QUALITY_MAX)
+
+        with METRICS.stage('upload'):
+            publish_results(bucket_name, {
+                'high_average_quality': high_average_quality,
+                'low_average_quality': low_average_quality,
+            }, aggregates, sources)
 
         # Return the result in the Lambda response
         return {
@@ -0,0 +1,183 @@
+"""Pandas-free Lambda handler for the high/low quality averages.
+
+Only the stdlib, boto3 (which the Lambda runtime already ships) and the
+stdlib-only results_manifest are imported, so this module can be deployed without the AWSSDKPandas layer and
+cold-starts without loading pandas/numpy/pyarrow. It writes the same
+high_quality_average.json / low_quality_average.json and quality_results.json
+manifest as lambda_function but not the Parquet aggregate table; the manifest
+says so with ``aggregates_key: null``.
+"""
+import csv
+import codecs
+import json
+import os
+import boto3
+from concurrent.futures import ThreadPoolExecutor
+from results_manifest import prune_result_versions, results_version
+
+# Created once per container and reused across invocations
+s3_client = boto3.client('s3')
+
+HIGH_QUALITY_MIN = 7
+LOW_QUALITY_MAX = 4
+STREAM_CHUNK_SIZE = int(os.getenv('STREAM_CHUNK_SIZE', 1024 * 1024))
+SOURCE_PREFIX = 'winequality-'
+SOURCE_SUFFIX = '.csv'
+# Formats only lambda_function can read (they need gzip/zstd streams or pyarrow)
+UNSUPPORTED_SUFFIXES = ('.csv.gz', '.csv.zst', '.parquet')
+FETCH_MAX_WORKERS = int(os.getenv('FETCH_MAX_WORKERS', 8))
+RESULTS_KEY = 'quality_results.json'
+RESULT_FILES = {
+    'high_average_quality': 'high_quality_average.json',
+    'low_average_quality': 'low_quality_average.json',
+}
+# Only the quality column is read; part of the results version, so it never matches a
+# version of lambda_function that also published the aggregate table
+LEAN_FEATURES = ['quality']
+
+
+def iter_lines(body, chunk_size=STREAM_CHUNK_SIZE):
+    """Yield complete lines from a streaming body read in fixed-size chunks."""
+    remainder = b''
+    for chunk in iter(lambda: body.read(chunk_size), b''):
+        lines = (remainder + chunk).split(b'\n')
+        remainder = lines.pop()
+        yield from lines
+    if remainder:
+        yield remainder
+
+
+def quality_counts(body, chunk_size=STREAM_CHUNK_SIZE):
+    """Count rows per quality score of one CSV body."""
+    lines = codecs.iterdecode(iter_lines(body, chunk_size), 'utf-8')
+    header_line = next(lines, '')
+    if not header_line.strip():
+        return {}
+    # The red/white files use ';', winequality.csv uses ','
+    delimiter = ';' if header_line.count(';') > header_line.count(',') else ','
+    header = next(csv.reader([header_line], delimiter=delimiter))
+    quality_index = [name.strip() for name in header].index('quality')
+
+    counts = {}
+    for row in csv.reader(lines, delimiter=delimiter):
+        if len(row) > quality_index:
+            score = int(float(row[quality_index]))
+            counts[score] = counts.get(score, 0) + 1
+    return counts
+
+
+def fetch_quality_counts(bucket_name, key):
+    """Quality counts of one object and the ETag of the version that was read."""
+    wine_obj = s3_client.get_object(Bucket=bucket_name, Key=key)
+    return quality_counts(wine_obj['Body']), wine_obj['ETag'].strip('"')
+
+
+def check_source_keys(keys):
+    """Fail on compressed CSV or Parquet sources instead of leaving them out of the averages."""
+    unsupported = [key for key in keys if not key.endswith(SOURCE_SUFFIX)]
+    if unsupported:
+        raise ValueError(f"The lean handler only reads plain {SOURCE_SUFFIX} sources; "
+                         f"deploy lambda_function for {unsupported}")
+    return keys
+
+
+def list_source_keys(bucket_name):
+    keys = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=SOURCE_PREFIX):
+        keys.extend(obj['Key'] for obj in page.get('Contents', [])
+                    if obj['Key'].endswith((SOURCE_SUFFIX,) + UNSUPPORTED_SUFFIXES))
+    return check_source_keys(sorted(keys))
+
+
+def average_quality(counts, keep):
+    selected = {score: count for score, count in counts.items() if keep(score)}
+    total = sum(selected.values())
+    if total == 0:
+        return None
+    return round(sum(score * count for score, count in selected.items()) / total, 2)
+
+
+def current_results_version(bucket_name):
+    try:
+        results_obj = s3_client.get_object(Bucket=bucket_name, Key=RESULTS_KEY)
+    except s3_client.exceptions.NoSuchKey:
+        return None
+    return json.loads(results_obj['Body'].read()).get('version')
+
+
+def publish_results(bucket_name, values, sources):
+    """Upload the per-metric files concurrently, then the manifest; skip unchanged results.
+
+    The version is derived like lambda_function's, from the values and the
+    source keys and ETags in ``sources``. Only the manifest is consistent: the
+    per-metric files are overwritten in place before it. Versioned aggregate
+    tables of lambda_function older than the previous manifest are deleted.
+    """
+    version = results_version(values, sources, LEAN_FEATURES)
+    previous_version = current_results_version(bucket_name)
+    if previous_version == version:
+        print(f"Results unchanged (version {version}); skipping publication")
+        return False
+    with ThreadPoolExecutor(max_workers=len(values)) as executor:
+        list(executor.map(lambda item: s3_client.put_object(
+            Bucket=bucket_name,
+            Key=RESULT_FILES[item[0]],
+            Body=json.dumps({item[0]: item[1]}),
+            ContentType='application/json'
+        ), values.items()))
+    s3_client.put_object(
+        Bucket=bucket_name,
+        Key=RESULTS_KEY,
+        Body=json.dumps({'version': version, **values, 'aggregates_key': None}),
+        ContentType='application/json'
+    )
+    try:
+        prune_result_versions(s3_client, bucket_name, keep={version, previous_version})
+    except Exception as e:
+        print(f"Could not prune older result versions: {e}")
+    return True
+
+
+def lambda_handler(event, context):
+    print(f"Received event: {json.dumps(event)}")
+    bucket_name = event['Records'][0]['s3']['bucket']['name']
+
+    try:
+        source_keys = check_source_keys(event.get('keys') or list_source_keys(bucket_name))
+        if not source_keys:
+            raise ValueError(f"No {SOURCE_PREFIX}*{SOURCE_SUFFIX} objects found in {bucket_name}")
+
+        counts = {}
+        sources = {}
+        with ThreadPoolExecutor(max_workers=min(FETCH_MAX_WORKERS, len(source_keys))) as executor:
+            fetched = executor.map(lambda key: fetch_quality_counts(bucket_name, key), source_keys)
+            for key, (partial, etag) in zip(source_keys, fetched):
+                sources[key] = etag
+                for score, count in partial.items():
+                    counts[score] = counts.get(score, 0) + count
+
+        high_average_quality = average_quality(counts, lambda score: score >= HIGH_QUALITY_MIN)
+        low_average_quality = average_quality(counts, lambda score: score <= LOW_QUALITY_MAX)
+
+        publish_results(bucket_name, {
+            'high_average_quality': high_average_quality,
+            'low_average_quality': low_average_quality,
+        }, sources)
+
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                'high_average_quality': high_average_quality,
+                'low_average_quality': low_average_quality
+            })
+        }
+
+    except Exception as e:
+        print(f"Error processing files: {e}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps({
+                'message': f"Error processing files: {str(e)}"
+            })
+        }
@@ -0,0 +1,173 @@
+"""Per-invocation stage timings for lambda_function, logged as one CloudWatch EMF line.
+
+Stages run on several download threads at once, so a stage's time is the sum
+over threads and the stages can add up to more than the wall-clock duration.
+"""
+import contextvars
+import cProfile
+import io
+import json
+import os
+import pstats
+import resource
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+EMF_NAMESPACE = os.getenv('EMF_NAMESPACE', 'DataKA/QualityAggregation')
+
+# Profiler reports go to s3://<bucket>/profiles/ unless a local directory is given
+PROFILE_PREFIX = 'profiles/'
+PROFILE_TOP_N = 50
+
+
+def peak_memory_mb():
+    # ru_maxrss is in kilobytes on Linux, the Lambda platform
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+class InvocationMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started_at = time.perf_counter()
+            self.stages = {}
+            self.counters = {'bytes_processed': 0, 'rows_processed': 0}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.stages[name] = self.stages.get(name, 0.0) + elapsed
+
+    def add(self, name, amount):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def timed_body(self, body, stage='download'):
+        """Wrap a streaming body so reads count towards ``stage`` and bytes_processed."""
+        return TimedBody(body, self, stage)
+
+    def emf_record(self, function_name, status):
+        """One Embedded Metric Format document with the stage timings in milliseconds."""
+        with self.lock:
+            values = {f'{name}_ms': round(seconds * 1000, 3) for name, seconds in self.stages.items()}
+            counters = dict(self.counters)
+        values['duration_ms'] = round((time.perf_counter() - self.started_at) * 1000, 3)
+        metrics = [{'Name': name, 'Unit': 'Milliseconds'} for name in values]
+        metrics += [{'Name': name, 'Unit': 'Bytes' if name.startswith('bytes') else 'Count'} for name in counters]
+        metrics.append({'Name': 'peak_memory_mb', 'Unit': 'Megabytes'})
+        return {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': EMF_NAMESPACE,
+                    'Dimensions': [['FunctionName']],
+                    'Metrics': metrics,
+                }],
+            },
+            'FunctionName': function_name,
+            'status': status,
+            **values,
+            **counters,
+            'peak_memory_mb': peak_memory_mb(),
+        }
+
+    def log(self, function_name, status):
+        print(json.dumps(self.emf_record(function_name, status)))
+
+
+# InvocationMetrics of the invocation running in the current context
+current_metrics = contextvars.ContextVar('current_metrics')
+
+
+class CurrentMetrics:
+    """Proxy to the current invocation's InvocationMetrics, or ``default`` outside one.
+
+    Lets concurrent local invocations each log their own EMF line. Executor
+    threads do not inherit the context, so wrap their tasks with ``in_context``.
+    """
+
+    def __init__(self, default):
+        self.default = default
+
+    def __getattr__(self, name):
+        return getattr(current_metrics.get(self.default), name)
+
+
+def in_context(fn):
+    """Bind ``fn`` to the caller's context so pool threads record into the same invocation."""
+    context = contextvars.copy_context()
+    return lambda *args: context.copy().run(fn, *args)
+
+
+class TimedBody:
+    def __init__(self, body, metrics, stage):
+        self.body = body
+        self.metrics = metrics
+        self.stage = stage
+
+    def read(self, size=-1):
+        with self.metrics.stage(self.stage):
+            data = self.body.read(size)
+        self.metrics.add('bytes_processed', len(data))
+        return data
+
+
+class Profiler:
+    """cProfile or tracemalloc around one invocation; ``report()`` returns the text profile."""
+
+    def __init__(self, mode):
+        if mode not in ('cprofile', 'tracemalloc'):
+            raise ValueError(f"Unknown profile mode: {mode}")
+        self.mode = mode
+        self.profile = None
+        self.snapshot = None
+
+    def __enter__(self):
+        if self.mode == 'cprofile':
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        else:
+            tracemalloc.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.mode == 'cprofile':
+            self.profile.disable()
+        else:
+            self.snapshot = tracemalloc.take_snapshot()
+            self.traced_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    def report(self):
+        out = io.StringIO()
+        if self.mode == 'cprofile':
+            pstats.Stats(self.profile, stream=out).sort_stats('cumulative').print_stats(PROFILE_TOP_N)
+        else:
+            out.write(f"Peak traced memory: {self.traced_peak / (1024 * 1024):.1f} MB\n")
+            for stat in self.snapshot.statistics('lineno')[:PROFILE_TOP_N]:
+                out.write(f"{stat}\n")
+        return out.getvalue()
+
+    def save(self, s3_client, bucket_name, name, directory=None):
+        """Write the report to ``directory`` if given, else to s3://bucket/profiles/; returns its location."""
+        filename = f"{name}.{self.mode}.txt"
+        body = self.report()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, filename)
+            with open(path, 'w') as f:
+                f.write(body)
+            return path
+        key = f"{PROFILE_PREFIX}{filename}"
+        s3_client.put_object(Bucket=bucket_name, Key=key, Body=body.encode('utf-8'), ContentType='text/plain')
+        return f"s3://{bucket_name}/{key}"
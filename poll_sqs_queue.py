@@ -1,55 +1,554 @@
+import asyncio
 import boto3
 import json
+import signal
+import threading
 import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import unquote_plus
 
-def poll_sqs_queue(queue_url, region='eu-north-1'):
+# SQS limits for a single receive / batch call
+MAX_RECEIVE_MESSAGES = 10
+MAX_BATCH_ENTRIES = 10
+# Longest a handled message waits for a full delete batch before it is acknowledged anyway
+ACK_FLUSH_SECONDS = 1.0
+# Pause before retrying a failed receive
+RECEIVE_RETRY_SECONDS = 1.0
 
-    sqs = boto3.client('sqs', region_name=region)
-    
-    print(f"Starting to poll SQS queue: {queue_url}")
-    print("Press Ctrl+C to stop polling")
-    print("-" * 50)
-    
+
+def parse_s3_records(message):
+    """Extract S3 event records from an SQS message body.
+
+    Handles both the SNS-wrapped shape (``body['Message']``) and the raw
+    ``Records`` shape S3 sends when it notifies the queue directly.
+    """
+    body = json.loads(message['Body'])
+    if 'Message' in body:
+        body = json.loads(body['Message'])
+    return [record for record in body.get('Records', []) if 's3' in record]
+
+
+def print_s3_event(message):
     try:
-        while True:
-            response = sqs.receive_message(
-                QueueUrl=queue_url,
-                MaxNumberOfMessages=5,
-                WaitTimeSeconds=10
+        records = parse_s3_records(message)
+    except (ValueError, TypeError, KeyError):
+        print("Could not parse message")
+        return
+    for record in records:
+        print(f"New file uploaded: {record['s3']['object']['key']}")
+        print(f"Bucket: {record['s3']['bucket']['name']}")
+        print(f"Event type: {record.get('eventName')}")
+
+
+def record_identity(record):
+    s3 = record['s3']
+    return s3['bucket']['name'], s3['object']['key']
+
+
+def sequencer_value(record):
+    # Sequencers are hex strings ordered per key; compare them numerically
+    return int(record['s3']['object'].get('sequencer') or '0', 16)
+
+
+class CoalescingWindow:
+    def __init__(self):
+        self.records = {}  # (bucket, key) -> latest record
+        self.seen = set()
+        self.duplicates = 0
+        self.done = threading.Event()
+        self.error = None
+
+    def add(self, records):
+        for record in records:
+            bucket, key = record_identity(record)
+            identity = (bucket, key, record['s3']['object'].get('sequencer'))
+            if identity in self.seen:
+                self.duplicates += 1
+                continue
+            self.seen.add(identity)
+            current = self.records.get((bucket, key))
+            if current is None or sequencer_value(record) >= sequencer_value(current):
+                self.records[(bucket, key)] = record
+
+    def events(self):
+        """One S3-style event per bucket holding the latest record of every changed key."""
+        by_bucket = {}
+        for (bucket, key), record in sorted(self.records.items()):
+            by_bucket.setdefault(bucket, []).append(record)
+        return [{'Records': records} for records in by_bucket.values()]
+
+
+class EventCoalescer:
+    """Collect S3 event records for ``window_seconds`` and process each window once.
+
+    Records are deduplicated by bucket/key/sequencer and only the latest event per
+    key is kept. ``process(event)`` is then called once per bucket with all changed
+    keys of the window. ``submit`` blocks until its window has been processed and
+    re-raises processing errors, so messages are only acknowledged after the
+    aggregation pass that covers them succeeded.
+    """
+
+    def __init__(self, process, window_seconds=5.0):
+        self.process = process
+        self.window_seconds = window_seconds
+        self.lock = threading.Lock()
+        self.window = None
+        self.records_received = 0
+        self.duplicates = 0
+        self.windows_processed = 0
+        self.process_calls = 0
+
+    def submit(self, records):
+        with self.lock:
+            window = self.window
+            if window is None:
+                window = self.window = CoalescingWindow()
+                timer = threading.Timer(self.window_seconds, self._flush, args=(window,))
+                timer.daemon = True
+                timer.start()
+            self.records_received += len(records)
+            window.add(records)
+        window.done.wait()
+        if window.error is not None:
+            raise window.error
+
+    def _flush(self, window):
+        with self.lock:
+            if self.window is window:
+                self.window = None
+            self.duplicates += window.duplicates
+        try:
+            for event in window.events():
+                self.process(event)
+                self.process_calls += 1
+        except Exception as e:
+            print(f"Error processing coalesced window: {e}")
+            window.error = e
+        finally:
+            self.windows_processed += 1
+            window.done.set()
+
+    def handle_message(self, message):
+        """SQS message handler that routes the message's S3 records through the window."""
+        records = parse_s3_records(message)
+        if records:
+            self.submit(records)
+
+
+# One local handler run per bucket at a time: runs read-modify-write the bucket's running total
+_bucket_locks = defaultdict(threading.Lock)
+_bucket_locks_lock = threading.Lock()
+
+
+def run_lambda_locally(event):
+    """Run lambda_handler once per bucket in ``event``, restricted to the objects it names.
+
+    The object keys go in as ``changed_keys``, so the handler only recomputes
+    those instead of diffing the whole bucket.
+    """
+    # Imported lazily so plain polling does not pull in pandas
+    from lambda_function import lambda_handler
+    by_bucket = defaultdict(list)
+    for record in event['Records']:
+        by_bucket[record['s3']['bucket']['name']].append(record)
+
+    results = []
+    for bucket_name, records in by_bucket.items():
+        changed_keys = sorted({unquote_plus(record['s3']['object']['key']) for record in records})
+        with _bucket_locks_lock:
+            lock = _bucket_locks[bucket_name]
+        with lock:
+            result = lambda_handler({'Records': records, 'changed_keys': changed_keys}, None)
+        if result['statusCode'] != 200:
+            raise RuntimeError(result['body'])
+        results.append(result)
+    return results[-1] if results else None
+
+
+class SQSBatchConsumer:
+    """Drain an SQS queue with batched receives, a worker pool and batched deletes.
+
+    ``handler(message)`` runs on a worker thread. Messages whose handler returns
+    are acknowledged with ``delete_message_batch``; messages whose handler raises
+    are left on the queue for redelivery. While a message is still being handled
+    its visibility timeout is extended every ``heartbeat_interval`` seconds.
+    Acknowledgements are deleted once a batch is full or the oldest has waited
+    ``ack_flush_seconds``, so a trickle of messages is not redelivered.
+    """
+
+    def __init__(self, queue_url, handler=print_s3_event, sqs_client=None, region='eu-north-1',
+                 max_workers=8, wait_time_seconds=10, visibility_timeout=60, heartbeat_interval=None,
+                 ack_flush_seconds=ACK_FLUSH_SECONDS):
+        self.queue_url = queue_url
+        self.handler = handler
+        self.sqs = sqs_client or boto3.client('sqs', region_name=region)
+        self.max_workers = max_workers
+        # Keep one receive batch buffered on top of the busy workers
+        self.max_in_flight = max_workers + MAX_RECEIVE_MESSAGES
+        self.wait_time_seconds = wait_time_seconds
+        self.visibility_timeout = visibility_timeout
+        self.heartbeat_interval = heartbeat_interval or visibility_timeout / 2
+        self.in_flight = {}  # receipt handle -> time the message was received
+        self.in_flight_lock = threading.Lock()
+        self.pending_acks = []
+        self.pending_acks_since = None
+        self.ack_flush_seconds = ack_flush_seconds
+        self.processed = 0
+        self.failed = 0
+        self.visibility_extensions = 0
+        self.started_at = None
+
+    def _receive(self, max_messages):
+        response = self.sqs.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=max_messages,
+            WaitTimeSeconds=self.wait_time_seconds,
+            VisibilityTimeout=self.visibility_timeout
+        )
+        return response.get('Messages', [])
+
+    def _handle(self, message):
+        try:
+            self.handler(message)
+            return message['ReceiptHandle'], True
+        except Exception as e:
+            print(f"Error handling message {message.get('MessageId')}: {e}")
+            return message['ReceiptHandle'], False
+        finally:
+            with self.in_flight_lock:
+                self.in_flight.pop(message['ReceiptHandle'], None)
+
+    def _flush_acks(self, force=False):
+        if self.pending_acks_since is not None and time.monotonic() - self.pending_acks_since >= self.ack_flush_seconds:
+            force = True
+        while self.pending_acks and (force or len(self.pending_acks) >= MAX_BATCH_ENTRIES):
+            batch, self.pending_acks = self.pending_acks[:MAX_BATCH_ENTRIES], self.pending_acks[MAX_BATCH_ENTRIES:]
+            response = self.sqs.delete_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[{'Id': str(i), 'ReceiptHandle': handle} for i, handle in enumerate(batch)]
             )
-            
-            if 'Messages' in response:
-                for message in response['Messages']:
-                    receipt_handle = message['ReceiptHandle']
-                    
-                    try:
-                        body = json.loads(message['Body'])
-                        if 'Message' in body:
-                            s3_event = json.loads(body['Message'])
-                            if 'Records' in s3_event:
-                                for record in s3_event['Records']:
-                                    if 's3' in record:
-                                        bucket = record['s3']['bucket']['name']
-                                        file_name = record['s3']['object']['key']
-                                        print(f"New file uploaded: {file_name}")
-                                        print(f"Bucket: {bucket}")
-                                        print(f"Event type: {record['eventName']}")
-                                        
-                    except:
-                        print("Could not parse message")
-
-                    sqs.delete_message(
-                        QueueUrl=queue_url,
-                        ReceiptHandle=receipt_handle
+            for failure in response.get('Failed', []):
+                print(f"Could not delete message: {failure.get('Message')}")
+        if not self.pending_acks:
+            self.pending_acks_since = None
+
+    def _heartbeat(self, stop):
+        while not stop.wait(self.heartbeat_interval / 2):
+            now = time.monotonic()
+            with self.in_flight_lock:
+                due = [handle for handle, since in self.in_flight.items() if now - since >= self.heartbeat_interval]
+                for handle in due:
+                    self.in_flight[handle] = now
+            for i in range(0, len(due), MAX_BATCH_ENTRIES):
+                batch = due[i:i + MAX_BATCH_ENTRIES]
+                try:
+                    self.sqs.change_message_visibility_batch(
+                        QueueUrl=self.queue_url,
+                        Entries=[
+                            {'Id': str(j), 'ReceiptHandle': handle, 'VisibilityTimeout': self.visibility_timeout}
+                            for j, handle in enumerate(batch)
+                        ]
                     )
+                except Exception as e:
+                    # Keep the thread alive; a later beat retries these handles
+                    print(f"Could not extend visibility on {self.queue_url}: {e}")
+                    continue
+                self.visibility_extensions += len(batch)
+
+    def _collect(self, futures, block):
+        done, _ = wait(futures, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+        for future in done:
+            futures.remove(future)
+            receipt_handle, ok = future.result()
+            if ok:
+                self.processed += 1
+                if not self.pending_acks:
+                    self.pending_acks_since = time.monotonic()
+                self.pending_acks.append(receipt_handle)
             else:
-                print(".", end="", flush=True)
-                time.sleep(2)
-            
+                self.failed += 1
+        self._flush_acks()
+
+    def run(self, max_empty_receives=None, stop_event=None):
+        """Consume until stopped, interrupted, or after ``max_empty_receives`` empty receives in a row."""
+        stop_event = stop_event or threading.Event()
+        heartbeat_stop = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(heartbeat_stop,), daemon=True)
+        heartbeat.start()
+
+        futures = set()
+        empty_receives = 0
+        self.started_at = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                while not stop_event.is_set():
+                    # Bound the number of received-but-unfinished messages
+                    while len(futures) > self.max_workers:
+                        self._collect(futures, block=True)
+
+                    messages = self._receive(min(MAX_RECEIVE_MESSAGES, self.max_in_flight - len(futures)))
+                    if not messages:
+                        self._collect(futures, block=False)
+                        self._flush_acks(force=True)
+                        empty_receives += 1
+                        if max_empty_receives is not None and empty_receives >= max_empty_receives and not futures:
+                            break
+                        continue
+                    empty_receives = 0
+
+                    now = time.monotonic()
+                    with self.in_flight_lock:
+                        for message in messages:
+                            self.in_flight[message['ReceiptHandle']] = now
+                    for message in messages:
+                        futures.add(executor.submit(self._handle, message))
+                    self._collect(futures, block=False)
+
+                while futures:
+                    self._collect(futures, block=True)
+        finally:
+            # Handlers that finished while the pool shut down (e.g. after Ctrl+C) still get acknowledged
+            futures = {future for future in futures if not future.cancelled()}
+            if futures:
+                self._collect(futures, block=False)
+            heartbeat_stop.set()
+            heartbeat.join()
+            self._flush_acks(force=True)
+
+        return self.report()
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started_at if self.started_at else 0.0
+        return {
+            'processed': self.processed,
+            'failed': self.failed,
+            'visibility_extensions': self.visibility_extensions,
+            'elapsed_seconds': round(elapsed, 3),
+            'messages_per_second': round(self.processed / elapsed, 2) if elapsed > 0 else 0.0,
+        }
+
+
+class AsyncSQSPoller:
+    """Poll several SQS queues from one event loop and feed S3 changes to a worker pool.
+
+    One receiver per queue long-polls and pushes ``(queue_url, message, records)``
+    onto a bounded work queue. When ``max_pending`` items are waiting, the
+    receivers block on ``put`` and stop receiving, which is the backpressure.
+    ``max_concurrency`` workers turn each message's records into per-bucket
+    events and run ``process(event)`` off the loop. A message is deleted once
+    all its events succeed and otherwise left for redelivery. Queued and
+    in-flight messages get their visibility extended every
+    ``heartbeat_interval`` seconds, like SQSBatchConsumer, so a deep work queue
+    does not cause redeliveries. ``stop()`` ends receiving and the queued and
+    in-flight work is drained before ``run`` returns.
+    """
+
+    def __init__(self, queue_urls, process=run_lambda_locally, sqs_client=None, region='eu-north-1',
+                 max_concurrency=4, max_pending=100, wait_time_seconds=10, visibility_timeout=60,
+                 heartbeat_interval=None):
+        self.queue_urls = list(queue_urls)
+        self.process = process
+        self.sqs = sqs_client or boto3.client('sqs', region_name=region)
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.wait_time_seconds = wait_time_seconds
+        self.visibility_timeout = visibility_timeout
+        self.heartbeat_interval = heartbeat_interval or visibility_timeout / 2
+        self.stopping = None
+        self.work = None
+        self.pending = {}  # receipt handle -> (queue url, last time its visibility was set)
+        self.received = 0
+        self.processed = 0
+        self.failed = 0
+        self.delete_errors = 0
+        self.visibility_extensions = 0
+        self.peak_pending = 0
+        self.started_at = None
+
+    def stop(self):
+        if self.stopping is not None:
+            self.stopping.set()
+
+    async def _receive(self, queue_url, max_empty_receives):
+        empty_receives = 0
+        while not self.stopping.is_set():
+            # Never ask for more than the work queue can take right now
+            room = max(1, min(MAX_RECEIVE_MESSAGES, self.max_pending - self.work.qsize()))
+            try:
+                response = await asyncio.to_thread(
+                    self.sqs.receive_message,
+                    QueueUrl=queue_url,
+                    MaxNumberOfMessages=room,
+                    WaitTimeSeconds=self.wait_time_seconds,
+                    VisibilityTimeout=self.visibility_timeout
+                )
+            except Exception as e:
+                print(f"Error receiving from {queue_url}: {e}")
+                await asyncio.sleep(RECEIVE_RETRY_SECONDS)
+                continue
+            messages = response.get('Messages', [])
+            if not messages:
+                empty_receives += 1
+                if max_empty_receives is not None and empty_receives >= max_empty_receives:
+                    return
+                continue
+            empty_receives = 0
+            self.received += len(messages)
+            for message in messages:
+                try:
+                    records = parse_s3_records(message)
+                except (ValueError, TypeError, KeyError):
+                    # Left invisible until the timeout; a redrive policy moves it to the DLQ
+                    print(f"Could not parse message {message.get('MessageId')}")
+                    self.failed += 1
+                    continue
+                self.pending[message['ReceiptHandle']] = (queue_url, time.monotonic())
+                await self.work.put((queue_url, message, records))
+                self.peak_pending = max(self.peak_pending, self.work.qsize())
+
+    async def _worker(self):
+        while True:
+            item = await self.work.get()
+            try:
+                if item is None:
+                    return
+                queue_url, message, records = item
+                try:
+                    window = CoalescingWindow()
+                    window.add(records)
+                    for event in window.events():
+                        await asyncio.to_thread(self.process, event)
+                except Exception as e:
+                    print(f"Error processing message {message.get('MessageId')}: {e}")
+                    self.failed += 1
+                    continue
+                try:
+                    await asyncio.to_thread(
+                        self.sqs.delete_message, QueueUrl=queue_url, ReceiptHandle=message['ReceiptHandle']
+                    )
+                except Exception as e:
+                    # Processed but still on the queue; it is redelivered once its visibility runs out
+                    print(f"Could not delete message {message.get('MessageId')}: {e}")
+                    self.delete_errors += 1
+                    continue
+                self.processed += 1
+            finally:
+                if item is not None:
+                    self.pending.pop(item[1]['ReceiptHandle'], None)
+                self.work.task_done()
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval / 2)
+            now = time.monotonic()
+            due = {}
+            for handle, (queue_url, since) in self.pending.items():
+                if now - since >= self.heartbeat_interval:
+                    due.setdefault(queue_url, []).append(handle)
+                    self.pending[handle] = (queue_url, now)
+            for queue_url, handles in due.items():
+                for i in range(0, len(handles), MAX_BATCH_ENTRIES):
+                    batch = handles[i:i + MAX_BATCH_ENTRIES]
+                    try:
+                        await asyncio.to_thread(
+                            self.sqs.change_message_visibility_batch,
+                            QueueUrl=queue_url,
+                            Entries=[
+                                {'Id': str(j), 'ReceiptHandle': handle, 'VisibilityTimeout': self.visibility_timeout}
+                                for j, handle in enumerate(batch)
+                            ]
+                        )
+                    except Exception as e:
+                        print(f"Could not extend visibility on {queue_url}: {e}")
+                        continue
+                    self.visibility_extensions += len(batch)
+
+    async def run(self, max_empty_receives=None):
+        """Poll until ``stop()`` or, per queue, ``max_empty_receives`` empty receives in a row."""
+        self.stopping = asyncio.Event()
+        self.work = asyncio.Queue(maxsize=self.max_pending)
+        self.started_at = time.perf_counter()
+        heartbeat = asyncio.create_task(self._heartbeat())
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.max_concurrency)]
+        receivers = [asyncio.create_task(self._receive(url, max_empty_receives)) for url in self.queue_urls]
+
+        stopped = asyncio.create_task(self.stopping.wait())
+        await asyncio.wait([stopped, asyncio.gather(*receivers)], return_when=asyncio.FIRST_COMPLETED)
+        self.stopping.set()
+        # Receivers finish their current long poll; messages they got are still queued
+        await asyncio.gather(*receivers)
+        await self.work.join()
+        for _ in workers:
+            await self.work.put(None)
+        await asyncio.gather(*workers)
+        stopped.cancel()
+        heartbeat.cancel()
+        await asyncio.gather(heartbeat, return_exceptions=True)
+        return self.report()
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started_at if self.started_at else 0.0
+        return {
+            'queues': len(self.queue_urls),
+            'received': self.received,
+            'processed': self.processed,
+            'failed': self.failed,
+            'delete_errors': self.delete_errors,
+            'visibility_extensions': self.visibility_extensions,
+            'peak_pending': self.peak_pending,
+            'elapsed_seconds': round(elapsed, 3),
+            'messages_per_second': round(self.processed / elapsed, 2) if elapsed > 0 else 0.0,
+        }
+
+
+def poll_sqs_queues(queue_urls, region='eu-north-1', max_concurrency=4, max_pending=100, process=run_lambda_locally):
+    """Run an AsyncSQSPoller over ``queue_urls`` until Ctrl+C or SIGTERM, then drain."""
+    poller = AsyncSQSPoller(queue_urls, process=process, region=region,
+                            max_concurrency=max_concurrency, max_pending=max_pending)
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, poller.stop)
+        return await poller.run()
+
+    print(f"Starting to poll {len(queue_urls)} SQS queues")
+    print("Press Ctrl+C to stop polling")
+    print("-" * 50)
+    report = asyncio.run(main())
+    print(f"Processed {report['processed']} messages ({report['messages_per_second']} msg/s)")
+    return report
+
+
+def poll_sqs_queue(queue_url, region='eu-north-1', max_workers=8, coalesce_window=None, process=run_lambda_locally):
+
+    if coalesce_window:
+        # Handlers mostly wait on their window, so allow a whole burst to be in flight
+        coalescer = EventCoalescer(process, window_seconds=coalesce_window)
+        consumer = SQSBatchConsumer(queue_url, handler=coalescer.handle_message, region=region,
+                                    max_workers=max(max_workers, 100))
+    else:
+        consumer = SQSBatchConsumer(queue_url, region=region, max_workers=max_workers)
+
+    print(f"Starting to poll SQS queue: {queue_url}")
+    print("Press Ctrl+C to stop polling")
+    print("-" * 50)
+
+    stop_event = threading.Event()
+    try:
+        report = consumer.run(stop_event=stop_event)
     except KeyboardInterrupt:
+        stop_event.set()
         print("\nStopping SQS polling")
+        report = consumer.report()
+    print(f"Processed {report['processed']} messages ({report['messages_per_second']} msg/s)")
+    return report
 
 if __name__ == "__main__":
 
-    queue_url = input("Enter your SQS Queue URL: ")
-    poll_sqs_queue(queue_url)
\ No newline at end of file
+    queue_urls = [url.strip() for url in input("Enter your SQS Queue URL(s), comma-separated: ").split(',') if url.strip()]
+    if len(queue_urls) > 1:
+        poll_sqs_queues(queue_urls)
+    else:
+        poll_sqs_queue(queue_urls[0])
@@ -0,0 +1,123 @@
+"""Exact per-(wine_type, quality, feature) aggregate tables and how to merge them.
+
+Shared by lambda_function and shard_aggregation. Nothing here creates AWS
+clients, so worker processes can import it without side effects.
+"""
+import os
+from contextlib import nullcontext
+import pandas as pd
+from wine_loader import read_wine_csv
+from quality_kernel import grouped_feature_stats
+
+# Number of bytes read from a streaming body per chunk
+STREAM_CHUNK_SIZE = int(os.getenv('STREAM_CHUNK_SIZE', 1024 * 1024))
+
+# Grouping columns and per-feature statistics of the aggregate artifact
+AGGREGATE_KEYS = ['wine_type', 'quality', 'feature']
+AGGREGATE_STATS = ['count', 'sum', 'sum_sq', 'min', 'max']
+# wine_type of sources whose name is not winequality-red/-white
+UNKNOWN_WINE_TYPE = 'unknown'
+
+
+def empty_aggregates():
+    columns = {key: pd.Series(dtype='object') for key in AGGREGATE_KEYS}
+    columns['quality'] = pd.Series(dtype='int64')
+    columns.update({stat: pd.Series(dtype='float64') for stat in AGGREGATE_STATS})
+    columns['count'] = pd.Series(dtype='int64')
+    return pd.DataFrame(columns)
+
+
+def aggregate_frame(df, wine_type):
+    """Per-feature count/sum/sum_sq/min/max of a frame, grouped by wine type and quality."""
+    wine_type = wine_type or UNKNOWN_WINE_TYPE
+    numeric = [column for column in df.columns if df[column].dtype.kind in 'biuf']
+    levels, stats = grouped_feature_stats(
+        df['quality'].to_numpy(), {column: df[column].to_numpy() for column in numeric}
+    )
+    frames = [
+        pd.DataFrame({'wine_type': wine_type, 'quality': levels.astype('int64'), 'feature': feature, **feature_stats})
+        for feature, feature_stats in stats.items()
+    ]
+    if not frames or len(levels) == 0:
+        return empty_aggregates()
+    grouped = pd.concat(frames, ignore_index=True)
+    grouped = grouped[grouped['count'] > 0].astype({'count': 'int64'})
+    return grouped[AGGREGATE_KEYS + AGGREGATE_STATS].reset_index(drop=True)
+
+
+def merge_aggregates(parts):
+    """Merge partial aggregate tables into one exact aggregate table."""
+    parts = [part for part in parts if len(part)]
+    if not parts:
+        return empty_aggregates()
+    merged = pd.concat(parts, ignore_index=True).groupby(AGGREGATE_KEYS).agg(
+        count=('count', 'sum'),
+        sum=('sum', 'sum'),
+        sum_sq=('sum_sq', 'sum'),
+        min=('min', 'min'),
+        max=('max', 'max'),
+    ).reset_index()
+    merged['quality'] = merged['quality'].astype('int64')
+    return merged[AGGREGATE_KEYS + AGGREGATE_STATS]
+
+
+def quality_average(aggregates, min_quality=None, max_quality=None):
+    """Average quality score of the wines within the given quality range."""
+    rows = aggregates[aggregates['feature'] == 'quality']
+    if min_quality is not None:
+        rows = rows[rows['quality'] >= min_quality]
+    if max_quality is not None:
+        rows = rows[rows['quality'] <= max_quality]
+    count = rows['count'].sum()
+    if count == 0:
+        return None
+    return round(float(rows['sum'].sum() / count), 2)
+
+
+def iter_line_chunks(body, chunk_size=STREAM_CHUNK_SIZE):
+    """Yield (header, lines) blocks of complete lines read from a streaming body."""
+    header = None
+    remainder = b''
+    while True:
+        chunk = body.read(chunk_size)
+        if not chunk:
+            break
+        data = remainder + chunk
+        if header is None:
+            newline = data.find(b'\n')
+            if newline == -1:
+                remainder = data
+                continue
+            header, data = data[:newline + 1], data[newline + 1:]
+        cut = data.rfind(b'\n')
+        if cut == -1:
+            remainder = data
+            continue
+        remainder = data[cut + 1:]
+        yield header, data[:cut + 1]
+    if header is None:
+        # Header-only file without a trailing newline
+        return
+    if remainder.strip():
+        yield header, remainder
+
+
+def stream_aggregates(body, wine_type, delimiter=None, chunk_size=STREAM_CHUNK_SIZE, metrics=None):
+    """Aggregate a CSV body chunk by chunk without holding the whole file.
+
+    ``metrics`` is an optional lambda_metrics.InvocationMetrics that gets the
+    parse/aggregate stage timings and rows_processed.
+    """
+    def stage(name):
+        return metrics.stage(name) if metrics is not None else nullcontext()
+
+    parts = []
+    for header, lines in iter_line_chunks(body, chunk_size):
+        with stage('parse'):
+            chunk = read_wine_csv(header + lines, delimiter=delimiter)
+        if metrics is not None:
+            metrics.add('rows_processed', len(chunk))
+        with stage('aggregate'):
+            # Fold as we go so memory stays bounded by the number of groups
+            parts = [merge_aggregates(parts + [aggregate_frame(chunk, wine_type)])]
+    return merge_aggregates(parts)
@@ -0,0 +1,108 @@
+import numpy as np
+
+# Quality is a score between 0 and 10 (winequality.names, section 7)
+QUALITY_LEVELS = 11
+
+# Rows per block; small enough that the intp/float64 scratch buffers stay in cache
+BLOCK_SIZE = 1 << 16
+
+HIGH_LOW_BANDS = {'high': (7, None), 'low': (None, 4)}
+
+
+def quality_histogram(quality, weights=None, square=False, block_size=BLOCK_SIZE):
+    """Count rows per quality score in a single pass, optionally summing ``weights`` per score.
+
+    Works block by block into reused scratch buffers, so no full-size
+    temporary is allocated however long ``quality`` is. With ``square`` the
+    squared weights are summed instead.
+    """
+    quality = np.asarray(quality)
+    counts = np.zeros(QUALITY_LEVELS, dtype=np.int64)
+    sums = np.zeros(QUALITY_LEVELS, dtype=np.float64) if weights is not None else None
+    index_buffer = np.empty(min(block_size, len(quality)), dtype=np.intp)
+    weight_buffer = np.empty(len(index_buffer), dtype=np.float64) if weights is not None else None
+
+    for start in range(0, len(quality), block_size):
+        block = quality[start:start + block_size]
+        index = index_buffer[:len(block)]
+        index[...] = block
+        counts += np.bincount(index, minlength=QUALITY_LEVELS)
+        if weights is not None:
+            weight = weight_buffer[:len(block)]
+            weight[...] = weights[start:start + block_size]
+            if square:
+                weight *= weight
+            sums += np.bincount(index, weights=weight, minlength=QUALITY_LEVELS)
+    return counts, sums
+
+
+def band_stats(counts, bands):
+    """Count and mean quality of each (low, high) inclusive band from a quality histogram.
+
+    ``None`` leaves a side of the band open, so (7, None) is quality >= 7.
+    """
+    scores = np.arange(QUALITY_LEVELS)
+    results = {}
+    for name, (low, high) in bands.items():
+        selected = np.ones(QUALITY_LEVELS, dtype=bool)
+        if low is not None:
+            selected &= scores >= low
+        if high is not None:
+            selected &= scores <= high
+        count = int(counts[selected].sum())
+        mean = float((counts[selected] * scores[selected]).sum() / count) if count else None
+        results[name] = {'count': count, 'mean': mean}
+    return results
+
+
+def quality_band_stats(quality, bands=HIGH_LOW_BANDS):
+    """Statistics for any set of quality bands from one pass over the quality column."""
+    counts, _ = quality_histogram(quality)
+    return band_stats(counts, bands)
+
+
+def grouped_feature_stats(quality, features):
+    """Per-quality count/sum/sum_sq/min/max of each feature column.
+
+    ``features`` maps names to 1-D arrays aligned with ``quality``. Rows are
+    ordered by quality once (a stable counting sort on the int8 scores) and
+    min/max come from ``reduceat`` over the sorted segments. Returns
+    ``(levels, {feature: {stat: array}})`` for the quality levels present.
+    """
+    quality = np.asarray(quality)
+    counts, _ = quality_histogram(quality)
+    levels = np.flatnonzero(counts)
+    if len(levels) == 0:
+        empty = {'count': np.zeros(0, dtype=np.int64), **{stat: np.zeros(0) for stat in ('sum', 'sum_sq', 'min', 'max')}}
+        return levels, {name: dict(empty) for name in features}
+    order = np.argsort(quality, kind='stable')
+    boundaries = np.concatenate(([0], np.cumsum(counts[levels])[:-1]))
+
+    stats = {}
+    for name, values in features.items():
+        values = np.asarray(values)
+        feature_counts, sums = quality_histogram(quality, weights=values)
+        if np.isnan(sums).any():
+            # Missing values are rare; only then pay for a mask and drop them for this feature
+            valid = ~np.isnan(values)
+            sub_levels, sub_stats = grouped_feature_stats(quality[valid], {name: values[valid]})
+            stats[name] = {stat: _expand(sub_levels, array, levels) for stat, array in sub_stats[name].items()}
+            continue
+        _, sums_sq = quality_histogram(quality, weights=values, square=True)
+        ordered = values[order]
+        stats[name] = {
+            'count': feature_counts[levels],
+            'sum': sums[levels],
+            'sum_sq': sums_sq[levels],
+            'min': np.minimum.reduceat(ordered, boundaries).astype(np.float64),
+            'max': np.maximum.reduceat(ordered, boundaries).astype(np.float64),
+        }
+    return levels, stats
+
+
+def _expand(sub_levels, array, levels):
+    expanded = np.zeros(len(levels), dtype=array.dtype)
+    if array.dtype.kind == 'f':
+        expanded[:] = np.nan
+    expanded[np.searchsorted(levels, sub_levels)] = array
+    return expanded
@@ -0,0 +1,40 @@
+"""Versioning and cleanup of published results, shared by lambda_function and lambda_lean.
+
+Stdlib only, so the lean handler can ship it without the pandas layer.
+"""
+import hashlib
+import json
+
+# Versioned copies of the aggregate table live under results/<version>/
+RESULTS_PREFIX = 'results/'
+# S3 DeleteObjects limit per request
+MAX_DELETE_KEYS = 1000
+
+
+def results_version(values, sources, features):
+    """Hash of the published values, the source keys and ETags they were computed from, and the features.
+
+    The aggregate table itself is not hashed: its float sums depend on merge
+    order, while the same source objects always describe the same table.
+    """
+    digest = hashlib.blake2b(digest_size=12)
+    digest.update(json.dumps({
+        'values': values,
+        'sources': sources,
+        'features': features,
+    }, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def prune_result_versions(s3_client, bucket_name, keep):
+    """Delete the results/<version>/ objects of every version not in ``keep``; returns how many."""
+    stale = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=RESULTS_PREFIX):
+        for obj in page.get('Contents', []):
+            version = obj['Key'][len(RESULTS_PREFIX):].split('/', 1)[0]
+            if version not in keep:
+                stale.append({'Key': obj['Key']})
+    for i in range(0, len(stale), MAX_DELETE_KEYS):
+        s3_client.delete_objects(Bucket=bucket_name, Delete={'Objects': stale[i:i + MAX_DELETE_KEYS], 'Quiet': True})
+    return len(stale)
@@ -0,0 +1,96 @@
+"""Byte-range reads of CSV sources in S3.
+
+A small ranged GET sniffs the header row, so the delimiter and schema are
+known (and malformed files rejected) before any full download. Large objects
+can then be fetched as several ranges in parallel, each trimmed to the
+complete lines that start inside it.
+"""
+import os
+from botocore.exceptions import ClientError
+from wine_loader import detect_delimiter, validate_columns
+
+# First GET when sniffing; doubled until the header line fits, up to the limit
+HEADER_SNIFF_BYTES = 4096
+HEADER_SNIFF_LIMIT = 1024 * 1024
+# Extra bytes fetched past a range end to finish its last line; rows are ~100 bytes
+LINE_OVERLAP_BYTES = 4096
+RANGE_SIZE = int(os.getenv('RANGE_SIZE', 16 * 1024 * 1024))
+
+
+def get_range(s3_client, bucket_name, key, start, end, etag=None):
+    """Bytes [start, end) of an object, plus the GetObject response."""
+    request = {'Bucket': bucket_name, 'Key': key, 'Range': f'bytes={start}-{end - 1}'}
+    if etag:
+        request['IfMatch'] = etag
+    response = s3_client.get_object(**request)
+    return response['Body'].read(), response
+
+
+def sniff_header(s3_client, bucket_name, key, sniff_bytes=HEADER_SNIFF_BYTES):
+    """Read just enough of an object to parse and validate its header row.
+
+    Returns a dict with the ``header`` line, ``delimiter``, normalized
+    ``columns``, the object ``size`` and ``etag``, and the ``data`` read so far
+    (the whole object when it is smaller than the sniff).
+    """
+    while True:
+        try:
+            data, response = get_range(s3_client, bucket_name, key, 0, sniff_bytes)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'InvalidRange':
+                raise
+            # Zero-byte object: nothing to parse
+            return {'header': b'', 'delimiter': ',', 'columns': [], 'size': 0, 'etag': None, 'data': b''}
+        size = int(response['ContentRange'].rsplit('/', 1)[1])
+        newline = data.find(b'\n')
+        if newline != -1 or len(data) >= size:
+            break
+        if sniff_bytes >= HEADER_SNIFF_LIMIT:
+            raise ValueError(f"{key} has no header line in its first {sniff_bytes} bytes")
+        sniff_bytes *= 2
+
+    header = data[:newline + 1] if newline != -1 else data
+    delimiter = detect_delimiter(header)
+    columns = validate_columns(header.decode('utf-8').strip().split(delimiter), source=key)
+    return {
+        'header': header,
+        'delimiter': delimiter,
+        'columns': columns,
+        'size': size,
+        'etag': response['ETag'],
+        'data': data,
+    }
+
+
+def split_ranges(size, data_start, range_size=RANGE_SIZE):
+    """Cut [data_start, size) into (start, end) ranges of about ``range_size`` bytes."""
+    return [(start, min(start + range_size, size)) for start in range(data_start, size, range_size)]
+
+
+def fetch_lines(s3_client, bucket_name, key, start, end, size, etag=None, overlap=LINE_OVERLAP_BYTES):
+    """Complete lines whose first byte lies in [start, end).
+
+    ``start`` must be past the header. The byte before ``start`` is fetched
+    too, so a range that happens to begin on a line boundary keeps that line.
+    The fetch runs ``overlap`` bytes past ``end`` (more if needed) to finish
+    the last line. Concatenating the results of consecutive ranges gives every
+    data line exactly once.
+    """
+    fetch_start = start - 1
+    data, _ = get_range(s3_client, bucket_name, key, fetch_start, min(end + overlap, size), etag)
+    first = data.find(b'\n') + 1
+    if first == 0 or fetch_start + first >= end:
+        # No line starts inside this range
+        return b''
+
+    search_from = end - 1 - fetch_start
+    while True:
+        cut = data.find(b'\n', search_from)
+        if cut != -1:
+            return data[first:cut + 1]
+        fetched_to = fetch_start + len(data)
+        if fetched_to >= size:
+            return data[first:]
+        search_from = len(data)
+        more, _ = get_range(s3_client, bucket_name, key, fetched_to, min(fetched_to + overlap, size), etag)
+        data += more
@@ -0,0 +1,114 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from quality_aggregates import STREAM_CHUNK_SIZE, aggregate_frame, merge_aggregates, stream_aggregates
+from wine_loader import open_decompressed, read_wine_parquet, source_format, wine_type_from_path
+
+# Target bytes per shard when splitting local files
+SHARD_SIZE = 64 * 1024 * 1024
+
+# S3 client of the current worker process, created by init_s3_worker
+worker_s3_client = None
+
+
+class RangeReader:
+    """File-like reader over ``prefix`` followed by bytes [start, end) of a file."""
+
+    def __init__(self, path, start, end, prefix=b''):
+        self.file = open(path, 'rb')
+        self.file.seek(start)
+        self.remaining = end - start
+        self.prefix = prefix
+
+    def read(self, size=-1):
+        if self.prefix:
+            data, self.prefix = self.prefix, b''
+            return data
+        if self.remaining <= 0:
+            return b''
+        size = self.remaining if size is None or size < 0 else min(size, self.remaining)
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_header(path):
+    with open(path, 'rb') as f:
+        return f.readline()
+
+
+def line_aligned_ranges(path, shard_size=SHARD_SIZE):
+    """Split a CSV's data rows into (start, end) byte ranges that begin and end on line boundaries."""
+    size = os.path.getsize(path)
+    ranges = []
+    with open(path, 'rb') as f:
+        start = len(f.readline())
+        while start < size:
+            end = min(start + shard_size, size)
+            if end < size:
+                # Extend to the end of the line the cut falls in
+                f.seek(end)
+                end += len(f.readline())
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def aggregate_byte_range(path, start, end, header, wine_type, chunk_size=STREAM_CHUNK_SIZE):
+    """Worker: aggregate one line-aligned byte range of a local CSV."""
+    with RangeReader(path, start, end, prefix=header) as reader:
+        return stream_aggregates(reader, wine_type, chunk_size=chunk_size)
+
+
+def init_s3_worker(region_name=None):
+    """Process pool initializer: one S3 client per worker, never inherited across a fork."""
+    # boto3 is imported here so local-only sharding never loads it
+    import boto3
+
+    global worker_s3_client
+    worker_s3_client = boto3.client('s3', region_name=region_name)
+
+
+def aggregate_s3_object(bucket_name, key):
+    """Worker: stream one S3 object (CSV, compressed CSV or Parquet) and aggregate it."""
+    wine_obj = worker_s3_client.get_object(Bucket=bucket_name, Key=key)
+    file_format, compression = source_format(key, wine_obj.get('ContentType'), wine_obj.get('ContentEncoding'))
+    wine_type = wine_type_from_path(key)
+    if file_format == 'parquet':
+        return aggregate_frame(read_wine_parquet(wine_obj['Body'].read()), wine_type)
+    return stream_aggregates(open_decompressed(wine_obj['Body'], compression), wine_type)
+
+
+def sharded_aggregate(paths, max_workers=None, shard_size=SHARD_SIZE):
+    """Aggregate local CSVs split into byte-range shards across a process pool.
+
+    Partial tables are merged with merge_aggregates, so counts, min and max
+    are exact and sums match a single-process run up to float rounding.
+    """
+    tasks = []
+    for path in paths:
+        header = read_header(path)
+        wine_type = wine_type_from_path(path)
+        for start, end in line_aligned_ranges(path, shard_size):
+            tasks.append((path, start, end, header, wine_type))
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        parts = list(executor.map(aggregate_byte_range, *zip(*tasks))) if tasks else []
+    return merge_aggregates(parts)
+
+
+def sharded_aggregate_s3(bucket_name, keys, max_workers=None, region_name=None):
+    """Aggregate S3 objects with one shard per object across a process pool."""
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=init_s3_worker,
+                             initargs=(region_name,)) as executor:
+        parts = list(executor.map(aggregate_s3_object, [bucket_name] * len(keys), keys))
+    return merge_aggregates(parts)
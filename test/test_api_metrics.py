@@ -0,0 +1,36 @@
+from api_metrics import MetricsRegistry
+
+
+# === Test: histogram buckets are cumulative and rendered in Prometheus format ===
+def test_histogram_render():
+    registry = MetricsRegistry()
+    latency = registry.histogram('latency_seconds', 'Latency.', labels=('stage',), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        latency.observe(value, 'fetch')
+
+    lines = registry.render().splitlines()
+    assert '# TYPE latency_seconds histogram' in lines
+    assert 'latency_seconds_bucket{stage="fetch",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{stage="fetch",le="1.0"} 3' in lines
+    assert 'latency_seconds_bucket{stage="fetch",le="+Inf"} 4' in lines
+    assert 'latency_seconds_count{stage="fetch"} 4' in lines
+    assert latency.count('fetch') == 4
+
+
+# === Test: counters and gauges track labelled values ===
+def test_counter_and_gauge():
+    registry = MetricsRegistry()
+    responses = registry.counter('responses_total', 'Responses.', labels=('status',))
+    in_flight = registry.gauge('in_flight', 'In flight.')
+    responses.inc(200)
+    responses.inc(200)
+    responses.inc(500)
+    in_flight.inc()
+    in_flight.inc()
+    in_flight.dec()
+
+    text = registry.render()
+    assert 'responses_total{status="200"} 2' in text
+    assert 'responses_total{status="500"} 1' in text
+    assert '# TYPE in_flight gauge' in text
+    assert 'in_flight 1' in text
@@ -1,11 +1,14 @@
 import pytest
 import json
+import gzip
 from unittest.mock import patch, MagicMock
 import boto3
 from moto import mock_aws
 import pandas as pd
 from io import StringIO
+import aws_lambda
 from aws_lambda import S3Utils
+from wine_loader import SOURCE_SUFFIXES
 from io import BytesIO
 
 # Sample CSV data to use in tests
@@ -126,3 +129,98 @@ def test_add_s3_trigger(s3_setup, secrets_manager_setup):
         mock_add_permission.assert_called_once()
         mock_put_notification.assert_called_once()
 
+        # One configuration per accepted source suffix, matching what the loader reads
+        configurations = mock_put_notification.call_args.kwargs['NotificationConfiguration']['LambdaFunctionConfigurations']
+        suffixes = [rule['Value'] for c in configurations for rule in c['Filter']['Key']['FilterRules'] if rule['Name'] == 'suffix']
+        assert tuple(suffixes) == SOURCE_SUFFIXES
+
+
+
+# Test add_s3_to_sqs_notification only subscribes the queue to winequality-* sources
+@mock_aws
+def test_add_s3_to_sqs_notification(s3_setup):
+    s3_utils = S3Utils(bucket_name='dataka', s3_client=s3_setup)
+    s3_utils.create_sqs_queue('my-sqs-queue')
+
+    s3_utils.add_s3_to_sqs_notification('my-sqs-queue')
+
+    configurations = s3_setup.get_bucket_notification_configuration(Bucket='dataka')['QueueConfigurations']
+    assert len(configurations) == len(SOURCE_SUFFIXES)
+    for configuration in configurations:
+        rules = {rule['Name'].lower(): rule['Value'] for rule in configuration['Filter']['Key']['FilterRules']}
+        assert rules['prefix'] == 'winequality-'
+
+
+# Test bulk upload (parallel, skips unchanged files, optional gzip)
+@mock_aws
+def test_bulk_upload_files(s3_setup, tmp_path):
+    s3_utils = S3Utils(bucket_name='dataka')
+
+    files = []
+    for name in ('winequality-batch-1.csv', 'winequality-batch-2.csv'):
+        path = tmp_path / name
+        path.write_text(CSV_DATA)
+        files.append(str(path))
+
+    report = s3_utils.upload_files_to_s3(files)
+    assert [entry['status'] for entry in report] == ['uploaded', 'uploaded']
+    assert all(entry['bytes'] == len(CSV_DATA) for entry in report)
+
+    # Unchanged files are skipped, changed ones re-uploaded
+    (tmp_path / 'winequality-batch-2.csv').write_text(CSV_DATA + "\n10,11,12")
+    report = s3_utils.upload_files_to_s3(files)
+    assert [entry['status'] for entry in report] == ['skipped', 'uploaded']
+
+    # Multipart ETags are matched too
+    report = s3_utils.bulk_upload_files(files, multipart_threshold=5 * 1024 * 1024, multipart_chunksize=5 * 1024 * 1024)
+    assert [entry['status'] for entry in report] == ['skipped', 'skipped']
+
+    report = s3_utils.bulk_upload_files(files[:1], compress=True)
+    assert report[0]['key'] == 'winequality-batch-1.csv.gz'
+    body = s3_utils.s3_client.get_object(Bucket='dataka', Key='winequality-batch-1.csv.gz')['Body'].read()
+    assert gzip.decompress(body).decode('utf-8') == CSV_DATA
+    head = s3_utils.s3_client.head_object(Bucket='dataka', Key='winequality-batch-1.csv.gz')
+    assert (head['ContentType'], head['ContentEncoding']) == ('text/csv', 'gzip')
+    assert s3_utils.bulk_upload_files(files[:1], compress=True)[0]['status'] == 'skipped'
+
+
+# === Test: uploads are typed by suffix, unknown files as application/octet-stream ===
+def test_content_type():
+    assert aws_lambda.content_type('winequality-red.csv') == 'text/csv'
+    assert aws_lambda.content_type('winequality-red.parquet') == 'application/vnd.apache.parquet'
+    assert aws_lambda.content_type('winequality-red.csv.gz') == 'application/gzip'
+    assert aws_lambda.content_type('winequality-red.csv.zst') == 'application/zstd'
+    assert aws_lambda.content_type('notes.json') == 'application/json'
+    assert aws_lambda.content_type('winequality-red.bin') == 'application/octet-stream'
+
+
+@mock_aws
+def test_local_etag_multipart(s3_setup, tmp_path):
+    s3_utils = S3Utils(bucket_name='dataka')
+    path = tmp_path / 'winequality-big.csv'
+    path.write_bytes(b'7.4;5\n' * 2 * 1024 * 1024)
+
+    report = s3_utils.bulk_upload_files([str(path)], multipart_threshold=5 * 1024 * 1024,
+                                        multipart_chunksize=5 * 1024 * 1024)
+    assert report[0]['status'] == 'uploaded'
+    with open(path, 'rb') as f:
+        etag = S3Utils.local_etag(f, 5 * 1024 * 1024, 5 * 1024 * 1024)
+    assert etag.endswith('-3"')
+    assert s3_utils.remote_etag_and_size('winequality-big.csv')[0] == etag
+
+
+# === Test: construction is free of AWS calls and clients are created once, on first use ===
+def test_s3_utils_lazy_clients(secrets_manager_setup):
+    with patch('aws_lambda.get_client', wraps=aws_lambda.get_client) as get_client:
+        s3_utils = S3Utils(bucket_name='dataka')
+        assert get_client.call_count == 0
+
+        assert s3_utils.get_secret('secret') == ('123456789012', 'arn:aws:iam::123456789012:role/lambda-role')
+        with patch.object(s3_utils.secrets_manager_client, 'get_secret_value') as get_secret_value:
+            assert s3_utils.get_secret('secret') == ('123456789012', 'arn:aws:iam::123456789012:role/lambda-role')
+            get_secret_value.assert_not_called()
+        assert [c.args[0] for c in get_client.call_args_list] == ['secretsmanager']
+
+    # Provisioning is an explicit step
+    s3_utils.create_s3_bucket()
+    assert 'dataka' in [bucket['Name'] for bucket in s3_utils.s3_client.list_buckets()['Buckets']]
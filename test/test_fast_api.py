@@ -1,8 +1,17 @@
 import pytest
+import json
 from fastapi.testclient import TestClient
-from fast_api import app, get_data_processor
-from unittest.mock import MagicMock
+from fast_api import app, get_data_processor, DataProcessor, ResultCache, AggregateStore, result_etag, S3_ERRORS
+from unittest.mock import MagicMock, patch
 import os
+import asyncio
+import httpx
+import pandas as pd
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from moto import mock_aws
 from fastapi import HTTPException
 
 # Set the API key environment variable
@@ -58,6 +67,26 @@ def test_process_data_valid_quality():
     app.dependency_overrides.clear()
 
 
+# === Test: a mocked processor with If-None-Match gets a plain 200 ===
+def test_process_data_conditional_get_mocked_processor():
+    mock_processor = MagicMock()
+    mock_processor.get_file_key.return_value = "high_quality_average.json"
+    mock_processor.process_json_data.return_value = {"key": "value"}
+
+    app.dependency_overrides[get_data_processor] = lambda: mock_processor
+
+    # peek_json_data returns a MagicMock here, which has no ETag
+    response = client.get("/process_data?qualityquery=high",
+                          headers={"api-key": "test-api-key", "if-none-match": '"stale"'})
+
+    assert response.status_code == 200
+    assert response.json() == {"key": "value"}
+    assert response.headers['ETag'] == result_etag({"key": "value"})
+    assert result_etag(MagicMock()) is None
+
+    app.dependency_overrides.clear()
+
+
 def test_process_data_s3_error():
     mock_processor = MagicMock()
     mock_processor.get_file_key.return_value = "high_quality_average.json"
@@ -71,3 +100,331 @@ def test_process_data_s3_error():
     assert response.json() == {"detail": "Error processing file: S3 error"}
 
     app.dependency_overrides.clear()
+
+
+# === Test: result cache serves hits and revalidates expired entries with the ETag ===
+def test_result_cache_hit_and_revalidation():
+    now = [0.0]
+    with mock_aws():
+        s3_client = boto3.client('s3', region_name='eu-north-1')
+        s3_client.create_bucket(Bucket='dataka', CreateBucketConfiguration={'LocationConstraint': 'eu-north-1'})
+        s3_client.put_object(Bucket='dataka', Key='high_quality_average.json', Body=b'{"high_average_quality": 7.16}')
+
+        cache = ResultCache(ttl=10, clock=lambda: now[0])
+        processor = DataProcessor(s3_client=s3_client, cache=cache)
+
+        assert processor.get_json_data('high_quality_average.json')[0] == {"high_average_quality": 7.16}
+        assert processor.get_json_data('high_quality_average.json')[0] == {"high_average_quality": 7.16}
+        assert cache.stats() == {'hits': 1, 'misses': 1, 'revalidations': 0, 'size': 1}
+
+        # Expired but unchanged: revalidated without a new download
+        now[0] = 11
+        assert processor.get_json_data('high_quality_average.json')[0] == {"high_average_quality": 7.16}
+        assert cache.stats()['revalidations'] == 1
+
+        # Expired and changed: fetched again
+        s3_client.put_object(Bucket='dataka', Key='high_quality_average.json', Body=b'{"high_average_quality": 7.5}')
+        now[0] = 22
+        assert processor.get_json_data('high_quality_average.json')[0] == {"high_average_quality": 7.5}
+        assert cache.stats()['misses'] == 2
+
+
+# === Test: concurrent misses on a cold key produce a single load ===
+def test_result_cache_single_flight():
+    calls = []
+    lock = threading.Lock()
+
+    def loader(key, etag):
+        with lock:
+            calls.append(key)
+        time.sleep(0.05)
+        return {"key": key}, '"etag"'
+
+    cache = ResultCache(ttl=60)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: cache.get_or_load('cold', loader), range(16)))
+
+    assert calls == ['cold']
+    assert all(result == {"key": "cold"} for result in results)
+
+
+# === Test: per-key locks survive eviction during a load and are dropped afterwards ===
+def test_result_cache_key_locks():
+    now = [0]
+    cache = ResultCache(ttl=10, max_entries=1, clock=lambda: now[0])
+    cache.get_or_load('a', lambda key, etag: ('a1', '"1"'))
+    now[0] = 100
+
+    started, release = threading.Event(), threading.Event()
+    duplicate_loads = []
+
+    def slow_loader(key, etag):
+        started.set()
+        release.wait(5)
+        return 'a2', '"2"'
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        first = executor.submit(cache.get_or_load, 'a', slow_loader)
+        started.wait(5)
+        # Evicts 'a' while its load is still running
+        cache.get_or_load('b', lambda key, etag: ('b1', '"1"'))
+        second = executor.submit(cache.get_or_load, 'a', lambda key, etag: duplicate_loads.append(key) or ('a3', '"3"'))
+        time.sleep(0.05)
+        release.set()
+        assert first.result() == 'a2' and second.result() == 'a2'
+    assert duplicate_loads == []
+
+    def failing_loader(key, etag):
+        raise RuntimeError("S3 down")
+    with pytest.raises(RuntimeError):
+        cache.get_or_load('c', failing_loader)
+    assert cache.key_locks == {}
+
+
+# === Test: least recently used entries are evicted beyond max_entries ===
+def test_result_cache_lru_eviction():
+    cache = ResultCache(ttl=60, max_entries=2)
+    for key in ('a', 'b', 'a', 'c'):
+        cache.get_or_load(key, lambda k, etag: (k, None))
+
+    assert list(cache.entries) == ['a', 'c']
+
+
+# === Test: concurrent requests overlap their blocking S3 calls ===
+def test_process_data_requests_overlap():
+    def slow_fetch(file_key):
+        time.sleep(0.2)
+        return {"key": file_key}
+
+    mock_processor = MagicMock()
+    mock_processor.get_file_key.return_value = "high_quality_average.json"
+    mock_processor.process_json_data.side_effect = slow_fetch
+
+    app.dependency_overrides[get_data_processor] = lambda: mock_processor
+
+    async def burst():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as async_client:
+            return await asyncio.gather(*[
+                async_client.get("/process_data?qualityquery=high", headers={"api-key": "test-api-key"})
+                for _ in range(5)
+            ])
+
+    start = time.perf_counter()
+    responses = asyncio.run(burst())
+    elapsed = time.perf_counter() - start
+
+    assert all(response.status_code == 200 for response in responses)
+    assert elapsed < 0.6
+
+    app.dependency_overrides.clear()
+
+
+# === Test: aggregate queries over the precomputed table ===
+AGGREGATE_TABLE = pd.DataFrame({
+    'wine_type': ['red', 'red', 'white', 'red', 'red', 'white'],
+    'quality': [5, 7, 7, 5, 7, 7],
+    'feature': ['quality', 'quality', 'quality', 'alcohol', 'alcohol', 'alcohol'],
+    'count': [2, 1, 3, 2, 1, 3],
+    'sum': [10.0, 7.0, 21.0, 19.0, 12.0, 33.0],
+    'sum_sq': [50.0, 49.0, 147.0, 181.0, 144.0, 365.0],
+    'min': [5.0, 7.0, 7.0, 9.0, 12.0, 10.0],
+    'max': [5.0, 7.0, 7.0, 10.0, 12.0, 12.0],
+})
+
+
+def test_aggregate_store_query():
+    store = AggregateStore(AGGREGATE_TABLE)
+
+    high = store.query('quality', min_quality=7)
+    assert (high['count'], high['mean']) == (4, 7.0)
+
+    red_alcohol = store.query('alcohol', wine_type='red')
+    assert red_alcohol['count'] == 3
+    assert red_alcohol['mean'] == pytest.approx(31 / 3)
+    assert red_alcohol['std'] == pytest.approx(pd.Series([9.0, 10.0, 12.0]).std(ddof=0))
+    assert (red_alcohol['min'], red_alcohol['max']) == (9.0, 12.0)
+
+    assert store.query('alcohol', max_quality=4)['mean'] is None
+
+
+def test_aggregates_endpoint():
+    mock_processor = MagicMock()
+    mock_processor.get_aggregate_store.return_value = AggregateStore(AGGREGATE_TABLE)
+
+    app.dependency_overrides[get_data_processor] = lambda: mock_processor
+
+    response = client.get("/aggregates?feature=alcohol&min_quality=7&wine_type=white", headers={"api-key": "test-api-key"})
+    assert response.status_code == 200
+    assert response.json()['mean'] == pytest.approx(11.0)
+
+    response = client.get("/aggregates?feature=colour", headers={"api-key": "test-api-key"})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Invalid feature. Allowed values: alcohol, quality"}
+
+    app.dependency_overrides.clear()
+
+
+# === Test: ETag/Cache-Control headers and 304 on a matching If-None-Match ===
+def test_process_data_conditional_get():
+    with mock_aws():
+        s3_client = boto3.client('s3', region_name='eu-north-1')
+        s3_client.create_bucket(Bucket='dataka', CreateBucketConfiguration={'LocationConstraint': 'eu-north-1'})
+        s3_client.put_object(Bucket='dataka', Key='high_quality_average.json', Body=b'{"high_average_quality": 7.16}')
+        etag = result_etag({"high_average_quality": 7.16})
+
+        processor = DataProcessor(s3_client=s3_client, cache=ResultCache(ttl=60))
+        app.dependency_overrides[get_data_processor] = lambda: processor
+
+        response = client.get("/process_data?qualityquery=high", headers={"api-key": "test-api-key"})
+        assert response.status_code == 200
+        assert response.headers['etag'] == etag
+        assert response.headers['cache-control'] == 'max-age=60'
+
+        with patch.object(s3_client, 'get_object') as get_object:
+            response = client.get("/process_data?qualityquery=high",
+                                  headers={"api-key": "test-api-key", "if-none-match": etag})
+            assert response.status_code == 304
+            assert response.content == b''
+            assert response.headers['etag'] == etag
+            get_object.assert_not_called()
+
+        response = client.get("/process_data?qualityquery=high",
+                              headers={"api-key": "test-api-key", "if-none-match": '"stale"'})
+        assert response.status_code == 200
+        assert response.json() == {"high_average_quality": 7.16}
+
+    app.dependency_overrides.clear()
+
+
+# === Test: batch endpoint returns every requested quality level in one response ===
+def test_process_data_batch():
+    mock_processor = DataProcessor(s3_client=MagicMock(), cache=None)
+    mock_processor.get_manifest = MagicMock(return_value=(None, None))
+    mock_processor.get_json_data = MagicMock(side_effect=lambda key: ({"key": key}, '"etag-1"'))
+    app.dependency_overrides[get_data_processor] = lambda: mock_processor
+
+    response = client.get("/process_data/batch?qualityquery=high&qualityquery=low,high",
+                          headers={"api-key": "test-api-key"})
+    assert response.status_code == 200
+    assert response.json() == {
+        "high": {"key": "high_quality_average.json"},
+        "low": {"key": "low_quality_average.json"},
+    }
+    assert mock_processor.get_json_data.call_count == 2
+
+    response = client.get("/process_data/batch?qualityquery=high,medium", headers={"api-key": "test-api-key"})
+    assert response.status_code == 400
+
+    app.dependency_overrides.clear()
+
+
+# === Test: lifespan builds one warmed processor and reports readiness ===
+def test_lifespan_singleton_processor_and_readiness():
+    s3_client = MagicMock()
+    assert DataProcessor(s3_client=s3_client).warm_up(connections=3)
+    assert s3_client.head_bucket.call_count == 3
+    s3_client.head_bucket.side_effect = Exception("unreachable")
+    assert not DataProcessor(s3_client=s3_client).warm_up(connections=1)
+
+    with patch.object(DataProcessor, 'warm_up', return_value=True) as warm_up:
+        with TestClient(app) as lifespan_client:
+            assert lifespan_client.get("/ready").status_code == 200
+            request = MagicMock(app=app)
+            assert get_data_processor(request) is app.state.processor
+            assert get_data_processor(request) is get_data_processor(request)
+            assert warm_up.call_count == 1
+        assert app.state.ready is False
+        assert lifespan_client.get("/ready").status_code == 503
+
+    # A failed warm-up leaves the worker unready until a retry succeeds
+    with patch('fast_api.WARM_UP_RETRY_SECONDS', 0.2), \
+            patch.object(DataProcessor, 'warm_up', side_effect=[False, False, True]) as warm_up:
+        with TestClient(app) as lifespan_client:
+            assert lifespan_client.get("/ready").status_code == 503
+            deadline = time.monotonic() + 5
+            while lifespan_client.get("/ready").status_code != 200 and time.monotonic() < deadline:
+                time.sleep(0.05)
+            assert lifespan_client.get("/ready").status_code == 200
+            assert warm_up.call_count == 3
+
+
+# === Test: /metrics exposes stage histograms, status counts and S3 errors ===
+def test_metrics_endpoint():
+    with mock_aws():
+        s3_client = boto3.client('s3', region_name='eu-north-1')
+        s3_client.create_bucket(Bucket='dataka', CreateBucketConfiguration={'LocationConstraint': 'eu-north-1'})
+        s3_client.put_object(Bucket='dataka', Key='high_quality_average.json', Body=b'{"high_average_quality": 7.16}')
+        processor = DataProcessor(s3_client=s3_client, cache=None)
+        app.dependency_overrides[get_data_processor] = lambda: processor
+
+        assert client.get("/process_data?qualityquery=high", headers={"api-key": "test-api-key"}).status_code == 200
+        assert client.get("/process_data?qualityquery=low", headers={"api-key": "test-api-key"}).status_code == 500
+        assert client.get("/process_data?qualityquery=high", headers={"api-key": "wrong"}).status_code == 401
+
+    app.dependency_overrides.clear()
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/plain')
+    text = response.text
+    for stage in ('auth', 's3_get', 'decode', 'response'):
+        assert f'request_stage_duration_seconds_count{{stage="{stage}"}}' in text
+    assert 'http_responses_total{path="/process_data",status="200"}' in text
+    assert 'http_responses_total{path="/process_data",status="401"}' in text
+    assert 's3_errors_total{operation="get_object",code="NoSuchKey"} ' in text
+    # The /metrics request itself is the only one in flight
+    assert 'http_requests_in_flight 1' in text
+    assert 'http_request_duration_seconds_bucket{path="/process_data",le="+Inf"}' in text
+
+
+# === Test: averages are served from the published manifest with one S3 read ===
+def test_process_data_reads_manifest():
+    with mock_aws():
+        s3_client = boto3.client('s3', region_name='eu-north-1')
+        s3_client.create_bucket(Bucket='dataka', CreateBucketConfiguration={'LocationConstraint': 'eu-north-1'})
+        # Stale per-metric file from an older run must not be mixed in
+        s3_client.put_object(Bucket='dataka', Key='high_quality_average.json', Body=b'{"high_average_quality": 1.0}')
+        s3_client.put_object(Bucket='dataka', Key='quality_results.json', Body=json.dumps({
+            'version': 'abc', 'high_average_quality': 7.16, 'low_average_quality': 3.88,
+            'aggregates_key': 'results/abc/quality_aggregates.parquet',
+        }).encode())
+
+        processor = DataProcessor(s3_client=s3_client, cache=ResultCache(ttl=60))
+        app.dependency_overrides[get_data_processor] = lambda: processor
+        with patch.object(s3_client, 'get_object', wraps=s3_client.get_object) as get_object:
+            response = client.get("/process_data/batch?qualityquery=high,low", headers={"api-key": "test-api-key"})
+            assert response.json() == {'high': {'high_average_quality': 7.16}, 'low': {'low_average_quality': 3.88}}
+            response = client.get("/process_data?qualityquery=low", headers={"api-key": "test-api-key"})
+            assert response.json() == {'low_average_quality': 3.88}
+            assert [c.kwargs['Key'] for c in get_object.call_args_list] == ['quality_results.json']
+
+        with patch.object(processor, 'fetch_aggregate_store', return_value=('store', None)) as fetch_store:
+            assert processor.get_aggregate_store() == 'store'
+            assert fetch_store.call_args.args[0] == 'results/abc/quality_aggregates.parquet'
+
+    app.dependency_overrides.clear()
+
+
+# === Test: a manifest without a table is a conflict and a missing manifest is not an S3 error ===
+def test_aggregates_without_published_table():
+    with mock_aws():
+        s3_client = boto3.client('s3', region_name='eu-north-1')
+        s3_client.create_bucket(Bucket='dataka', CreateBucketConfiguration={'LocationConstraint': 'eu-north-1'})
+        s3_client.put_object(Bucket='dataka', Key='high_quality_average.json', Body=b'{"high_average_quality": 7.16}')
+        processor = DataProcessor(s3_client=s3_client, cache=None)
+        app.dependency_overrides[get_data_processor] = lambda: processor
+
+        misses = S3_ERRORS.value('get_object', 'NoSuchKey')
+        response = client.get("/process_data?qualityquery=high", headers={"api-key": "test-api-key"})
+        assert response.json() == {"high_average_quality": 7.16}
+        assert S3_ERRORS.value('get_object', 'NoSuchKey') == misses
+
+        # Published by the lean handler: the legacy table is from an older run and must not be served
+        s3_client.put_object(Bucket='dataka', Key='quality_aggregates.parquet', Body=b'stale')
+        s3_client.put_object(Bucket='dataka', Key='quality_results.json', Body=json.dumps({
+            'version': 'lean', 'high_average_quality': 7.2, 'low_average_quality': 3.9, 'aggregates_key': None,
+        }).encode())
+        response = client.get("/aggregates", headers={"api-key": "test-api-key"})
+        assert response.status_code == 409
+
+    app.dependency_overrides.clear()
@@ -0,0 +1,285 @@
+import pytest
+import gzip
+import json
+from io import BytesIO
+from unittest.mock import patch
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from moto import mock_aws
+import pandas as pd
+import lambda_function
+
+RED_CSV = '"fixed acidity";"quality"\n7.4;5\n7.8;7\n7.8;8\n11.2;3\n'
+WHITE_CSV = '"fixed acidity";"quality"\n7.0;6\n6.3;4\n8.1;7'
+
+
+@pytest.fixture
+def s3_setup(monkeypatch):
+    with mock_aws():
+        s3_client = boto3.client('s3', region_name='eu-north-1')
+        s3_client.create_bucket(
+            Bucket='dataka',
+            CreateBucketConfiguration={'LocationConstraint': 'eu-north-1'}
+        )
+        s3_client.put_object(Bucket='dataka', Key='winequality-red.csv', Body=RED_CSV.encode('utf-8'))
+        s3_client.put_object(Bucket='dataka', Key='winequality-white.csv', Body=WHITE_CSV.encode('utf-8'))
+        monkeypatch.setattr(lambda_function, 's3_client', s3_client)
+        yield s3_client
+
+
+def s3_event(key='winequality-red.csv'):
+    return {"Records": [{"s3": {"bucket": {"name": "dataka"}, "object": {"key": key}}}]}
+
+
+# === Test: streamed aggregates match the in-memory pandas computation ===
+@pytest.mark.parametrize("chunk_size", [1, 7, 1024])
+def test_stream_aggregates_matches_pandas(chunk_size):
+    aggregates = lambda_function.merge_aggregates([
+        lambda_function.stream_aggregates(BytesIO(content.encode('utf-8')), wine_type, chunk_size=chunk_size)
+        for wine_type, content in (('red', RED_CSV), ('white', WHITE_CSV))
+    ])
+
+    wine = pd.concat([pd.read_csv(BytesIO(c.encode('utf-8')), delimiter=';') for c in (RED_CSV, WHITE_CSV)])
+    assert lambda_function.quality_average(aggregates, min_quality=7) == round(wine[wine['quality'] >= 7]['quality'].mean(), 2)
+    assert lambda_function.quality_average(aggregates, max_quality=4) == round(wine[wine['quality'] <= 4]['quality'].mean(), 2)
+
+    acidity = aggregates[(aggregates['feature'] == 'fixed_acidity') & (aggregates['wine_type'] == 'red')]
+    assert acidity['count'].sum() == 4
+    assert acidity['sum'].sum() == pytest.approx(7.4 + 7.8 + 7.8 + 11.2)
+    assert acidity['sum_sq'].sum() == pytest.approx(7.4 ** 2 + 7.8 ** 2 + 7.8 ** 2 + 11.2 ** 2)
+    assert (acidity['min'].min(), acidity['max'].max()) == pytest.approx((7.4, 11.2))
+
+
+# === Test: handler writes both average files ===
+def test_lambda_handler_writes_averages(s3_setup):
+    result = lambda_function.lambda_handler(s3_event(), None)
+
+    assert result['statusCode'] == 200
+    assert json.loads(result['body']) == {'high_average_quality': 7.33, 'low_average_quality': 3.5}
+
+    high = s3_setup.get_object(Bucket='dataka', Key='high_quality_average.json')['Body'].read()
+    low = s3_setup.get_object(Bucket='dataka', Key='low_quality_average.json')['Body'].read()
+    assert json.loads(high) == {'high_average_quality': 7.33}
+    assert json.loads(low) == {'low_average_quality': 3.5}
+
+    aggregates = pd.read_parquet(BytesIO(s3_setup.get_object(Bucket='dataka', Key='quality_aggregates.parquet')['Body'].read()))
+    assert set(aggregates['wine_type']) == {'red', 'white'}
+    assert set(aggregates['feature']) == {'fixed_acidity', 'quality'}
+
+
+# === Test: missing source object returns an error response ===
+def test_lambda_handler_missing_object(s3_setup):
+    event = dict(s3_event(), keys=['winequality-red.csv', 'winequality-missing.csv'])
+    result = lambda_function.lambda_handler(event, None)
+    assert result['statusCode'] == 500
+
+
+# === Test: every winequality-*.csv object in the bucket is aggregated ===
+def test_lambda_handler_aggregates_all_source_keys(s3_setup):
+    s3_setup.put_object(Bucket='dataka', Key='winequality-batch-1.csv', Body=b'"quality"\n9\n2\n')
+    s3_setup.put_object(Bucket='dataka', Key='notes.csv', Body=b'"quality"\n10\n')
+
+    assert lambda_function.list_source_keys('dataka') == [
+        'winequality-batch-1.csv', 'winequality-red.csv', 'winequality-white.csv'
+    ]
+    result = lambda_function.lambda_handler(s3_event(), None)
+    assert json.loads(result['body']) == {'high_average_quality': 7.75, 'low_average_quality': 3.0}
+    aggregates = pd.read_parquet(BytesIO(s3_setup.get_object(Bucket='dataka', Key='quality_aggregates.parquet')['Body'].read()))
+    assert set(aggregates['wine_type']) == {'red', 'white', lambda_function.UNKNOWN_WINE_TYPE}
+
+
+# === Test: explicit key list in the event overrides the bucket listing ===
+def test_lambda_handler_uses_event_keys(s3_setup):
+    event = dict(s3_event(), keys=['winequality-red.csv'])
+    result = lambda_function.lambda_handler(event, None)
+    assert json.loads(result['body']) == {'high_average_quality': 7.5, 'low_average_quality': 3.0}
+
+
+# === Test: incremental mode only recomputes objects whose ETag changed ===
+def test_lambda_handler_incremental(s3_setup):
+    result = lambda_function.lambda_handler(s3_event(), None)
+    assert json.loads(result['body']) == {'high_average_quality': 7.33, 'low_average_quality': 3.5}
+    assert lambda_function.list_partials('dataka') == {'winequality-red.csv', 'winequality-white.csv'}
+
+    with patch.object(lambda_function, 'fetch_and_aggregate', wraps=lambda_function.fetch_and_aggregate) as fetch, \
+            patch.object(lambda_function, 'load_partial', wraps=lambda_function.load_partial) as load_partial:
+        # Duplicate delivery of an unchanged object: nothing is re-downloaded
+        lambda_function.lambda_handler(s3_event(), None)
+        assert fetch.call_count == 0
+
+        # A new batch file only computes its own partial and is folded into the running total
+        s3_setup.put_object(Bucket='dataka', Key='winequality-batch-1.csv', Body=b'"quality"\n9\n2\n')
+        result = lambda_function.lambda_handler(s3_event('winequality-batch-1.csv'), None)
+        assert [c.args[1] for c in fetch.call_args_list] == ['winequality-batch-1.csv']
+        assert load_partial.call_count == 0
+        assert json.loads(result['body']) == {'high_average_quality': 7.75, 'low_average_quality': 3.0}
+
+        # An overwrite whose event was lost is caught by the listing ETag on the next event
+        fetch.reset_mock()
+        s3_setup.put_object(Bucket='dataka', Key='winequality-batch-1.csv', Body=b'"quality"\n8\n')
+        result = lambda_function.lambda_handler(s3_event(), None)
+        assert [c.args[1] for c in fetch.call_args_list] == ['winequality-batch-1.csv']
+        assert json.loads(result['body']) == {'high_average_quality': 7.5, 'low_average_quality': 3.5}
+
+    # Removed objects drop out of the merged result
+    s3_setup.delete_object(Bucket='dataka', Key='winequality-batch-1.csv')
+    result = lambda_function.lambda_handler(s3_event('winequality-batch-1.csv'), None)
+    assert json.loads(result['body']) == {'high_average_quality': 7.33, 'low_average_quality': 3.5}
+    assert 'winequality-batch-1.csv' not in lambda_function.list_partials('dataka')
+
+
+# === Test: concurrent local runs each fold in only their own object and log their own metrics ===
+def test_run_lambda_locally_concurrent_events(s3_setup, capsys):
+    from poll_sqs_queue import run_lambda_locally
+    lambda_function.lambda_handler(s3_event(), None)
+    batches = {'winequality-batch-1.csv': b'"quality"\n9\n', 'winequality-batch-2.csv': b'"quality"\n2\n8\n'}
+    for key, body in batches.items():
+        s3_setup.put_object(Bucket='dataka', Key=key, Body=body)
+    capsys.readouterr()
+
+    with patch.object(lambda_function, 'fetch_and_aggregate', wraps=lambda_function.fetch_and_aggregate) as fetch, \
+            ThreadPoolExecutor(max_workers=2) as executor:
+        list(executor.map(run_lambda_locally, [s3_event(key) for key in batches]))
+
+    assert sorted(c.args[1] for c in fetch.call_args_list) == sorted(batches)
+    manifest = json.loads(s3_setup.get_object(Bucket='dataka', Key=lambda_function.RESULTS_KEY)['Body'].read())
+    assert (manifest['high_average_quality'], manifest['low_average_quality']) == (7.8, 3.0)
+    emf_lines = [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith('{"_aws"')]
+    assert sorted(record['bytes_processed'] for record in emf_lines) == sorted(len(body) for body in batches.values())
+
+
+# === Test: one EMF log line per invocation with stage timings, bytes, rows and peak memory ===
+def test_lambda_handler_emits_emf_line(s3_setup, capsys):
+    event = s3_event()
+    event['keys'] = ['winequality-red.csv', 'winequality-white.csv']
+    lambda_function.lambda_handler(event, None)
+
+    emf_lines = [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith('{"_aws"')]
+    assert len(emf_lines) == 1
+    record = emf_lines[0]
+    metric_names = {metric['Name'] for metric in record['_aws']['CloudWatchMetrics'][0]['Metrics']}
+    for stage in ('list', 'download', 'parse', 'aggregate', 'merge', 'upload', 'duration'):
+        assert f'{stage}_ms' in metric_names
+        assert record[f'{stage}_ms'] >= 0
+    assert record['bytes_processed'] == len(RED_CSV) + len(WHITE_CSV)
+    assert record['rows_processed'] == 7
+    assert record['peak_memory_mb'] > 0
+    assert record['status'] == 200
+
+
+# === Test: opt-in profiling writes a profile locally or to S3 ===
+@pytest.mark.parametrize("mode", ['cprofile', 'tracemalloc'])
+def test_lambda_handler_profiling(s3_setup, monkeypatch, tmp_path, mode):
+    monkeypatch.setattr(lambda_function, 'LAMBDA_PROFILE', mode)
+    monkeypatch.setattr(lambda_function, 'LAMBDA_PROFILE_DIR', str(tmp_path))
+    assert lambda_function.lambda_handler(s3_event(), None)['statusCode'] == 200
+    [profile] = tmp_path.iterdir()
+    assert profile.name.endswith(f'.{mode}.txt') and profile.read_text()
+
+    monkeypatch.setattr(lambda_function, 'LAMBDA_PROFILE_DIR', None)
+    lambda_function.lambda_handler(s3_event(), None)
+    listed = s3_setup.list_objects_v2(Bucket='dataka', Prefix='profiles/')
+    assert [obj['Key'].endswith(f'.{mode}.txt') for obj in listed['Contents']] == [True]
+
+
+# === Test: gzip CSV and projected Parquet sources aggregate like plain CSV ===
+def test_lambda_handler_compressed_and_parquet_sources(s3_setup):
+    expected = json.loads(lambda_function.lambda_handler(s3_event(), None)['body'])
+
+    s3_setup.delete_object(Bucket='dataka', Key='winequality-red.csv')
+    s3_setup.delete_object(Bucket='dataka', Key='winequality-white.csv')
+    s3_setup.put_object(Bucket='dataka', Key='winequality-red.csv.gz', Body=gzip.compress(RED_CSV.encode('utf-8')))
+    parquet = BytesIO()
+    pd.read_csv(BytesIO(WHITE_CSV.encode('utf-8')), delimiter=';').to_parquet(parquet, index=False)
+    s3_setup.put_object(Bucket='dataka', Key='winequality-white.parquet', Body=parquet.getvalue())
+
+    assert lambda_function.list_source_keys('dataka') == ['winequality-red.csv.gz', 'winequality-white.parquet']
+    result = lambda_function.lambda_handler(s3_event('winequality-white.parquet'), None)
+    assert json.loads(result['body']) == expected
+
+    # Only the footer and the projected column chunks are requested
+    # pyarrow reads the last 64 KiB speculatively, so use a file large enough to show the saving
+    parquet = BytesIO()
+    pd.concat([pd.read_csv('winequality-white.csv', delimiter=';')] * 10).to_parquet(parquet, index=False)
+    s3_setup.put_object(Bucket='dataka', Key='winequality-white.parquet', Body=parquet.getvalue())
+    with patch.object(s3_setup, 'get_object', wraps=s3_setup.get_object) as get_object:
+        aggregates, _ = lambda_function.fetch_and_aggregate('dataka', 'winequality-white.parquet', features=['alcohol'])
+    assert set(aggregates['feature']) == {'alcohol', 'quality'}
+    assert aggregates[aggregates['feature'] == 'quality']['count'].sum() == 48980
+    ranges = [c.kwargs['Range'][len('bytes='):].split('-') for c in get_object.call_args_list]
+    assert sum(int(end) - int(start) + 1 for start, end in ranges) < len(parquet.getvalue()) / 2
+
+
+# === Test: a zstd CSV streams through the decompressor ===
+def test_fetch_and_aggregate_zstd(s3_setup):
+    zstandard = pytest.importorskip('zstandard')
+    s3_setup.put_object(Bucket='dataka', Key='winequality-red.csv.zst',
+                        Body=zstandard.ZstdCompressor().compress(RED_CSV.encode('utf-8')))
+    aggregates, _ = lambda_function.fetch_and_aggregate('dataka', 'winequality-red.csv.zst')
+    assert lambda_function.quality_average(aggregates, min_quality=7) == 7.5
+
+
+# === Test: results go out as one manifest and unchanged results are not republished ===
+def test_lambda_handler_publishes_manifest_once(s3_setup):
+    lambda_function.lambda_handler(s3_event(), None)
+    manifest = json.loads(s3_setup.get_object(Bucket='dataka', Key=lambda_function.RESULTS_KEY)['Body'].read())
+    assert manifest['high_average_quality'] == 7.33
+    assert manifest['low_average_quality'] == 3.5
+    table = pd.read_parquet(BytesIO(s3_setup.get_object(Bucket='dataka', Key=manifest['aggregates_key'])['Body'].read()))
+    assert lambda_function.quality_average(table, min_quality=7) == 7.33
+
+    # Reprocessing the same inputs computes the same version and skips every PUT
+    event = s3_event()
+    event['keys'] = ['winequality-red.csv', 'winequality-white.csv']
+    with patch.object(s3_setup, 'put_object', wraps=s3_setup.put_object) as put_object:
+        assert lambda_function.lambda_handler(event, None)['statusCode'] == 200
+        assert put_object.call_count == 0
+
+        s3_setup.put_object(Bucket='dataka', Key='winequality-batch-1.csv', Body=b'"quality"\n9\n')
+        put_object.reset_mock()
+        event['keys'].append('winequality-batch-1.csv')
+        lambda_function.lambda_handler(event, None)
+        # The manifest is written last, after every output it points to
+        assert put_object.call_args_list[-1].kwargs['Key'] == lambda_function.RESULTS_KEY
+        assert put_object.call_count == 5
+
+    updated = json.loads(s3_setup.get_object(Bucket='dataka', Key=lambda_function.RESULTS_KEY)['Body'].read())
+    assert updated['version'] != manifest['version']
+    assert updated['high_average_quality'] == 7.75
+
+
+# === Test: only the current and the previous versioned tables are kept ===
+def test_lambda_handler_prunes_old_result_versions(s3_setup):
+    versions = []
+    for i in range(3):
+        s3_setup.put_object(Bucket='dataka', Key='winequality-batch-1.csv', Body=f'"quality"\n{i + 5}\n'.encode('utf-8'))
+        lambda_function.lambda_handler(s3_event('winequality-batch-1.csv'), None)
+        manifest = json.loads(s3_setup.get_object(Bucket='dataka', Key=lambda_function.RESULTS_KEY)['Body'].read())
+        versions.append(manifest['version'])
+
+    listed = s3_setup.list_objects_v2(Bucket='dataka', Prefix=lambda_function.RESULTS_PREFIX)['Contents']
+    assert sorted(obj['Key'] for obj in listed) == sorted(
+        f'{lambda_function.RESULTS_PREFIX}{version}/{lambda_function.AGGREGATES_KEY}' for version in versions[1:]
+    )
+
+
+# === Test: the same data gives the same version whichever path computed it ===
+def test_lambda_handler_same_data_same_version(s3_setup, monkeypatch):
+    def put_batch(i, acidity):
+        s3_setup.put_object(Bucket='dataka', Key=f'winequality-batch-{i}.csv',
+                            Body=f'"fixed acidity";"quality"\n{acidity};5\n'.encode('utf-8'))
+
+    # The running total adds 1e-8 to (1e-8 + 1e8); a full pass sums (1e-8 + 1e-8) + 1e8,
+    # which rounds differently
+    put_batch(1, 1e-8)
+    put_batch(2, 1e8)
+    lambda_function.lambda_handler(s3_event(), None)
+    put_batch(0, 1e-8)
+    assert lambda_function.lambda_handler(s3_event('winequality-batch-0.csv'), None)['statusCode'] == 200
+
+    with patch.object(s3_setup, 'put_object', wraps=s3_setup.put_object) as put_object:
+        lambda_function.lambda_handler(s3_event(), None)
+        monkeypatch.setattr(lambda_function, 'INCREMENTAL_AGGREGATION', False)
+        for _ in range(2):
+            assert lambda_function.lambda_handler(s3_event(), None)['statusCode'] == 200
+        assert put_object.call_count == 0
@@ -0,0 +1,98 @@
+import pytest
+import json
+from unittest.mock import patch
+import os
+import sys
+import subprocess
+import boto3
+from moto import mock_aws
+import lambda_lean
+import lambda_function
+
+RED_CSV = '"fixed acidity";"quality"\n7.4;5\n7.8;7\n7.8;8\n11.2;3\n'
+WHITE_CSV = 'fixed_acidity,quality\n7.0,6.0\n6.3,4.0\n8.1,7.0'
+
+
+@pytest.fixture
+def s3_setup(monkeypatch):
+    with mock_aws():
+        s3_client = boto3.client('s3', region_name='eu-north-1')
+        s3_client.create_bucket(
+            Bucket='dataka',
+            CreateBucketConfiguration={'LocationConstraint': 'eu-north-1'}
+        )
+        s3_client.put_object(Bucket='dataka', Key='winequality-red.csv', Body=RED_CSV.encode('utf-8'))
+        s3_client.put_object(Bucket='dataka', Key='winequality-white.csv', Body=WHITE_CSV.encode('utf-8'))
+        monkeypatch.setattr(lambda_lean, 's3_client', s3_client)
+        monkeypatch.setattr(lambda_function, 's3_client', s3_client)
+        yield s3_client
+
+
+# === Test: lean handler produces the same averages as the pandas handler ===
+def test_lean_handler_matches_full_handler(s3_setup):
+    event = {"Records": [{"s3": {"bucket": {"name": "dataka"}, "object": {"key": "winequality-red.csv"}}}]}
+
+    lean = lambda_lean.lambda_handler(dict(event), None)
+    full = lambda_function.lambda_handler(dict(event, keys=['winequality-red.csv', 'winequality-white.csv']), None)
+
+    assert lean['statusCode'] == 200
+    assert json.loads(lean['body']) == json.loads(full['body']) == {'high_average_quality': 7.33, 'low_average_quality': 3.5}
+    high = s3_setup.get_object(Bucket='dataka', Key='high_quality_average.json')['Body'].read()
+    assert json.loads(high) == {'high_average_quality': 7.33}
+    manifest = json.loads(s3_setup.get_object(Bucket='dataka', Key='quality_results.json')['Body'].read())
+    assert manifest['low_average_quality'] == 3.5
+
+
+# === Test: the lean handler publishes a manifest and skips unchanged results ===
+def test_lean_handler_skips_unchanged_results(s3_setup):
+    event = {"Records": [{"s3": {"bucket": {"name": "dataka"}, "object": {"key": "winequality-red.csv"}}}]}
+    lambda_lean.lambda_handler(dict(event), None)
+    manifest = json.loads(s3_setup.get_object(Bucket='dataka', Key='quality_results.json')['Body'].read())
+    assert manifest['high_average_quality'] == 7.33
+    # No aggregate table is written, and the manifest says so
+    assert manifest['aggregates_key'] is None
+
+    with patch.object(s3_setup, 'put_object', wraps=s3_setup.put_object) as put_object:
+        assert lambda_lean.lambda_handler(dict(event), None)['statusCode'] == 200
+        put_object.assert_not_called()
+
+
+# === Test: the lean version covers the source ETags, like lambda_function's ===
+def test_lean_handler_version_tracks_sources(s3_setup):
+    event = {"Records": [{"s3": {"bucket": {"name": "dataka"}, "object": {"key": "winequality-red.csv"}}}]}
+    lambda_lean.lambda_handler(dict(event), None)
+    manifest = json.loads(s3_setup.get_object(Bucket='dataka', Key='quality_results.json')['Body'].read())
+
+    # Same averages from a rewritten source still publish a new version
+    s3_setup.put_object(Bucket='dataka', Key='winequality-red.csv', Body=(RED_CSV + '7.9;5\n').encode('utf-8'))
+    s3_setup.put_object(Bucket='dataka', Key='winequality-white.csv', Body=(WHITE_CSV + '\n6.0,6.0').encode('utf-8'))
+    lambda_lean.lambda_handler(dict(event), None)
+    updated = json.loads(s3_setup.get_object(Bucket='dataka', Key='quality_results.json')['Body'].read())
+    assert updated['high_average_quality'] == manifest['high_average_quality']
+    assert updated['version'] != manifest['version']
+
+    # A full handler run over the same sources never reuses the lean version, so it publishes its table
+    lambda_function.lambda_handler(dict(event), None)
+    full = json.loads(s3_setup.get_object(Bucket='dataka', Key='quality_results.json')['Body'].read())
+    assert full['version'] != updated['version']
+    assert full['aggregates_key'] is not None
+
+
+# === Test: compressed and Parquet sources fail instead of being left out ===
+def test_lean_handler_rejects_unsupported_sources(s3_setup):
+    s3_setup.put_object(Bucket='dataka', Key='winequality-batch-1.parquet', Body=b'PAR1')
+    event = {"Records": [{"s3": {"bucket": {"name": "dataka"}, "object": {"key": "winequality-red.csv"}}}]}
+
+    result = lambda_lean.lambda_handler(dict(event), None)
+    assert result['statusCode'] == 500
+    assert 'winequality-batch-1.parquet' in json.loads(result['body'])['message']
+    assert 'Contents' not in s3_setup.list_objects_v2(Bucket='dataka', Prefix='quality_results')
+
+
+# === Test: importing the lean handler does not pull in pandas ===
+def test_lean_handler_imports_no_pandas():
+    code = "import sys, lambda_lean; print('pandas' in sys.modules, 'numpy' in sys.modules)"
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    completed = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                               cwd=root, env={'AWS_DEFAULT_REGION': 'eu-north-1', 'PATH': ''})
+    assert completed.stdout.strip() == 'False False'
@@ -0,0 +1,273 @@
+import pytest
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+import boto3
+from unittest.mock import patch
+from moto import mock_aws
+from poll_sqs_queue import SQSBatchConsumer, EventCoalescer, AsyncSQSPoller, parse_s3_records
+
+
+def s3_message_body(key, wrapped=False):
+    event = {"Records": [{"eventName": "ObjectCreated:Put", "s3": {"bucket": {"name": "dataka"}, "object": {"key": key}}}]}
+    if wrapped:
+        return json.dumps({"Message": json.dumps(event)})
+    return json.dumps(event)
+
+
+@pytest.fixture
+def sqs_setup():
+    with mock_aws():
+        sqs_client = boto3.client('sqs', region_name='eu-north-1')
+        queue_url = sqs_client.create_queue(QueueName='my-sqs-queue')['QueueUrl']
+        yield sqs_client, queue_url
+
+
+def queue_depth(sqs_client, queue_url):
+    attributes = sqs_client.get_queue_attributes(
+        QueueUrl=queue_url,
+        AttributeNames=['ApproximateNumberOfMessages', 'ApproximateNumberOfMessagesNotVisible']
+    )['Attributes']
+    return int(attributes['ApproximateNumberOfMessages']) + int(attributes['ApproximateNumberOfMessagesNotVisible'])
+
+
+# === Test: both envelope shapes are parsed ===
+def test_parse_s3_records_shapes():
+    raw = parse_s3_records({'Body': s3_message_body('winequality-red.csv')})
+    wrapped = parse_s3_records({'Body': s3_message_body('winequality-red.csv', wrapped=True)})
+    assert raw == wrapped
+    assert raw[0]['s3']['object']['key'] == 'winequality-red.csv'
+
+
+# === Test: all messages are handled concurrently and acknowledged in batches ===
+def test_consumer_drains_queue(sqs_setup):
+    sqs_client, queue_url = sqs_setup
+    for i in range(25):
+        sqs_client.send_message(QueueUrl=queue_url, MessageBody=s3_message_body(f'winequality-{i}.csv'))
+
+    seen = []
+    lock = threading.Lock()
+
+    def handler(message):
+        with lock:
+            seen.append(parse_s3_records(message)[0]['s3']['object']['key'])
+
+    consumer = SQSBatchConsumer(queue_url, handler=handler, sqs_client=sqs_client, max_workers=4, wait_time_seconds=0)
+    report = consumer.run(max_empty_receives=1)
+
+    assert sorted(seen) == sorted(f'winequality-{i}.csv' for i in range(25))
+    assert report['processed'] == 25
+    assert report['messages_per_second'] > 0
+    assert queue_depth(sqs_client, queue_url) == 0
+
+
+# === Test: failed messages stay on the queue and slow ones get their visibility extended ===
+def test_consumer_failures_and_heartbeat(sqs_setup):
+    sqs_client, queue_url = sqs_setup
+    sqs_client.send_message(QueueUrl=queue_url, MessageBody=s3_message_body('winequality-slow.csv'))
+    sqs_client.send_message(QueueUrl=queue_url, MessageBody=s3_message_body('winequality-bad.csv'))
+
+    def handler(message):
+        key = parse_s3_records(message)[0]['s3']['object']['key']
+        if key == 'winequality-bad.csv':
+            raise ValueError("bad file")
+        time.sleep(0.5)
+
+    consumer = SQSBatchConsumer(queue_url, handler=handler, sqs_client=sqs_client, wait_time_seconds=0,
+                                visibility_timeout=30, heartbeat_interval=0.2)
+    report = consumer.run(max_empty_receives=1)
+
+    assert (report['processed'], report['failed']) == (1, 1)
+    assert report['visibility_extensions'] >= 1
+    assert queue_depth(sqs_client, queue_url) == 1
+
+
+# === Test: a partial ack batch is deleted once it has waited ack_flush_seconds ===
+def test_consumer_flushes_partial_ack_batch(sqs_setup):
+    sqs_client, queue_url = sqs_setup
+    sqs_client.send_message(QueueUrl=queue_url, MessageBody=s3_message_body('winequality-red.csv'))
+    consumer = SQSBatchConsumer(queue_url, handler=lambda message: None, sqs_client=sqs_client,
+                                wait_time_seconds=0, ack_flush_seconds=0.1)
+    [message] = consumer._receive(1)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        futures = {executor.submit(consumer._handle, message)}
+        wait(futures)
+    consumer._collect(futures, block=False)
+    assert consumer.pending_acks == [message['ReceiptHandle']]
+
+    # The next receive cycle acknowledges it without waiting for nine more messages
+    time.sleep(0.1)
+    consumer._collect(set(), block=False)
+    assert consumer.pending_acks == []
+    assert queue_depth(sqs_client, queue_url) == 0
+
+
+# === Test: a failing visibility extension is logged and the heartbeat keeps beating ===
+def test_consumer_heartbeat_survives_errors(sqs_setup, capsys):
+    sqs_client, queue_url = sqs_setup
+    sqs_client.send_message(QueueUrl=queue_url, MessageBody=s3_message_body('winequality-slow.csv'))
+    consumer = SQSBatchConsumer(queue_url, handler=lambda message: time.sleep(0.6), sqs_client=sqs_client,
+                                wait_time_seconds=0, visibility_timeout=30, heartbeat_interval=0.2)
+
+    with patch.object(sqs_client, 'change_message_visibility_batch', side_effect=Exception("Throttling")):
+        report = consumer.run(max_empty_receives=1)
+
+    assert report['processed'] == 1
+    assert report['visibility_extensions'] == 0
+    assert capsys.readouterr().out.count("Could not extend visibility") >= 2
+    assert queue_depth(sqs_client, queue_url) == 0
+
+
+# === Test: handlers that finish after Ctrl+C are still acknowledged ===
+def test_consumer_acks_after_interrupt(sqs_setup):
+    sqs_client, queue_url = sqs_setup
+    for i in range(3):
+        sqs_client.send_message(QueueUrl=queue_url, MessageBody=s3_message_body(f'winequality-{i}.csv'))
+    consumer = SQSBatchConsumer(queue_url, handler=lambda message: time.sleep(0.3), sqs_client=sqs_client,
+                                max_workers=4, wait_time_seconds=0)
+    receive = consumer._receive
+
+    with patch.object(consumer, '_receive', side_effect=[receive(10), KeyboardInterrupt()]):
+        with pytest.raises(KeyboardInterrupt):
+            consumer.run(max_empty_receives=1)
+
+    assert consumer.processed == 3
+    assert queue_depth(sqs_client, queue_url) == 0
+
+
+# === Test: a burst of events is deduplicated and processed in one pass per window ===
+def test_coalescing_consumer_single_pass(sqs_setup):
+    sqs_client, queue_url = sqs_setup
+    for i in range(30):
+        key = f'winequality-{i % 5}.csv'
+        event = {"Records": [{"s3": {"bucket": {"name": "dataka"}, "object": {"key": key, "sequencer": f"{i // 5:04X}"}}}]}
+        sqs_client.send_message(QueueUrl=queue_url, MessageBody=json.dumps(event))
+    # At-least-once delivery: the same event arriving twice
+    sqs_client.send_message(QueueUrl=queue_url, MessageBody=json.dumps(
+        {"Records": [{"s3": {"bucket": {"name": "dataka"}, "object": {"key": "winequality-0.csv", "sequencer": "0005"}}}]}
+    ))
+
+    events = []
+    coalescer = EventCoalescer(events.append, window_seconds=0.5)
+    consumer = SQSBatchConsumer(queue_url, handler=coalescer.handle_message, sqs_client=sqs_client,
+                                max_workers=64, wait_time_seconds=0)
+    report = consumer.run(max_empty_receives=1)
+
+    assert report['processed'] == 31
+    assert len(events) == 1
+    records = events[0]['Records']
+    assert [r['s3']['object']['key'] for r in records] == [f'winequality-{i}.csv' for i in range(5)]
+    assert all(r['s3']['object']['sequencer'] == '0005' for r in records)
+    assert (coalescer.records_received, coalescer.duplicates) == (31, 1)
+    assert queue_depth(sqs_client, queue_url) == 0
+
+
+# === Test: a failed window leaves its messages on the queue ===
+def test_coalescing_window_failure():
+    def process(event):
+        raise RuntimeError("aggregation failed")
+
+    coalescer = EventCoalescer(process, window_seconds=0.05)
+    record = {"s3": {"bucket": {"name": "dataka"}, "object": {"key": "winequality-red.csv"}}}
+    with pytest.raises(RuntimeError):
+        coalescer.submit([record])
+
+
+# === Test: async poller drains several queues with both envelopes under backpressure ===
+def test_async_poller_multiple_queues(sqs_setup):
+    sqs_client, first_url = sqs_setup
+    second_url = sqs_client.create_queue(QueueName='second-queue')['QueueUrl']
+    for i in range(15):
+        sqs_client.send_message(QueueUrl=first_url, MessageBody=s3_message_body(f'winequality-a{i}.csv'))
+        sqs_client.send_message(QueueUrl=second_url, MessageBody=s3_message_body(f'winequality-b{i}.csv', wrapped=True))
+    sqs_client.send_message(QueueUrl=second_url, MessageBody=s3_message_body('winequality-fail.csv'))
+
+    lock = threading.Lock()
+    active = []
+    peak = []
+    keys = []
+
+    def process(event):
+        key = event['Records'][0]['s3']['object']['key']
+        with lock:
+            active.append(key)
+            peak.append(len(active))
+        time.sleep(0.01)
+        with lock:
+            active.remove(key)
+            keys.append(key)
+        if key == 'winequality-fail.csv':
+            raise RuntimeError("aggregation failed")
+
+    poller = AsyncSQSPoller([first_url, second_url], process=process, sqs_client=sqs_client,
+                            max_concurrency=3, max_pending=4, wait_time_seconds=0, visibility_timeout=30)
+    report = asyncio.run(poller.run(max_empty_receives=2))
+
+    assert report['received'] == 31
+    assert report['processed'] == 30
+    assert report['failed'] == 1
+    assert report['peak_pending'] <= 4
+    assert max(peak) <= 3
+    assert sorted(keys) == sorted([f'winequality-a{i}.csv' for i in range(15)] +
+                                  [f'winequality-b{i}.csv' for i in range(15)] + ['winequality-fail.csv'])
+    assert queue_depth(sqs_client, first_url) == 0
+    # The failed message stays on its queue for redelivery
+    assert queue_depth(sqs_client, second_url) == 1
+
+
+# === Test: stop() ends receiving and drains the work already queued ===
+def test_async_poller_graceful_stop(sqs_setup):
+    sqs_client, queue_url = sqs_setup
+    for i in range(5):
+        sqs_client.send_message(QueueUrl=queue_url, MessageBody=s3_message_body(f'winequality-{i}.csv'))
+
+    processed = []
+
+    async def main():
+        poller = AsyncSQSPoller([queue_url], process=lambda event: (time.sleep(0.05), processed.append(event)),
+                                sqs_client=sqs_client, max_concurrency=1, max_pending=10, wait_time_seconds=0)
+        task = asyncio.create_task(poller.run())
+        while poller.received < 5:
+            await asyncio.sleep(0.01)
+        poller.stop()
+        return await task
+
+    report = asyncio.run(main())
+    assert report['processed'] == 5
+    assert len(processed) == 5
+    assert queue_depth(sqs_client, queue_url) == 0
+
+
+# === Test: a failing delete neither kills the workers nor hangs run() ===
+def test_async_poller_delete_errors(sqs_setup):
+    sqs_client, queue_url = sqs_setup
+    for i in range(3):
+        sqs_client.send_message(QueueUrl=queue_url, MessageBody=s3_message_body(f'winequality-{i}.csv'))
+
+    poller = AsyncSQSPoller([queue_url], process=lambda event: None, sqs_client=sqs_client,
+                            max_concurrency=1, wait_time_seconds=0)
+    with patch.object(sqs_client, 'delete_message', side_effect=RuntimeError("throttled")):
+        report = asyncio.run(asyncio.wait_for(poller.run(max_empty_receives=1), timeout=10))
+
+    assert (report['processed'], report['delete_errors']) == (0, 3)
+    assert poller.pending == {}
+    assert queue_depth(sqs_client, queue_url) == 3
+
+
+# === Test: queued and in-flight messages get their visibility extended ===
+def test_async_poller_heartbeat(sqs_setup):
+    sqs_client, queue_url = sqs_setup
+    for i in range(2):
+        sqs_client.send_message(QueueUrl=queue_url, MessageBody=s3_message_body(f'winequality-{i}.csv'))
+
+    poller = AsyncSQSPoller([queue_url], process=lambda event: time.sleep(0.5), sqs_client=sqs_client,
+                            max_concurrency=1, wait_time_seconds=0, visibility_timeout=30, heartbeat_interval=0.2)
+    report = asyncio.run(poller.run(max_empty_receives=1))
+
+    assert report['processed'] == 2
+    # The second message waited in the work queue behind the first and was extended too
+    assert report['visibility_extensions'] >= 3
+    assert queue_depth(sqs_client, queue_url) == 0
@@ -0,0 +1,47 @@
+import pytest
+import numpy as np
+import pandas as pd
+from quality_kernel import quality_histogram, quality_band_stats, grouped_feature_stats, HIGH_LOW_BANDS
+
+
+@pytest.fixture
+def wine():
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        'quality': rng.integers(3, 10, size=10_000).astype('int8'),
+        'alcohol': rng.uniform(8, 15, size=10_000).astype('float32'),
+    })
+
+
+# === Test: band statistics match boolean-masked pandas means ===
+def test_quality_band_stats_matches_pandas(wine):
+    bands = dict(HIGH_LOW_BANDS, middle=(5, 6))
+    stats = quality_band_stats(wine['quality'].to_numpy(), bands)
+
+    for name, mask in (('high', wine['quality'] >= 7), ('low', wine['quality'] <= 4),
+                       ('middle', wine['quality'].between(5, 6))):
+        assert stats[name]['count'] == mask.sum()
+        assert stats[name]['mean'] == pytest.approx(wine[mask]['quality'].mean())
+
+
+def test_quality_histogram_blocks(wine):
+    quality = wine['quality'].to_numpy()
+    counts, sums = quality_histogram(quality, weights=quality, block_size=7)
+    assert counts.tolist() == np.bincount(quality, minlength=11).tolist()
+    assert sums.sum() == quality.sum()
+    assert quality_band_stats(np.array([], dtype='int8'))['high'] == {'count': 0, 'mean': None}
+
+
+# === Test: grouped feature statistics match pandas groupby ===
+def test_grouped_feature_stats_matches_groupby(wine):
+    wine.loc[3, 'alcohol'] = np.nan
+    levels, stats = grouped_feature_stats(wine['quality'].to_numpy(), {'alcohol': wine['alcohol'].to_numpy()})
+
+    expected = wine.groupby('quality')['alcohol'].agg(['count', 'sum', 'min', 'max'])
+    assert levels.tolist() == expected.index.tolist()
+    assert stats['alcohol']['count'].tolist() == expected['count'].tolist()
+    assert stats['alcohol']['sum'] == pytest.approx(expected['sum'].to_numpy(), rel=1e-6)
+    assert stats['alcohol']['min'].tolist() == expected['min'].astype('float64').tolist()
+    assert stats['alcohol']['max'].tolist() == expected['max'].astype('float64').tolist()
+    squares = (wine['alcohol'].astype('float64') ** 2).groupby(wine['quality']).sum()
+    assert stats['alcohol']['sum_sq'] == pytest.approx(squares.to_numpy(), rel=1e-9)
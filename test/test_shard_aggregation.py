@@ -0,0 +1,74 @@
+import pytest
+import gzip
+import sys
+import subprocess
+from io import BytesIO
+import boto3
+from moto import mock_aws
+import pandas as pd
+from quality_aggregates import stream_aggregates, quality_average, AGGREGATE_KEYS
+from shard_aggregation import line_aligned_ranges, sharded_aggregate, sharded_aggregate_s3
+
+
+# === Test: byte ranges cover every data row exactly once, on line boundaries ===
+def test_line_aligned_ranges():
+    with open('winequality-red.csv', 'rb') as f:
+        content = f.read()
+    header_length = content.index(b'\n') + 1
+
+    ranges = line_aligned_ranges('winequality-red.csv', shard_size=4096)
+    assert len(ranges) > 1
+    assert ranges[0][0] == header_length
+    assert ranges[-1][1] == len(content)
+    assert all(previous[1] == current[0] for previous, current in zip(ranges, ranges[1:]))
+    assert all(content[end - 1:end] == b'\n' for _, end in ranges[:-1])
+
+
+# === Test: sharded aggregation across processes matches the single-pass result ===
+def test_sharded_aggregate_matches_single_pass():
+    paths = ['winequality-red.csv', 'winequality-white.csv']
+    sharded = sharded_aggregate(paths, max_workers=2, shard_size=16 * 1024)
+
+    with open(paths[0], 'rb') as red, open(paths[1], 'rb') as white:
+        single = pd.concat([stream_aggregates(red, 'red'), stream_aggregates(white, 'white')], ignore_index=True)
+
+    sharded = sharded.sort_values(AGGREGATE_KEYS).reset_index(drop=True)
+    single = single.sort_values(AGGREGATE_KEYS).reset_index(drop=True)
+    pd.testing.assert_frame_equal(sharded[AGGREGATE_KEYS + ['count', 'min', 'max']],
+                                  single[AGGREGATE_KEYS + ['count', 'min', 'max']])
+    assert sharded['sum'].to_numpy() == pytest.approx(single['sum'].to_numpy(), rel=1e-12)
+    assert sharded['sum_sq'].to_numpy() == pytest.approx(single['sum_sq'].to_numpy(), rel=1e-12)
+
+
+# === Test: S3 shards are read by per-worker clients and match the single-pass result ===
+def test_sharded_aggregate_s3():
+    red = '"fixed acidity";"quality"\n7.4;5\n7.8;7\n7.8;8\n11.2;3\n'
+    white = '"fixed acidity";"quality"\n7.0;6\n6.3;4\n8.1;7\n'
+    with mock_aws():
+        s3_client = boto3.client('s3', region_name='eu-north-1')
+        s3_client.create_bucket(Bucket='dataka', CreateBucketConfiguration={'LocationConstraint': 'eu-north-1'})
+        s3_client.put_object(Bucket='dataka', Key='winequality-red.csv.gz', Body=gzip.compress(red.encode('utf-8')))
+        parquet = BytesIO()
+        pd.read_csv(BytesIO(white.encode('utf-8')), delimiter=';').to_parquet(parquet, index=False)
+        s3_client.put_object(Bucket='dataka', Key='winequality-white.parquet', Body=parquet.getvalue())
+
+        # Forked workers inherit the mocked bucket and create their own clients
+        aggregates = sharded_aggregate_s3('dataka', ['winequality-red.csv.gz', 'winequality-white.parquet'],
+                                          max_workers=2, region_name='eu-north-1')
+
+    assert set(aggregates['wine_type']) == {'red', 'white'}
+    assert quality_average(aggregates, min_quality=7) == 7.33
+    assert quality_average(aggregates, max_quality=4) == 3.5
+
+
+# === Test: local sharding loads neither boto3 nor lambda_function before the pool forks ===
+def test_shard_aggregation_imports_no_client(tmp_path):
+    path = tmp_path / 'winequality-red.csv'
+    path.write_text('"fixed acidity";"quality"\n7.4;5\n7.8;7\n11.2;3\n')
+    code = (
+        "import sys, shard_aggregation, data_processing; "
+        f"print(data_processing.sharded_quality_averages([{str(path)!r}])); "
+        "print('lambda_function' in sys.modules, 'boto3' in sys.modules, shard_aggregation.worker_s3_client)"
+    )
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    assert result.stdout.splitlines() == ['(7.0, 3.0)', 'False False None']
@@ -0,0 +1,114 @@
+import pytest
+import os
+import shutil
+import pandas as pd
+import gzip
+from wine_loader import read_wine_csv, load_wines, load_wines_cached, detect_delimiter, wine_type_from_path, FEATURE_COLUMNS
+from wine_loader import read_wine_parquet, source_format
+
+
+# === Test: red/white files load with the compact schema ===
+def test_read_wine_csv_schema():
+    df = read_wine_csv('winequality-red.csv', wine_type='red')
+
+    assert list(df.columns) == FEATURE_COLUMNS + ['quality', 'wine_type']
+    assert all(df[column].dtype == 'float32' for column in FEATURE_COLUMNS)
+    assert df['quality'].dtype == 'int8'
+    assert isinstance(df['wine_type'].dtype, pd.CategoricalDtype)
+    assert len(df) == 1599
+
+
+# === Test: the comma-separated combined file uses the same schema ===
+def test_read_wine_csv_comma_delimited():
+    df = read_wine_csv('winequality.csv')
+    assert list(df.columns) == FEATURE_COLUMNS + ['quality']
+    assert df['quality'].dtype == 'int8'
+    assert len(df) == 6497
+
+
+@pytest.mark.parametrize("header, delimiter", [
+    ('"fixed acidity";"quality"\n', ';'),
+    (b'fixed_acidity,quality\n', ','),
+])
+def test_detect_delimiter(header, delimiter):
+    assert detect_delimiter(header) == delimiter
+
+
+# === Test: combined frame keeps wine_type categorical ===
+def test_load_wines():
+    wine = load_wines(['winequality-red.csv', 'winequality-white.csv'])
+
+    assert wine_type_from_path('data/winequality-white.csv') == 'white'
+    assert isinstance(wine['wine_type'].dtype, pd.CategoricalDtype)
+    assert wine['wine_type'].value_counts().to_dict() == {'white': 4898, 'red': 1599}
+    assert round(wine[wine['quality'] >= 7]['quality'].mean(), 2) == 7.16
+
+
+# === Test: only red/white are read from file names; other files have no wine type ===
+def test_wine_type_from_path_unknown(tmp_path):
+    assert wine_type_from_path('winequality-red.csv.gz') == 'red'
+    assert wine_type_from_path('winequality-batch-1.csv') is None
+    assert wine_type_from_path('winequality.csv') is None
+
+    batch = tmp_path / 'winequality-batch-1.csv'
+    batch.write_text('"fixed acidity";"quality"\n7.4;5\n')
+    wine = load_wines(['winequality-red.csv', str(batch)])
+    assert list(wine['wine_type'].cat.categories) == ['red']
+    assert wine['wine_type'].isna().sum() == 1
+
+
+# === Test: snapshot cache maps the same frame and is invalidated by source changes ===
+def test_load_wines_cached(tmp_path):
+    paths = []
+    for name in ('winequality-red.csv', 'winequality-white.csv'):
+        target = tmp_path / name
+        shutil.copy(name, target)
+        paths.append(str(target))
+
+    parsed = load_wines(paths)
+    first = load_wines_cached(paths)
+    second = load_wines_cached(paths)
+
+    pd.testing.assert_frame_equal(first, parsed)
+    pd.testing.assert_frame_equal(second, parsed)
+    # Mapped read-only from the snapshot rather than parsed into fresh memory
+    assert not second['alcohol'].to_numpy().flags.writeable
+    assert len(os.listdir(tmp_path / '.wine_cache')) == 2  # one snapshot plus the digest index
+
+    with open(paths[0], 'a') as f:
+        f.write('7.4;0.7;0;1.9;0.076;11;34;0.9978;3.51;0.56;9.4;8\n')
+    updated = load_wines_cached(paths)
+    assert len(updated) == len(parsed) + 1
+    assert updated['quality'].iloc[1599] == 8
+    # The replaced snapshot is removed; the first frame still reads its mapped pages
+    assert len(os.listdir(tmp_path / '.wine_cache')) == 2
+    assert first['quality'].sum() == parsed['quality'].sum()
+
+
+@pytest.mark.parametrize("key, content_type, expected", [
+    ('winequality-red.csv', None, ('csv', None)),
+    ('winequality-red.csv.gz', None, ('csv', 'gzip')),
+    ('winequality-red.csv.zst', None, ('csv', 'zstd')),
+    ('winequality-red.parquet', 'text/csv', ('parquet', None)),
+    ('winequality-red', 'application/vnd.apache.parquet', ('parquet', None)),
+    ('winequality-red', 'application/gzip', ('csv', 'gzip')),
+])
+def test_source_format(key, content_type, expected):
+    assert source_format(key, content_type) == expected
+
+
+# === Test: gzip CSV and Parquet sources load like the plain CSV ===
+def test_load_wines_compressed_and_parquet(tmp_path):
+    red = str(tmp_path / 'winequality-red.csv.gz')
+    with open('winequality-red.csv', 'rb') as source, gzip.open(red, 'wb') as target:
+        shutil.copyfileobj(source, target)
+    white = str(tmp_path / 'winequality-white.parquet')
+    pd.read_csv('winequality-white.csv', delimiter=';').to_parquet(white, index=False)
+
+    expected = load_wines(['winequality-red.csv', 'winequality-white.csv'])
+    wine = load_wines([red, white])
+    pd.testing.assert_frame_equal(wine, expected)
+
+    projected = read_wine_parquet(white, features=['alcohol'])
+    assert list(projected.columns) == ['alcohol', 'quality']
+    assert projected['quality'].dtype == 'int8'
@@ -0,0 +1,352 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from io import BytesIO
+import numpy as np
+import pandas as pd
+
+# Input variables from section 7 of winequality.names, in file order
+FEATURES = [
+    'fixed acidity',
+    'volatile acidity',
+    'citric acid',
+    'residual sugar',
+    'chlorides',
+    'free sulfur dioxide',
+    'total sulfur dioxide',
+    'density',
+    'pH',
+    'sulphates',
+    'alcohol',
+]
+# Output variable: score between 0 and 10, fits in int8
+TARGET = 'quality'
+
+FEATURE_DTYPE = 'float32'
+QUALITY_DTYPE = 'int8'
+
+SOURCE_PREFIX = 'winequality-'
+# Wine types named by the source files (winequality-red.csv, winequality-white.csv)
+WINE_TYPES = ('red', 'white')
+
+# Accepted source suffixes -> (format, compression); longest suffix wins
+SOURCE_FORMATS = {
+    '.csv': ('csv', None),
+    '.csv.gz': ('csv', 'gzip'),
+    '.csv.zst': ('csv', 'zstd'),
+    '.parquet': ('parquet', None),
+}
+SOURCE_SUFFIXES = tuple(SOURCE_FORMATS)
+# Fallbacks for keys without a known suffix
+CONTENT_TYPE_FORMATS = {
+    'text/csv': ('csv', None),
+    'application/gzip': ('csv', 'gzip'),
+    'application/x-gzip': ('csv', 'gzip'),
+    'application/zstd': ('csv', 'zstd'),
+    'application/vnd.apache.parquet': ('parquet', None),
+    'application/x-parquet': ('parquet', None),
+}
+
+# Binary snapshots written by load_wines_cached; bump when the layout changes
+SNAPSHOT_DIR = '.wine_cache'
+SNAPSHOT_VERSION = 1
+
+
+def normalize_column(name):
+    """'fixed acidity' / '"fixed acidity"' -> 'fixed_acidity' (the winequality.csv spelling)."""
+    return name.strip().strip('"').replace(' ', '_')
+
+
+FEATURE_COLUMNS = [normalize_column(name) for name in FEATURES]
+
+
+def schema_dtypes():
+    """Dtype map covering both the spaced (red/white) and underscored (combined) headers."""
+    dtypes = {}
+    for name in FEATURES:
+        dtypes[name] = FEATURE_DTYPE
+        dtypes[normalize_column(name)] = FEATURE_DTYPE
+    dtypes[TARGET] = QUALITY_DTYPE
+    return dtypes
+
+
+SCHEMA_DTYPES = schema_dtypes()
+
+
+def default_engine():
+    try:
+        import pyarrow  # noqa: F401
+        return 'pyarrow'
+    except ImportError:
+        return 'c'
+
+
+def detect_delimiter(header):
+    """The red/white files use ';', winequality.csv uses ','."""
+    if isinstance(header, bytes):
+        header = header.decode('utf-8', errors='replace')
+    return ';' if header.count(';') > header.count(',') else ','
+
+
+def source_format(key, content_type=None, content_encoding=None):
+    """(format, compression) of a source from its key suffix, else its Content-Type/-Encoding."""
+    for suffix in sorted(SOURCE_FORMATS, key=len, reverse=True):
+        if key.endswith(suffix):
+            return SOURCE_FORMATS[suffix]
+    if content_encoding in ('gzip', 'zstd'):
+        return 'csv', content_encoding
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    return CONTENT_TYPE_FORMATS.get(content_type, ('csv', None))
+
+
+def open_decompressed(stream, compression):
+    """Wrap a binary stream so reads return decompressed bytes, decoding as data arrives."""
+    if compression is None:
+        return stream
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("Reading .zst sources requires the zstandard package")
+        return zstandard.ZstdDecompressor().stream_reader(stream)
+    raise ValueError(f"Unsupported compression: {compression}")
+
+
+def validate_columns(columns, source='source'):
+    """Check header columns against winequality.names: quality plus only known input variables."""
+    columns = [normalize_column(column) for column in columns]
+    unexpected = [column for column in columns if column not in FEATURE_COLUMNS and column != TARGET]
+    if TARGET not in columns or unexpected:
+        problems = []
+        if TARGET not in columns:
+            problems.append(f"missing '{TARGET}'")
+        if unexpected:
+            problems.append(f"unexpected columns {unexpected}")
+        raise ValueError(f"{source} does not match the winequality.names schema: {', '.join(problems)}")
+    return columns
+
+
+def wine_type_from_path(path):
+    """'data/winequality-red.csv' -> 'red'; None when the name is not one of WINE_TYPES."""
+    name = os.path.basename(path)
+    if name.startswith(SOURCE_PREFIX):
+        name = name[len(SOURCE_PREFIX):]
+    wine_type = name.split('.', 1)[0]
+    return wine_type if wine_type in WINE_TYPES else None
+
+
+def _read_header(source):
+    if isinstance(source, (bytes, bytearray)):
+        return bytes(source[:source.find(b'\n')] if b'\n' in source else source)
+    if hasattr(source, 'read'):
+        position = source.tell()
+        header = source.readline()
+        source.seek(position)
+        return header
+    with open(source, 'rb') as f:
+        return f.readline()
+
+
+def wine_type_column(wine_type, length, categories=None):
+    categories = list(categories or [wine_type])
+    codes = np.full(length, categories.index(wine_type), dtype=np.int8)
+    return pd.Categorical.from_codes(codes, categories=categories)
+
+
+def read_wine_csv(source, delimiter=None, wine_type=None, wine_types=None, engine=None, usecols=None):
+    """Read one wine-quality CSV with the compact schema.
+
+    ``source`` is a path, a bytes buffer or a seekable binary file. The delimiter
+    is sniffed from the header unless given. Columns come back in their
+    underscored form. When ``wine_type`` is given a categorical ``wine_type``
+    column is added, using ``wine_types`` as the category set if provided.
+    """
+    if delimiter is None:
+        delimiter = detect_delimiter(_read_header(source))
+    if isinstance(source, (bytes, bytearray)):
+        source = BytesIO(source)
+
+    df = pd.read_csv(
+        source,
+        delimiter=delimiter,
+        dtype=SCHEMA_DTYPES,
+        engine=engine or default_engine(),
+        usecols=usecols,
+    )
+    df.columns = [normalize_column(column) for column in df.columns]
+    if wine_type is not None:
+        df['wine_type'] = wine_type_column(wine_type, len(df), wine_types)
+    return df
+
+
+def read_wine_parquet(source, wine_type=None, wine_types=None, features=None):
+    """Read a wine-quality Parquet file with the compact schema.
+
+    With ``features`` only those columns plus ``quality`` are read (matched in
+    either spelling), so the other column chunks are never fetched from ``source``.
+    """
+    import pyarrow.parquet as pq
+    if isinstance(source, (bytes, bytearray)):
+        source = BytesIO(source)
+    parquet_file = pq.ParquetFile(source)
+    columns = None
+    if features is not None:
+        wanted = {normalize_column(name) for name in features} | {TARGET}
+        columns = [name for name in parquet_file.schema_arrow.names if normalize_column(name) in wanted]
+
+    df = parquet_file.read(columns=columns).to_pandas()
+    df = df.astype({column: dtype for column, dtype in SCHEMA_DTYPES.items() if column in df.columns})
+    df.columns = [normalize_column(column) for column in df.columns]
+    if wine_type is not None:
+        df['wine_type'] = wine_type_column(wine_type, len(df), wine_types)
+    return df
+
+
+def read_wine_file(path, wine_type=None, wine_types=None, engine=None, features=None):
+    """read_wine_csv / read_wine_parquet by the file's suffix, decompressing .gz/.zst CSVs."""
+    file_format, compression = source_format(path)
+    if file_format == 'parquet':
+        return read_wine_parquet(path, wine_type=wine_type, wine_types=wine_types, features=features)
+    if compression is not None:
+        with open(path, 'rb') as raw:
+            path = open_decompressed(raw, compression).read()
+    return read_wine_csv(path, wine_type=wine_type, wine_types=wine_types, engine=engine)
+
+
+def load_wines(paths, engine=None):
+    """Load several winequality-<type> files (CSV, compressed CSV or Parquet) into one frame."""
+    types = [wine_type_from_path(path) for path in paths]
+    wine_types = sorted({wine_type for wine_type in types if wine_type is not None})
+    frames = [
+        read_wine_file(path, wine_type=wine_type, wine_types=wine_types, engine=engine)
+        for path, wine_type in zip(paths, types)
+    ]
+    wine = pd.concat(frames, ignore_index=True)
+    if None in types:
+        # Rows from files that are not named red/white get a missing wine_type
+        column = wine['wine_type'] if 'wine_type' in wine.columns else pd.Series(index=wine.index, dtype=object)
+        wine['wine_type'] = pd.Categorical(column, categories=wine_types)
+    return wine
+
+
+def file_digest(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cached_file_digests(paths, cache_dir):
+    """Content hashes of the sources, only re-hashing files whose size or mtime changed."""
+    index_path = os.path.join(cache_dir, 'digests.json')
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        index = {}
+
+    digests = []
+    changed = False
+    for path in paths:
+        stat = os.stat(path)
+        entry = index.get(os.path.abspath(path))
+        if not entry or entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns:
+            entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'digest': file_digest(path)}
+            index[os.path.abspath(path)] = entry
+            changed = True
+        digests.append(entry['digest'])
+
+    if changed:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, staging = tempfile.mkstemp(dir=cache_dir, suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(index, f)
+        os.replace(staging, index_path)
+    return digests
+
+
+def snapshot_key(paths, digests):
+    """Key a snapshot by the content hash of every source file, in order."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f'v{SNAPSHOT_VERSION}'.encode())
+    for path, file_hash in zip(paths, digests):
+        digest.update(os.path.basename(path).encode())
+        digest.update(file_hash.encode())
+    return digest.hexdigest()
+
+
+def write_snapshot(wine, directory, sources=()):
+    """Write the frame as one (features x rows) float32 matrix plus quality and wine_type codes."""
+    features = [column for column in wine.columns if column not in (TARGET, 'wine_type')]
+    np.save(os.path.join(directory, 'features.npy'),
+            np.ascontiguousarray(wine[features].to_numpy(dtype=FEATURE_DTYPE).T))
+    np.save(os.path.join(directory, 'quality.npy'), wine[TARGET].to_numpy(dtype=QUALITY_DTYPE))
+    np.save(os.path.join(directory, 'wine_type.npy'), wine['wine_type'].cat.codes.to_numpy())
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump({'features': features, 'wine_types': list(wine['wine_type'].cat.categories),
+                   'rows': len(wine), 'sources': list(sources)}, f)
+
+
+def read_snapshot(directory):
+    """Memory-map a snapshot; the returned frame shares read-only pages with the files."""
+    with open(os.path.join(directory, 'meta.json')) as f:
+        meta = json.load(f)
+    features = np.load(os.path.join(directory, 'features.npy'), mmap_mode='r')
+    wine = pd.DataFrame(features.T, columns=meta['features'], copy=False)
+    wine[TARGET] = np.load(os.path.join(directory, 'quality.npy'), mmap_mode='r')
+    codes = np.load(os.path.join(directory, 'wine_type.npy'), mmap_mode='r')
+    wine['wine_type'] = pd.Categorical.from_codes(codes, categories=meta['wine_types'])
+    return wine
+
+
+def prune_snapshots(cache_dir, sources, keep):
+    """Remove older snapshots of the same source files once ``keep`` has replaced them.
+
+    Processes that still map a removed snapshot keep reading it; the pages stay
+    valid until they unmap. Staging directories have no meta.json yet and are left alone.
+    """
+    for name in os.listdir(cache_dir):
+        directory = os.path.join(cache_dir, name)
+        if name == keep or not os.path.isdir(directory):
+            continue
+        try:
+            with open(os.path.join(directory, 'meta.json')) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if meta.get('sources') == list(sources):
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def load_wines_cached(paths, cache_dir=None, engine=None):
+    """load_wines backed by a memory-mapped binary snapshot next to the CSVs.
+
+    The first call parses the CSVs and writes the snapshot. Later calls with
+    unchanged sources map it instead of re-parsing. The snapshot is written to
+    a temporary directory and renamed into place, so concurrent processes never
+    see a partial one and can all map the same pages. The snapshots it replaces
+    are then removed.
+    """
+    cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(paths[0])), SNAPSHOT_DIR)
+    directory = os.path.join(cache_dir, snapshot_key(paths, cached_file_digests(paths, cache_dir)))
+    if os.path.exists(os.path.join(directory, 'meta.json')):
+        return read_snapshot(directory)
+
+    wine = load_wines(paths, engine=engine)
+    sources = [os.path.abspath(path) for path in paths]
+    os.makedirs(cache_dir, exist_ok=True)
+    staging = tempfile.mkdtemp(dir=cache_dir)
+    try:
+        write_snapshot(wine, staging, sources)
+        os.rename(staging, directory)
+    except OSError:
+        # Another process published the same snapshot first
+        shutil.rmtree(staging, ignore_errors=True)
+    prune_snapshots(cache_dir, sources, keep=os.path.basename(directory))
+    return read_snapshot(directory)